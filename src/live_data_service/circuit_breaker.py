@@ -0,0 +1,106 @@
+import os
+import time
+import random
+
+FAILURE_THRESHOLD = int(os.getenv("KIA_BREAKER_FAILURES", 3))     # consecutive failures before opening
+BASE_BACKOFF = float(os.getenv("KIA_BREAKER_BACKOFF", 10))        # seconds open after the first trip
+MAX_BACKOFF = float(os.getenv("KIA_BREAKER_MAX_BACKOFF", 600))    # cap on the open period
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class UpstreamError(Exception):
+    """
+    The upstream call failed, as opposed to succeeding with no vehicles.
+    """
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    The call was not attempted because the endpoint's breaker is open.
+    """
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit '{name}' open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Per-endpoint breaker. After FAILURE_THRESHOLD consecutive failures it opens for an
+    exponentially growing, jittered period; then one trial call is let through (half-open).
+    A successful trial closes it and resets the backoff, a failed one re-opens it for longer.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = FAILURE_THRESHOLD,
+                 base_backoff: float = BASE_BACKOFF, max_backoff: float = MAX_BACKOFF):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0  # Consecutive times opened without a success in between
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.total_failures = 0
+        self.total_successes = 0
+        self.last_error = None
+
+    def retry_after(self) -> float:
+        return max(0.0, self.open_until - time.monotonic()) if self.state == OPEN else 0.0
+
+    def before_call(self):
+        """
+        Raises CircuitOpenError if the call must not go upstream right now.
+        """
+        if self.state == OPEN:
+            if time.monotonic() < self.open_until:
+                raise CircuitOpenError(self.name, self.retry_after())
+            self.state = HALF_OPEN
+            self.trial_in_flight = False
+        if self.state == HALF_OPEN:
+            if self.trial_in_flight:
+                raise CircuitOpenError(self.name, self.base_backoff)
+            self.trial_in_flight = True
+
+    def release_trial(self):
+        """
+        The call ended without an outcome (e.g. it was cancelled): let the next call be the trial instead.
+        """
+        self.trial_in_flight = False
+
+    def record_success(self):
+        if self.state != CLOSED:
+            print(f"[Breaker] {self.name} recovered after {self.trips} trip(s)")
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.trial_in_flight = False
+        self.total_successes += 1
+
+    def record_failure(self, error):
+        self.consecutive_failures += 1
+        self.total_failures += 1
+        self.last_error = str(error)
+        self.trial_in_flight = False
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self.trips += 1
+            backoff = min(self.max_backoff, self.base_backoff * 2 ** (self.trips - 1))
+            backoff = backoff / 2 + random.uniform(0, backoff / 2)  # Equal jitter: de-synchronize recovering clients
+            self.state = OPEN
+            self.open_until = time.monotonic() + backoff
+            print(f"[Breaker] {self.name} open for {backoff:.0f}s after: {error}")
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.consecutive_failures,
+            "trips": self.trips,
+            "retry_after": round(self.retry_after(), 1),
+            "total_failures": self.total_failures,
+            "total_successes": self.total_successes,
+            "last_error": self.last_error,
+        }
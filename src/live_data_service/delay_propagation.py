@@ -0,0 +1,191 @@
+"""
+Carries a trip's live delay down the rest of its stop sequence. The delay observed at the last stop
+with actual times fades with distance travelled, w = exp(-km / DELAY_DECAY_KM), towards the stop's
+historical prediction (see delay_model), or the schedule:
+
+    delay = w * observed + (1 - w) * historical
+
+Stop sequences come from client_stops, ordered by distance exactly as the static stop_times are, and
+are kept as one padded distance matrix; the model's predictions for them are kept as matrices of the same
+shape, one per hour and weekday. The blend for all the trips of a poll is then one NumPy pass. Reading the
+trips' stop_time_updates and writing the results back stays a Python loop over the protobuf messages.
+"""
+import os
+from datetime import datetime
+from typing import NamedTuple
+
+import numpy as np
+
+from src.shared import AtomicRef
+from src.shared.config import local_tz
+from src.shared.delay_model import DelayModel, current_delay_model
+from src.local_file_service.gtfs_builder import build_stops
+
+DELAY_DECAY_KM = float(os.getenv("KIA_DELAY_DECAY_KM", 10))  # km over which a live delay fades to 1/e; 0 disables
+
+
+class RouteStopIndex(NamedTuple):
+    """
+    Immutable stop sequences of every child route, rebuilt on every static data load.
+    """
+    rows: dict          # child route id -> row in distances
+    stop_ids: tuple     # per row, stop ids in sequence order
+    columns: tuple      # per row, {stop_id: position in the sequence}
+    distances: object   # float ndarray (routes, longest sequence) in km from the first stop; padded with inf
+    counts: object      # int ndarray (routes,) of stops per route
+
+
+def build_route_stop_index(client_stops: dict, routes_children: dict) -> RouteStopIndex:
+    _, stop_id_map, _ = build_stops(client_stops)
+    rows, stop_ids, columns, sequences = {}, [], [], []
+    for route_key, route_id in routes_children.items():
+        stops = (client_stops.get(route_key) or {}).get("stops")
+        if not stops:
+            continue
+        points = sorted((
+            (s["distance"], str(s["stop_id"] if "stop_id" in s else
+                                stop_id_map[(round(s["loc"][0], 6), round(s["loc"][1], 6), s["name"])]))
+            for s in stops
+        ), key=lambda point: point[0])  # Same order as build_trips_and_stop_times
+        rows[str(route_id)] = len(sequences)
+        stop_ids.append(tuple(stop_id for _, stop_id in points))
+        columns.append({stop_id: col for col, (_, stop_id) in enumerate(points)})
+        sequences.append([float(distance) for distance, _ in points])
+
+    width = max((len(sequence) for sequence in sequences), default=0)
+    distances = np.full((len(sequences), width), np.inf)
+    for row, sequence in enumerate(sequences):
+        distances[row, :len(sequence)] = sequence
+    return RouteStopIndex(
+        rows, tuple(stop_ids), tuple(columns), distances, np.array([len(s) for s in sequences], dtype=int)
+    )
+
+
+EMPTY_ROUTE_STOP_INDEX = build_route_stop_index({}, {})
+current_route_stops = AtomicRef(EMPTY_ROUTE_STOP_INDEX)  # Replaced on every static load
+
+
+class PredictedDelays:
+    """
+    The delay model's predicted delay at every stop of a RouteStopIndex, as (routes, stops) matrices in
+    seconds (0 without a prediction). One matrix per (hour, weekday) is built on first use; all are dropped
+    when the index or the model is replaced.
+    """
+
+    def __init__(self):
+        self._source = (None, None)  # (index, model) the matrices were built from
+        self._matrices = {}          # (hour, weekday) -> ndarray
+
+    def get(self, index: RouteStopIndex, model: DelayModel, hour: int, weekday: int):
+        if self._source[0] is not index or self._source[1] is not model:
+            self._source, self._matrices = (index, model), {}
+        matrix = self._matrices.get((hour, weekday))
+        if matrix is None:
+            matrix = self._matrices[(hour, weekday)] = np.zeros(index.distances.shape)
+            for route_id, row in index.rows.items():
+                for col, stop_id in enumerate(index.stop_ids[row]):
+                    predicted = model.lookup(route_id, stop_id, hour, weekday)
+                    if predicted:
+                        matrix[row, col] = predicted[0]
+        return matrix
+
+
+predicted_delays = PredictedDelays()
+
+
+def propagate_delays(trips: list, index: RouteStopIndex = None, decay_km: float = DELAY_DECAY_KM,
+                     model: DelayModel = None) -> int:
+    """
+    trips are (route_id, entity, observed) where observed maps the stop ids with actual times to their delay
+    in seconds.
+    Updates each entity's stop_time_updates after its last observed stop in place, adds the stops the
+    upstream did not return (delay only), and orders them by stop_sequence. Returns the trips updated.
+    """
+    if index is None:
+        index = current_route_stops.get()
+    if model is None:
+        model = current_delay_model.get()
+    if decay_km <= 0:
+        return 0
+
+    # Gather: one row per trip with a usable observation
+    gathered = []  # (row, last observed column, observed delay, scheduled hour, entity, {col: stop_time_update})
+    for route_id, entity, observed in trips:
+        row = index.rows.get(str(route_id))
+        if row is None or not observed:
+            continue
+        columns = index.columns[row]
+        updates = {}
+        last = -1
+        for stu in entity.trip_update.stop_time_update:
+            col = columns.get(stu.stop_id)
+            if col is None:
+                continue
+            updates[col] = stu
+            if stu.stop_id in observed and col > last:
+                last = col
+        if last < 0:
+            continue
+        # Stops the upstream did not return have no schedule: they use the hour of the last observed stop
+        last_stu = updates[last]
+        hour = datetime.fromtimestamp(last_stu.arrival.time - last_stu.arrival.delay, tz=local_tz).hour
+        gathered.append((row, last, observed[index.stop_ids[row][last]], hour, entity, updates))
+    if not gathered:
+        return 0
+
+    # Propagate every trip at once over the padded (trips, stops) distance matrix
+    trip_rows = np.array([g[0] for g in gathered])
+    last_cols = np.array([g[1] for g in gathered])
+    observed_delays = np.array([g[2] for g in gathered], dtype=float)
+    distances = index.distances[trip_rows]
+    travelled = distances - distances[np.arange(len(gathered)), last_cols][:, None]
+    weights = np.exp(-np.maximum(travelled, 0) / decay_km)  # Padding is inf -> weight 0
+
+    # Historical delay: the upstream's prediction where it returned the stop, else the model's
+    weekday = datetime.now(local_tz).isoweekday() % 7  # 0 = Sunday, as SQLite's strftime('%w')
+    historical = np.stack([
+        predicted_delays.get(index, model, hour, weekday)[row] for row, _, _, hour, _, _ in gathered
+    ])
+    returned = [(i, col, stu.arrival.delay) for i, g in enumerate(gathered) for col, stu in g[5].items()]
+    if returned:
+        trip_idx, cols, upstream = zip(*returned)
+        historical[list(trip_idx), list(cols)] = upstream
+    delays = np.rint(weights * observed_delays[:, None] + (1 - weights) * historical).astype(int)
+
+    # Scatter the results back into the trip updates
+    for i, (row, last, _, _, entity, updates) in enumerate(gathered):
+        stop_ids = index.stop_ids[row]
+        for col in range(last + 1, int(index.counts[row])):
+            stu = updates.get(col)
+            delay = int(delays[i, col])
+            if stu is None:
+                stu = updates[col] = entity.trip_update.stop_time_update.add()
+                stu.stop_id = stop_ids[col]
+                stu.arrival.delay = delay
+                continue
+            if stu.arrival.time:
+                stu.arrival.time += delay - stu.arrival.delay
+            stu.arrival.delay = delay
+            if stu.HasField("departure"):
+                stu.departure.time = max(stu.departure.time + delay - stu.departure.delay, stu.arrival.time)
+                stu.departure.delay = delay
+        _order_by_sequence(entity, updates)
+    return len(gathered)
+
+
+def _order_by_sequence(entity, updates: dict):
+    """
+    Sets stop_sequence from the route's order and sorts the updates by it, as GTFS-Realtime requires.
+    Stops not in the route's sequence keep their relative order after the known ones.
+    """
+    for col, stu in updates.items():
+        stu.stop_sequence = col + 1
+    ordered = sorted(
+        entity.trip_update.stop_time_update,
+        key=lambda stu: stu.stop_sequence if stu.stop_sequence else float("inf")
+    )
+    copies = [type(stu)() for stu in ordered]
+    for copy, stu in zip(copies, ordered):
+        copy.CopyFrom(stu)
+    del entity.trip_update.stop_time_update[:]
+    entity.trip_update.stop_time_update.extend(copies)
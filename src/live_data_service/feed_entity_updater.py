@@ -1,22 +1,142 @@
 from google.transit import gtfs_realtime_pb2
 from datetime import datetime
-from src.shared import feed_message, feed_message_lock
+from threading import Lock
+from typing import NamedTuple, Optional
+from src.shared import feed_snapshot, trip_updates_snapshot, vehicle_positions_snapshot
+from src.shared.feed_snapshot import EMPTY_INDEX, encode_feed_message
+
+
+class EncodedEntity(NamedTuple):
+    """
+    A FeedEntity serialized once, together with its TripUpdates-only and VehiclePositions-only
+    forms and its index keys. Feeds are assembled by concatenating these bytes.
+    """
+    id: str
+    body: bytes
+    trip_update: Optional[bytes]
+    vehicle: Optional[bytes]
+    keys: tuple
+
+
+def encode_entity(entity) -> EncodedEntity:
+    """
+    Encodes entity for publishing. Called once per changed entity, never per publish.
+    """
+    trip_update = vehicle = None
+    if entity.HasField("trip_update"):
+        split = gtfs_realtime_pb2.FeedEntity(id=entity.id)
+        split.trip_update.CopyFrom(entity.trip_update)
+        trip_update = split.SerializeToString()
+    if entity.HasField("vehicle"):
+        split = gtfs_realtime_pb2.FeedEntity(id=entity.id)
+        split.vehicle.CopyFrom(entity.vehicle)
+        vehicle = split.SerializeToString()
+    return EncodedEntity(entity.id, entity.SerializeToString(), trip_update, vehicle, entity_index_keys(entity))
+
+
+class FeedPublisher:
+    """
+    Publishes a feed assembled from cached entity bytes to a SnapshotStore, together with
+    its differential update and indexes. Nothing is re-encoded, so the work per publish is
+    the byte concatenation (O(entities)) plus the changed entities and their index keys.
+    With only_on_change, an update whose entities are byte-identical to the last publish is skipped,
+    so the store's version (and clients' ETags) only move when the content does.
+    """
+
+    def __init__(self, store, only_on_change: bool = False):
+        self.store = store
+        self.only_on_change = only_on_change
+        # entity id -> serialized FeedEntity as of the last publish, used to compute differential updates
+        self.published_entities = {}
+        # Route/trip/vehicle indexes of the last publish, maintained incrementally from the diff
+        self.index = EMPTY_INDEX
+
+    def publish(self, header: bytes, timestamp: int, current: dict, keys: dict):
+        """
+        current maps entity id -> serialized FeedEntity, in feed order; keys maps entity id -> index keys.
+        """
+        if self.only_on_change and current == self.published_entities:
+            return None
+
+        changed_keys = {
+            entity_id: keys[entity_id]
+            for entity_id, body in current.items()
+            if self.published_entities.get(entity_id) != body
+        }
+        deleted = [entity_id for entity_id in self.published_entities if entity_id not in current]
+        diff = encode_feed_message(
+            differential_header(timestamp),
+            [current[entity_id] for entity_id in changed_keys] + [deleted_marker(entity_id) for entity_id in deleted]
+        )
+
+        self.index = self.index.updated(header, current, changed_keys, deleted)
+        self.published_entities = current
+
+        return self.store.publish(encode_feed_message(header, current.values()), timestamp, diff, self.index)
+
+
+feed_publisher = FeedPublisher(feed_snapshot)
+trip_updates_publisher = FeedPublisher(trip_updates_snapshot, only_on_change=True)
+vehicle_positions_publisher = FeedPublisher(vehicle_positions_snapshot, only_on_change=True)
+publish_lock = Lock()
 
 
 def update_feed_message(entities: list):
     """
-    Overwrites the shared GTFS-RT FeedMessage with new data.
-    """
-    with feed_message_lock:
-        feed_message.Clear()
-
-        # Build new header
-        feed_message.header.gtfs_realtime_version = "2.0"
-        feed_message.header.timestamp = int(datetime.now().timestamp())
-        ids = set()
-        # Add entities
-        for entity in entities:
-            if entity.id in ids: # Prevent duplicates
-                continue
-            ids.add(entity.id)
-            feed_message.entity.append(entity)
+    Publishes the combined feed of entities (EncodedEntity, or FeedEntity which is encoded here),
+    then the TripUpdates and VehiclePositions feeds split out of it, each only when its part changed.
+    Feeds are concatenated from the entities' cached bytes rather than re-serialized.
+    """
+    header = gtfs_realtime_pb2.FeedHeader(gtfs_realtime_version="2.0", timestamp=int(datetime.now().timestamp()))
+    header_bytes = header.SerializeToString()
+
+    full, trip_updates, vehicle_positions, keys = {}, {}, {}, {}
+    for entity in entities:
+        if not isinstance(entity, EncodedEntity):
+            entity = encode_entity(entity)
+        if entity.id in full:  # Prevent duplicates
+            continue
+        full[entity.id] = entity.body
+        keys[entity.id] = entity.keys
+        if entity.trip_update is not None:
+            trip_updates[entity.id] = entity.trip_update
+        if entity.vehicle is not None:
+            vehicle_positions[entity.id] = entity.vehicle
+
+    with publish_lock:
+        feed_publisher.publish(header_bytes, header.timestamp, full, keys)
+        trip_updates_publisher.publish(header_bytes, header.timestamp, trip_updates, keys)
+        vehicle_positions_publisher.publish(header_bytes, header.timestamp, vehicle_positions, keys)
+
+
+def entity_index_keys(entity) -> tuple:
+    """
+    Returns the (field, value) pairs an entity can be filtered by.
+    """
+    if entity.HasField("trip_update"):
+        trip, vehicle = entity.trip_update.trip, entity.trip_update.vehicle
+    elif entity.HasField("vehicle"):
+        trip, vehicle = entity.vehicle.trip, entity.vehicle.vehicle
+    else:
+        return ()
+
+    keys = []
+    if trip.route_id:
+        keys.append(("route_id", trip.route_id))
+    if trip.trip_id:
+        keys.append(("trip_id", trip.trip_id))
+    if vehicle.id:
+        keys.append(("vehicle_id", vehicle.id))
+    return tuple(keys)
+
+
+def differential_header(timestamp: int) -> bytes:
+    return gtfs_realtime_pb2.FeedHeader(
+        gtfs_realtime_version="2.0",
+        incrementality=gtfs_realtime_pb2.FeedHeader.DIFFERENTIAL,
+        timestamp=timestamp,
+    ).SerializeToString()
+
+
+def deleted_marker(entity_id: str) -> bytes:
+    return gtfs_realtime_pb2.FeedEntity(id=entity_id, is_deleted=True).SerializeToString()
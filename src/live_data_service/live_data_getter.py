@@ -1,6 +1,12 @@
 import os
+import json
+import time
+import asyncio
 import aiohttp
 
+from src.shared import status_providers
+from src.live_data_service.circuit_breaker import CircuitBreaker, UpstreamError
+
 KIA_API_BASE = os.getenv("KIA_BMTC_API_URL", "https://bmtcmobileapi.karnataka.gov.in/WebAPI")
 HEADERS = {
     'Accept': 'application/json, text/plain, */*',
@@ -10,33 +16,106 @@ HEADERS = {
     'deviceType': 'WEB',
 }
 
+CONNECT_TIMEOUT = float(os.getenv("KIA_UPSTREAM_CONNECT_TIMEOUT", 5))   # seconds, TCP + TLS
+READ_TIMEOUT = float(os.getenv("KIA_UPSTREAM_READ_TIMEOUT", 10))        # seconds between reads
+CONNECTIONS_PER_HOST = int(os.getenv("KIA_UPSTREAM_CONNECTIONS", 8))
+KEEPALIVE_TIMEOUT = float(os.getenv("KIA_UPSTREAM_KEEPALIVE", 60))      # seconds an idle connection is kept
+DNS_CACHE_TTL = int(os.getenv("KIA_UPSTREAM_DNS_TTL", 300))             # seconds
+RECORD_DIR = os.getenv("KIA_RECORD_DIR")  # When set, every upstream response is saved here for the simulator's replay mode
+
+# One breaker per upstream endpoint, exposed through the status endpoint
+breakers = {"SearchByRouteDetails_v4": CircuitBreaker("SearchByRouteDetails_v4")}
+status_providers["upstream_breakers"] = lambda: {name: b.snapshot() for name, b in breakers.items()}
+
+# One session per event loop, reused by every poll so connections and TLS sessions stay warm
+_session = None
+_session_loop = None
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the long-lived upstream session, creating it on the running loop if needed.
+    """
+    global _session, _session_loop
+    loop = asyncio.get_running_loop()
+    if _session is None or _session.closed or _session_loop is not loop:
+        connector = aiohttp.TCPConnector(
+            limit_per_host=CONNECTIONS_PER_HOST,
+            ttl_dns_cache=DNS_CACHE_TTL,
+            keepalive_timeout=KEEPALIVE_TIMEOUT,
+        )
+        _session = aiohttp.ClientSession(
+            connector=connector,
+            headers=HEADERS,
+            timeout=aiohttp.ClientTimeout(total=None, connect=CONNECT_TIMEOUT, sock_read=READ_TIMEOUT),
+        )
+        _session_loop = loop
+    return _session
+
+
+async def close_session():
+    global _session, _session_loop
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+    _session_loop = None
+
+
+def record_response(parent_id: int, json_data: dict):
+    """
+    Saves a raw response as <parent_id>_<epoch ms>.json, the naming the simulator's replay mode expects.
+    """
+    os.makedirs(RECORD_DIR, exist_ok=True)
+    path = os.path.join(RECORD_DIR, f"{parent_id}_{int(time.time() * 1000)}.json")
+    tmp_path = f"{path}.tmp"  # Renamed into place so a replay reading the directory never sees half a file
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(json_data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
 async def fetch_route_data(parent_id: int) -> list:
+    """
+    Returns the combined up/down stop data for parent_id, or [] when the API reports nothing.
+    Raises UpstreamError when the call fails or the endpoint's breaker is open,
+    so callers can tell an outage apart from a route with no vehicles.
+    """
     url = f"{KIA_API_BASE}/SearchByRouteDetails_v4"
     payload = {
         "routeid": parent_id,
         "servicetypeid": 0
     }
+    breaker = breakers["SearchByRouteDetails_v4"]
+    breaker.before_call()
 
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.post(url, json=payload, headers=HEADERS, timeout=10) as resp:
-                if resp.status != 200:
-                    print(f"[Getter] Error {resp.status} for parent_id {parent_id}")
-                    return []
+        session = get_session()
+        async with session.post(url, json=payload) as resp:
+            if resp.status != 200:
+                raise UpstreamError(f"HTTP {resp.status} for parent_id {parent_id}")
 
-                json_data = await resp.json()
+            json_data = await resp.json()
+    except UpstreamError as e:
+        breaker.record_failure(e)
+        raise
+    except Exception as e:
+        breaker.record_failure(e)
+        raise UpstreamError(f"Exception fetching live data for route {parent_id}: {e!r}") from e
+    except BaseException:
+        breaker.release_trial()  # Cancelled mid-call: a half-open trial must not stay in flight forever
+        raise
+    breaker.record_success()
 
-                if not json_data.get("issuccess", False):
-                    print(f"[Getter] API error: {json_data.get('message')}")
-                    return []
+    if RECORD_DIR:
+        # Disk writes stay off the event loop so recording does not skew the timings being captured
+        asyncio.get_running_loop().run_in_executor(None, record_response, parent_id, json_data)
 
-                combined_data = []
-                for direction in ["up", "down"]:
-                    if direction in json_data:
-                        combined_data.extend(json_data[direction].get("data", []))
+    if not json_data.get("issuccess", False):
+        print(f"[Getter] API error: {json_data.get('message')}")
+        return []
 
-                return combined_data
+    combined_data = []
+    for direction in ["up", "down"]:
+        if direction in json_data:
+            combined_data.extend(json_data[direction].get("data", []))
 
-    except Exception as e:
-        print(f"[Getter] Exception fetching live data for route {parent_id}: {e}")
-        return []
+    return combined_data
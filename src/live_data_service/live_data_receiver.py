@@ -1,94 +1,213 @@
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import os
 import asyncio
+import threading
 
-from src.shared import scheduled_timings, routes_children, routes_parent, start_times
-from src.live_data_service.live_data_getter import fetch_route_data
-from src.live_data_service.live_data_transformer import transform_response_to_feed_entities
-from src.live_data_service.feed_entity_updater import update_feed_message
-from src.shared.utils import generate_trip_id_timing_map
+from src.shared import scheduled_timings, status_providers
+from src.shared.trip_index import current_trip_index
+from src.live_data_service.live_data_getter import close_session, breakers
+from src.live_data_service.circuit_breaker import UpstreamError
+from src.live_data_service.upstream_dispatcher import (
+    get_dispatcher, close_dispatcher, PRIORITY_ACTIVE, PRIORITY_PROBE
+)
+from src.live_data_service.live_data_transformer import transform_jobs
+from src.live_data_service.live_feed_store import live_store
+from src.live_data_service.feed_entity_updater import update_feed_message, encode_entity
 
 
-# Set of active parent_ids currently being polled
-active_parents = set()
+# Active parent_ids currently being polled -> end of the latest session dispatched for them
+active_parents = {}
+POLL_INTERVAL = 20  # seconds
+TRIP_EARLY_MARGIN = int(os.getenv("KIA_TRIP_EARLY_MARGIN", 15))  # minutes before a trip's start it is matched
+TRIP_LATE_MARGIN = int(os.getenv("KIA_TRIP_LATE_MARGIN", 60))    # minutes after its scheduled end
+
+# Feeds are assembled and compressed on this thread, off the event loop; one worker keeps publishes in order
+publish_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feed_publisher")
+publish_queued = False
+
+# Polls whose payload matched the previous one for the same parent are skipped before transformation
+poll_stats = {"processed": 0, "skipped": 0}
+status_providers["live_polls"] = lambda: dict(poll_stats)
+status_providers["live_scheduler"] = lambda: dict(scheduled_timings.stats, pending=scheduled_timings.qsize())
 
 
 async def live_data_receiver_loop():
     """
-    Consumes scheduled_timings queue and starts polling tasks for each unique parent_id.
+    Sleeps on scheduled_timings until jobs are due and starts polling tasks for each unique parent_id.
     Ensures only one polling task per parent_id at a time.
+    Owns the upstream HTTP session and dispatcher shared by all polls and closes them when the loop ends.
+    """
+    expiry = asyncio.create_task(expire_live_entities())
+    try:
+        await scheduled_timings.run(dispatch_due_jobs)
+    finally:
+        expiry.cancel()
+        await close_dispatcher()
+        await close_session()
+
+
+class ReceiverThread:
+    """
+    Runs live_data_receiver_loop on its own event loop in a background thread. stop() cancels the loop
+    from the calling thread and waits for it, so the loop's cleanup closes the dispatcher and session.
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._task = None
+        self._started = threading.Event()
+        self._thread = threading.Thread(target=lambda: asyncio.run(self._main()), name="live_data_receiver", daemon=True)
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.current_task()
+        self._started.set()
+        try:
+            await live_data_receiver_loop()
+        except asyncio.CancelledError:
+            print("[Receiver] Stopped")
+
+    def stop(self, timeout: float = 10) -> bool:
+        """
+        Returns whether the receiver finished within timeout.
+        """
+        if self._task is not None:
+            try:
+                self._loop.call_soon_threadsafe(self._task.cancel)
+            except RuntimeError:
+                pass  # Loop already closed
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+
+def publish_live_feed():
+    """
+    Queues a publish of live_store on publish_executor. Calls made while one is still queued are
+    folded into it, since it reads live_store only when it runs.
+    """
+    global publish_queued
+    if publish_queued:
+        return
+    publish_queued = True
+    publish_executor.submit(run_publish)
+
+
+def run_publish():
+    global publish_queued
+    publish_queued = False  # Before reading: later changes queue another publish
+    try:
+        update_feed_message(live_store.entities())
+    except Exception as e:
+        print(f"[Receiver] Publishing the live feed failed: {e}")
+
+
+async def expire_live_entities():
+    """
+    Republishes the feed when partitions of pollers that stopped refreshing them go stale.
     """
     while True:
-        if scheduled_timings.empty():
-            await asyncio.sleep(1)
-            continue
+        await asyncio.sleep(live_store.ttl / 4)
+        if live_store.expire():
+            publish_live_feed()
 
-        scheduled_time, job = scheduled_timings.queue[0]  # Peek without removing
 
-        now = datetime.now()
-        if now >= scheduled_time:
-            _, job = scheduled_timings.get()  # Now remove
-            parent_id = job["parent_id"]
+def dispatch_due_jobs(due: list):
+    for _, session in due:
+        parent_id = session["parent_id"]
 
-            if parent_id in active_parents:
-                continue  # Already polling this parent
+        if parent_id in active_parents:
+            # Already polling this parent: stretch the running task to cover this session too
+            active_parents[parent_id] = max(active_parents[parent_id], session["end"])
+            continue
 
-            active_parents.add(parent_id)
-            asyncio.create_task(poll_route_parent_until_done(parent_id))
-        else:
-            await asyncio.sleep(1)
+        active_parents[parent_id] = session["end"]
+        asyncio.create_task(poll_route_parent_until_done(parent_id))
 
 
 async def poll_route_parent_until_done(parent_id: int):
     """
-    Polls the BMTC API every 20s for a given route parent_id.
-    Stops after 2 consecutive polls return no matching live trip data.
+    Polls the BMTC API every 20s for a given route parent_id until its session ends.
+    After that it stops once 2 consecutive polls return no matching live trip data, so late buses are still followed.
+    Upstream failures don't count as empty polls: the task backs off with the breaker and keeps its session.
+    A payload identical to the previous poll's (see payload_fingerprint) is not transformed again; it keeps that poll's outcome.
     """
-    child_routes = routes_children.as_dict()
-    start_time_data = start_times.as_dict()
-    trip_map = generate_trip_id_timing_map(start_time_data, child_routes)
-
     print(f"[Polling] Started polling for parent_id={parent_id}")
     empty_tries = 0
     MAX_EMPTY_TRIES = 2
+    priority = PRIORITY_PROBE
+    last_fingerprint = None
+    last_found_match = False
 
     while True:
-        data = await fetch_route_data(parent_id)
+        try:
+            data = await get_dispatcher().fetch(parent_id, priority)
+        except UpstreamError as e:
+            retry_in = max(POLL_INTERVAL, breakers["SearchByRouteDetails_v4"].retry_after())
+            print(f"[Polling] [{datetime.now().strftime('%d-%m %H:%M:%S')}] Upstream unavailable for parent_id={parent_id}: {e}. Retrying in {retry_in:.0f}s")
+            await asyncio.sleep(retry_in)
+            continue
 
-        if not data:
+        fingerprint = payload_fingerprint(data)
+        if data and fingerprint == last_fingerprint:
+            # Same vehicles, refresh times and actuals as last poll: transforming again would publish the same feed
+            poll_stats["skipped"] += 1
+            live_store.touch(parent_id)
+            empty_tries = 0 if last_found_match else empty_tries + 1
+        elif not data:
             print(f"[Polling] [{datetime.now().strftime('%d-%m %H:%M:%S')}] No data for parent_id={parent_id}")
             empty_tries += 1
         else:
-            matching_jobs = []
-            for route_key, child_id in child_routes.items():
-                if routes_parent.get(route_key) != parent_id:
-                    continue
-
-                for trip_entry in trip_map.get(route_key, []):
-                    matching_jobs.append({
-                        "trip_id": trip_entry["trip"],
-                        "trip_time": datetime.strptime(trip_entry['start'], "%H:%M:%S"),
-                        "route_id": str(child_id),
-                        "parent_id": parent_id
-                    })
-
-            found_match = False
-            all_entities = []
-
-            for job in matching_jobs:
-                entities = transform_response_to_feed_entities(data, job)
-                if entities:
-                    found_match = True
-                    all_entities.extend(entities)
-
+            poll_stats["processed"] += 1
+            now = datetime.now()
+            trips = current_trip_index.get().candidates(parent_id, now.hour * 60 + now.minute, TRIP_EARLY_MARGIN, TRIP_LATE_MARGIN)
+            matching_jobs = [
+                {"trip_id": trip.trip_id, "trip_time": trip.trip_time, "route_id": trip.route_id, "parent_id": parent_id}
+                for trip in trips
+            ]
+
+            # Only this parent's partition is replaced; trips no longer matched leave the feed with it
+            # Entities are encoded once here; publishes reuse the bytes until the trip changes again
+            matched = {trip_id: encode_entity(entity) for trip_id, entity in transform_jobs(data, matching_jobs).items()}
+            if live_store.replace(parent_id, matched):
+                publish_live_feed()
+
+            found_match = bool(matched)
             if found_match:
-                update_feed_message(all_entities)
                 empty_tries = 0
             else:
                 empty_tries += 1
+            last_found_match = found_match
+        last_fingerprint = fingerprint
+
+        # Parents with live vehicles go first when the upstream budget is tight
+        priority = PRIORITY_ACTIVE if empty_tries == 0 else PRIORITY_PROBE
 
-        if empty_tries >= MAX_EMPTY_TRIES:
+        if empty_tries >= MAX_EMPTY_TRIES and datetime.now() >= active_parents[parent_id]:
             print(f"[Polling] [{datetime.now().strftime('%d-%m %H:%M:%S')}] No matches after {MAX_EMPTY_TRIES} tries. Stopping {parent_id}.")
-            active_parents.remove(parent_id)
+            active_parents.pop(parent_id)
+            if live_store.drop(parent_id):
+                publish_live_feed()
             break
 
-        await asyncio.sleep(20)
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+def payload_fingerprint(data: list) -> int:
+    """
+    Hashes the parts of a response the transformer depends on: which vehicles are at which stations,
+    when each was last refreshed and its actual arrival/departure times.
+    """
+    return hash(tuple(
+        (
+            station.get("routeid"), station.get("stationid"), vehicle.get("vehicleid"),
+            vehicle.get("lastrefreshon"), vehicle.get("actual_arrivaltime"), vehicle.get("actual_departuretime"),
+        )
+        for station in data
+        for vehicle in station.get("vehicleDetails", [])
+    ))
@@ -2,12 +2,16 @@ import os
 import time
 from datetime import datetime, timedelta
 from src.shared.utils import generate_trip_id_timing_map
-from src.shared import scheduled_timings, start_times, routes_children, routes_parent
+from src.shared import scheduled_timings, start_times, routes_children, routes_parent, status_providers
+from src.shared.trip_index import build_trip_index, current_trip_index
 import traceback
 
 QUERY_INTERVAL = int(os.getenv("KIA_QUERY_INTERVAL", 5))  # minutes
 QUERY_AMOUNT = int(os.getenv("KIA_QUERY_AMOUNT", 2))      # before/after count
-TOTAL_QUERIES = 2 * QUERY_AMOUNT + 1                      # total per trip
+
+# Handles of the sessions put on scheduled_timings by the last populate_schedule()
+planned_sessions = []
+status_providers["polling_plan"] = lambda: polling_plan()
 
 def schedule_thread():
     now = datetime.now()
@@ -30,11 +34,18 @@ def schedule_thread():
             time.sleep(30)
 
 def populate_schedule():
+    """
+    Plans one polling session per parent route: the union of every trip's
+    [start - QUERY_AMOUNT*QUERY_INTERVAL, start + QUERY_AMOUNT*QUERY_INTERVAL] window,
+    with overlapping windows merged. Sessions left over from the previous plan are cancelled.
+    Also rebuilds the trip index the pollers use to find the trips running at a given time.
+    """
+    current_trip_index.set(build_trip_index(start_times, routes_children, routes_parent))
     trip_map = generate_trip_id_timing_map(start_times, routes_children)
     today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-    tomorrow = today + timedelta(days=1)
-    queried_times = set()
+    margin = timedelta(minutes=QUERY_AMOUNT * QUERY_INTERVAL)
 
+    windows = {}  # parent_id -> [(start, end, trip)]
     for route_key, trips in trip_map.items():
         child_id = routes_children.get(route_key)
         parent_id = routes_parent.get(route_key)
@@ -48,20 +59,40 @@ def populate_schedule():
             if trip_time <= datetime.now():
                 trip_time += timedelta(days=1)
 
-            for offset in range(-QUERY_AMOUNT, QUERY_AMOUNT + 1):
-                query_time = trip_time + timedelta(minutes=offset * QUERY_INTERVAL)
-                if today <= query_time < tomorrow + timedelta(days=1):
-                    while query_time in queried_times:
-                        query_time += timedelta(seconds=1)
-                    queried_times.add(query_time)
-                    scheduled_timings.put(
-                        (
-                            query_time,
-                            {
-                                "trip_id": trip_entry["trip"],
-                                "trip_time": trip_time,
-                                "route_id": str(child_id),
-                                "parent_id": int(parent_id)
-                            }
-                        )
-                    )
+            trip = {"trip_id": trip_entry["trip"], "trip_time": trip_time, "route_id": str(child_id)}
+            windows.setdefault(int(parent_id), []).append((trip_time - margin, trip_time + margin, trip))
+
+    sessions = []
+    for parent_id, parent_windows in windows.items():
+        parent_windows.sort(key=lambda window: window[0])
+        session = None
+        for window_start, window_end, trip in parent_windows:
+            if session is None or window_start > session["end"]:
+                session = {"parent_id": parent_id, "start": window_start, "end": window_end, "trips": []}
+                sessions.append(session)
+            session["end"] = max(session["end"], window_end)
+            session["trips"].append(trip)
+
+    for handle in planned_sessions:
+        scheduled_timings.cancel(handle)
+    planned_sessions.clear()
+    sessions.sort(key=lambda session: session["start"])
+    for session in sessions:
+        planned_sessions.append(scheduled_timings.put((session["start"], session)))
+    print(f"[Scheduler] Planned {len(sessions)} polling sessions for {len(windows)} parent routes")
+
+
+def polling_plan() -> list:
+    """
+    The sessions of the current plan, for the status endpoint.
+    """
+    return [
+        {
+            "parent_id": handle.job["parent_id"],
+            "start": handle.job["start"].isoformat(),
+            "end": handle.job["end"].isoformat(),
+            "trips": [trip["trip_id"] for trip in handle.job["trips"]],
+            "pending": not handle.cancelled,
+        }
+        for handle in list(planned_sessions)
+    ]
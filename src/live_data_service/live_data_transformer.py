@@ -1,53 +1,113 @@
 from google.transit import gtfs_realtime_pb2
 from datetime import datetime, timedelta
-import pytz
+from bisect import bisect_left, bisect_right
+from src.shared.config import local_tz
 from src.shared.db import insert_vehicle_data, insert_vehicle_position
+from src.shared.delay_model import current_delay_model
+from src.live_data_service.delay_propagation import propagate_delays
+from src.live_data_service.shape_matching import match_vehicles
 from datetime import date
 
 
-from src.shared import ThreadSafeDict
-
-local_tz = pytz.timezone("Asia/Kolkata")
-all_entities = ThreadSafeDict()
+MATCH_WINDOW = 2  # minutes between a vehicle's sch_tripstarttime and a scheduled trip start
 
 
 def transform_response_to_feed_entities(api_data: list, job: dict) -> list:
-    route_id = job["route_id"]
-    trip_time = job["trip_time"]
-    trip_id = job["trip_id"]
-    match_window = timedelta(minutes=2)
-
-    vehicle_groups = {}
-
-    for stop in api_data:
-        if str(stop.get("routeid")) != str(route_id):
+    """
+    Single-job form of transform_jobs, returning the entities matched to job's trip.
+    """
+    return list(transform_jobs(api_data, [job]).values())
+
+
+def transform_jobs(api_data: list, jobs: list) -> dict:
+    """
+    Matches the vehicles in one upstream payload to the given jobs' trips in a single pass.
+    Returns {trip_id: entity} for the trips that matched.
+
+    Records are grouped by (routeid, vehicleid, sch_tripstarttime), then each group goes to the
+    job of the same route whose start is nearest within MATCH_WINDOW. A trip claimed by several
+    vehicles keeps the closest one.
+    """
+    groups = group_vehicle_records(api_data)
+
+    jobs_by_route = {}
+    for job in jobs:
+        trip_time = job["trip_time"]
+        jobs_by_route.setdefault(str(job["route_id"]), []).append((trip_time.hour * 60 + trip_time.minute, job))
+    starts_by_route = {}
+    for route_id, route_jobs in jobs_by_route.items():
+        route_jobs.sort(key=lambda entry: entry[0])
+        starts_by_route[route_id] = [minute for minute, _ in route_jobs]
+
+    best = {}  # trip_id -> (distance, job, bundle)
+    for (route_id, _, _), bundle in groups.items():
+        starts = starts_by_route.get(route_id)
+        if starts is None:
             continue
-
-        vehicle_list = stop.get("vehicleDetails", [])
-        for vehicle in vehicle_list:
-            vehicle_id = str(vehicle.get("vehicleid"))
-            if not vehicle_id:
-                continue
-
+        minute = bundle["start_minute"]
+        low = bisect_left(starts, minute - MATCH_WINDOW)
+        high = bisect_right(starts, minute + MATCH_WINDOW)
+        if low == high:
+            continue
+        distance, job = min(
+            ((abs(start - minute), job) for start, job in jobs_by_route[route_id][low:high]),
+            key=lambda candidate: candidate[0]
+        )
+        trip_id = job["trip_id"]
+        if trip_id not in best or distance <= best[trip_id][0]:
+            best[trip_id] = (distance, job, bundle)
+
+    entities = {
+        trip_id: build_feed_entity(bundle["vehicle"], trip_id, job["route_id"], bundle["stops"])
+        for trip_id, (_, job, bundle) in best.items()
+    }
+    # Carry each trip's live delay down its remaining stops, all trips of the poll at once
+    propagate_delays([
+        (job["route_id"], entities[trip_id], observed_delays(entities[trip_id], bundle["stops"]))
+        for trip_id, (_, job, bundle) in best.items()
+    ])
+    # Snap the vehicles onto their route shapes, one vectorized projection per shape
+    match_vehicles(entities, {trip_id: job["route_id"] for trip_id, (_, job, _) in best.items()})
+    return entities
+
+
+def observed_delays(entity, stops: list) -> dict:
+    """
+    {stop_id: delay in seconds} of the stops with actual times: the departure delay once the vehicle
+    has left the stop, else the arrival delay.
+    """
+    departed = {
+        str(stop.get("stationid", "")): bool(stop.get("actual_departuretime"))
+        for stop in stops if stop.get("actual_arrivaltime")
+    }
+    return {
+        stu.stop_id: stu.departure.delay if departed[stu.stop_id] else stu.arrival.delay
+        for stu in entity.trip_update.stop_time_update if stu.stop_id in departed
+    }
+
+
+def group_vehicle_records(api_data: list) -> dict:
+    """
+    One pass over the payload: {(routeid, vehicleid, sch_tripstarttime): {"vehicle", "start_minute", "stops"}},
+    where stops are the station records carrying that vehicle's per-stop schedule and actual times.
+    """
+    groups = {}
+    for stop in api_data:
+        route_id = str(stop.get("routeid"))
+        for vehicle in stop.get("vehicleDetails", []):
+            vehicle_id = vehicle.get("vehicleid")
             sch_time_str = vehicle.get("sch_tripstarttime")
-            if not sch_time_str:
-                continue
-
-            try:
-                hh, mm = map(int, sch_time_str.split(":"))
-                sch_trip_time = trip_time.replace(hour=hh, minute=mm, second=0, microsecond=0)
-            except Exception:
-                continue
-
-            if abs(sch_trip_time - trip_time) > match_window:
+            if vehicle_id in (None, "") or not sch_time_str:
                 continue
 
-            # Initialize group if needed
-            if vehicle_id not in vehicle_groups:
-                vehicle_groups[vehicle_id] = {
-                    "vehicle": vehicle,
-                    "stops": []
-                }
+            key = (route_id, str(vehicle_id), sch_time_str)
+            bundle = groups.get(key)
+            if bundle is None:
+                try:
+                    hh, mm = map(int, sch_time_str.split(":"))
+                except ValueError:
+                    continue
+                bundle = groups[key] = {"vehicle": vehicle, "start_minute": hh * 60 + mm, "stops": []}
 
             # Copy per-stop schedule into stop structure
             stop_copy = stop.copy()
@@ -55,13 +115,8 @@ def transform_response_to_feed_entities(api_data: list, job: dict) -> list:
             stop_copy["sch_departuretime"] = vehicle.get("sch_departuretime")
             stop_copy["actual_arrivaltime"] = vehicle.get("actual_arrivaltime")
             stop_copy["actual_departuretime"] = vehicle.get("actual_departuretime")
-            vehicle_groups[vehicle_id]["stops"].append(stop_copy)
-    all_entities.pop(trip_id)
-    # Step 2: Build GTFS-RT FeedEntities (one per vehicle)
-    for vehicle_id, bundle in vehicle_groups.items():
-        entity = build_feed_entity(bundle["vehicle"], trip_id, route_id, bundle["stops"])
-        all_entities[trip_id] = entity
-    return all_entities.values()
+            bundle["stops"].append(stop_copy)
+    return groups
 
 
 def build_feed_entity(vehicle: dict, trip_id: str, route_id: str, stops: list):
@@ -74,6 +129,8 @@ def build_feed_entity(vehicle: dict, trip_id: str, route_id: str, stops: list):
     trip_update.vehicle.id = str(vehicle["vehicleid"])
     trip_update.vehicle.label = vehicle.get("vehiclenumber", "")
 
+    delay_model = current_delay_model.get()
+    weekday = datetime.now(local_tz).isoweekday() % 7  # 0 = Sunday, as SQLite's strftime('%w')
     for stop in stops:
         stop_id = str(stop.get("stationid", ""))
         sch_arr = parse_local_time(stop.get("sch_arrivaltime"))
@@ -88,13 +145,24 @@ def build_feed_entity(vehicle: dict, trip_id: str, route_id: str, stops: list):
         stu.stop_id = stop_id
 
         stu.arrival.time = act_arr if act_arr else sch_arr
+        predicted = None
         if act_arr:
             stu.arrival.delay = int(act_arr - sch_arr)
+        else:
+            # Not reached yet: shift the schedule by this stop's typical delay at this hour and weekday
+            hour = int(stop["sch_arrivaltime"].split(":")[0])
+            predicted = delay_model.lookup(str(route_id), stop_id, hour, weekday)
+            if predicted:
+                stu.arrival.delay, stu.arrival.uncertainty = predicted
+                stu.arrival.time = sch_arr + predicted[0]
 
         if sch_dep:
             stu.departure.time = act_dep if act_dep else sch_dep
             if act_dep:
                 stu.departure.delay = int(act_dep - sch_dep)
+            elif predicted:
+                stu.departure.delay, stu.departure.uncertainty = predicted
+                stu.departure.time = max(sch_dep + predicted[0], stu.arrival.time)
 
     if stops:
         last_stop = stops[-1]
@@ -0,0 +1,86 @@
+import os
+import time
+from threading import Lock
+
+from src.shared import status_providers
+
+ENTITY_TTL = float(os.getenv("KIA_LIVE_ENTITY_TTL", 180))  # seconds an entity survives without a fresh poll
+
+
+class LiveFeedStore:
+    """
+    Live entities partitioned by parent route, then trip. Each poll replaces only its own parent's
+    partition; a partition not refreshed within the TTL expires, so vehicles of a poller that
+    died or lost upstream don't stay in the feed. The published feed is the merge of all partitions.
+    """
+
+    def __init__(self, ttl: float = ENTITY_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._partitions = {}  # parent_id -> {trip_id: entity}
+        self._expires_at = {}  # parent_id -> clock deadline
+        self.stats = {"replaced": 0, "expired": 0}
+
+    def replace(self, parent_id: int, entities: dict) -> bool:
+        """
+        Sets parent_id's partition to {trip_id: entity}. Returns whether the feed changed.
+        """
+        with self._lock:
+            previous = self._partitions.pop(parent_id, {})
+            self._expires_at.pop(parent_id, None)
+            if entities:
+                self._partitions[parent_id] = dict(entities)
+                self._expires_at[parent_id] = self._clock() + self.ttl
+            self.stats["replaced"] += 1
+            return previous != entities
+
+    def touch(self, parent_id: int):
+        """
+        Extends parent_id's partition after a poll that confirmed it unchanged.
+        """
+        with self._lock:
+            if parent_id in self._expires_at:
+                self._expires_at[parent_id] = self._clock() + self.ttl
+
+    def drop(self, parent_id: int) -> bool:
+        return self.replace(parent_id, {})
+
+    def expire(self) -> bool:
+        """
+        Removes partitions past their TTL. Returns whether any were removed.
+        """
+        now = self._clock()
+        with self._lock:
+            expired = [parent_id for parent_id, deadline in self._expires_at.items() if deadline <= now]
+            for parent_id in expired:
+                del self._partitions[parent_id]
+                del self._expires_at[parent_id]
+            self.stats["expired"] += len(expired)
+        for parent_id in expired:
+            print(f"[LiveStore] Expired stale entities of parent_id={parent_id}")
+        return bool(expired)
+
+    def entities(self) -> list:
+        """
+        Every live entity, expired partitions excluded, in a stable (parent, trip) order.
+        """
+        self.expire()
+        with self._lock:
+            return [
+                self._partitions[parent_id][trip_id]
+                for parent_id in sorted(self._partitions)
+                for trip_id in sorted(self._partitions[parent_id])
+            ]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(
+                self.stats,
+                partitions=len(self._partitions),
+                entities=sum(len(partition) for partition in self._partitions.values()),
+            )
+
+
+live_store = LiveFeedStore()
+status_providers["live_store"] = live_store.snapshot
@@ -0,0 +1,193 @@
+"""
+Matches vehicle positions to their route's shape, reporting how far along it each trip is. Each shape from routelines.json is precomputed once per
+static load into NumPy arrays of segment start points and vectors in a local metric plane, plus the
+distance travelled at every segment start. A poll's vehicles are then grouped by route and projected
+with one vectorized call per shape: every vehicle against every segment, nearest segment wins.
+"""
+import os
+import math
+import time
+from threading import Lock
+from typing import NamedTuple
+from urllib import parse
+
+import numpy as np
+
+from src.shared import status_providers, vehicle_progress_report, AtomicRef
+from src.shared.utils import decode_polyline
+from src.live_data_service.live_feed_store import ENTITY_TTL
+
+EARTH_RADIUS = 6371000.0  # meters, as utils.distance_meters
+SNAP_MAX_OFFSET = float(os.getenv("KIA_SNAP_MAX_OFFSET", 0))  # meters; 0 publishes raw fixes, else fixes this close are snapped
+
+
+class ShapeSegments(NamedTuple):
+    """
+    A shape's polyline in a plane around its first point (x east, y north, meters).
+    """
+    origin: tuple       # (lat, lon) of the plane's origin
+    scale_x: float      # meters per degree of longitude at the origin
+    starts: object      # float ndarray (segments, 2) of segment start points
+    vectors: object     # float ndarray (segments, 2) from each start to the next point
+    lengths: object     # float ndarray (segments,) in meters
+    travelled: object   # float ndarray (segments,) of shape distance at each segment start
+    total: float        # shape length in meters
+
+    def to_plane(self, lats, lons):
+        scale_y = math.radians(EARTH_RADIUS)
+        return np.column_stack(((lons - self.origin[1]) * self.scale_x, (lats - self.origin[0]) * scale_y))
+
+    def to_degrees(self, points):
+        scale_y = math.radians(EARTH_RADIUS)
+        return self.origin[0] + points[:, 1] / scale_y, self.origin[1] + points[:, 0] / self.scale_x
+
+
+class ShapeMatch(NamedTuple):
+    lat: float                  # snapped position
+    lon: float
+    shape_dist_traveled: float  # meters from the start of the shape
+    progress: float             # shape_dist_traveled / shape length, 0 to 1
+    offset: float               # meters between the fix and the snapped position
+
+
+def build_shape_segments(points: list):
+    """
+    points are (lat, lon) in shape order; None for shapes with fewer than two distinct points.
+    """
+    coords = np.asarray(points, dtype=float)
+    if len(coords) < 2:
+        return None
+    keep = np.ones(len(coords), dtype=bool)
+    keep[1:] = np.any(coords[1:] != coords[:-1], axis=1)  # Repeated points make zero-length segments
+    coords = coords[keep]
+    if len(coords) < 2:
+        return None
+
+    origin = (float(coords[0, 0]), float(coords[0, 1]))
+    scale_x = math.radians(EARTH_RADIUS) * math.cos(math.radians(origin[0]))
+    plane = np.column_stack((
+        (coords[:, 1] - origin[1]) * scale_x, (coords[:, 0] - origin[0]) * math.radians(EARTH_RADIUS)
+    ))
+    vectors = np.diff(plane, axis=0)
+    lengths = np.hypot(vectors[:, 0], vectors[:, 1])
+    travelled = np.concatenate(([0.0], np.cumsum(lengths)[:-1]))
+    return ShapeSegments(origin, scale_x, plane[:-1], vectors, lengths, travelled, float(lengths.sum()))
+
+
+def build_shape_index(routelines: dict, routes_children: dict) -> dict:
+    """
+    {child route id: ShapeSegments}, the same shapes build_shapes writes to shapes.txt.
+    """
+    index = {}
+    for key, encoded in routelines.items():
+        if key not in routes_children:
+            continue
+        segments = build_shape_segments(decode_polyline(parse.unquote(encoded, encoding='utf-8', errors='replace')))
+        if segments is not None:
+            index[str(routes_children[key])] = segments
+    return index
+
+
+def project(segments: ShapeSegments, lats, lons) -> list:
+    """
+    Projects a batch of positions onto one shape. Returns a ShapeMatch per position.
+    """
+    points = segments.to_plane(np.asarray(lats, dtype=float), np.asarray(lons, dtype=float))
+    # (positions, segments): where along each segment the perpendicular from each point lands, clamped to the segment
+    relative = points[:, None, :] - segments.starts[None, :, :]
+    along = np.einsum("psk,sk->ps", relative, segments.vectors) / (segments.lengths ** 2)
+    along = np.clip(along, 0.0, 1.0)
+    nearest = segments.starts[None, :, :] + along[:, :, None] * segments.vectors[None, :, :]
+    offsets = np.hypot(points[:, None, 0] - nearest[:, :, 0], points[:, None, 1] - nearest[:, :, 1])
+
+    best = offsets.argmin(axis=1)
+    rows = np.arange(len(points))
+    snapped = nearest[rows, best]
+    snapped_lats, snapped_lons = segments.to_degrees(snapped)
+    travelled = segments.travelled[best] + along[rows, best] * segments.lengths[best]
+    return [
+        ShapeMatch(float(lat), float(lon), float(dist), float(dist / segments.total), float(offset))
+        for lat, lon, dist, offset in zip(snapped_lats, snapped_lons, travelled, offsets[rows, best])
+    ]
+
+
+current_shapes = AtomicRef({})  # {child route id: ShapeSegments}, replaced on every static load
+
+
+class VehicleProgress:
+    """
+    Latest shape match of every live trip, served on /vehicle-progress so consumers can tell how far along
+    its route a bus is. A trip not matched again within the TTL (the live feed's) is dropped.
+    """
+
+    def __init__(self, ttl: float = ENTITY_TTL, clock=time.monotonic):
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = Lock()
+        self._matches = {}  # trip_id -> (ShapeMatch, clock deadline)
+        self.stats = {"matched": 0, "snapped": 0}
+
+    def update(self, matches: dict, snapped: int):
+        now = self._clock()
+        with self._lock:
+            for trip_id in [t for t, (_, deadline) in self._matches.items() if deadline <= now]:
+                del self._matches[trip_id]
+            self._matches.update((trip_id, (match, now + self.ttl)) for trip_id, match in matches.items())
+            self.stats["matched"] += len(matches)
+            self.stats["snapped"] += snapped
+
+    def get(self, trip_id: str):
+        now = self._clock()
+        with self._lock:
+            match, deadline = self._matches.get(trip_id, (None, now))
+            return match if deadline > now else None
+
+    def report(self) -> dict:
+        """
+        {"trips": {trip_id: {"shape_dist_traveled": meters, "progress": 0 to 1, "offset": meters}}}
+        """
+        now = self._clock()
+        with self._lock:
+            return {"trips": {
+                trip_id: {"shape_dist_traveled": round(match.shape_dist_traveled, 1),
+                          "progress": round(match.progress, 4), "offset": round(match.offset, 1)}
+                for trip_id, (match, deadline) in self._matches.items() if deadline > now
+            }}
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, trips=len(self._matches), shapes=len(current_shapes.get()))
+
+
+vehicle_progress = VehicleProgress()
+status_providers["shape_matching"] = vehicle_progress.snapshot
+vehicle_progress_report.set(vehicle_progress.report)
+
+
+def match_vehicles(entities: dict, route_ids: dict, index: dict = None, max_offset: float = SNAP_MAX_OFFSET) -> dict:
+    """
+    entities are {trip_id: FeedEntity}, route_ids {trip_id: child route id}. Projects every vehicle
+    with one call per shape and records its progress. The published position is only rewritten when
+    max_offset > 0, for vehicles within max_offset of their shape.
+    Returns {trip_id: ShapeMatch} for every vehicle on a known shape.
+    """
+    if index is None:
+        index = current_shapes.get()
+    by_route = {}
+    for trip_id, entity in entities.items():
+        route_id = str(route_ids[trip_id])
+        if route_id in index and entity.HasField("vehicle"):
+            by_route.setdefault(route_id, []).append(trip_id)
+
+    matches = {}
+    snapped = 0
+    for route_id, trip_ids in by_route.items():
+        positions = [entities[trip_id].vehicle.position for trip_id in trip_ids]
+        results = project(index[route_id], [p.latitude for p in positions], [p.longitude for p in positions])
+        for trip_id, position, match in zip(trip_ids, positions, results):
+            matches[trip_id] = match
+            if max_offset > 0 and match.offset <= max_offset:
+                position.latitude, position.longitude = match.lat, match.lon
+                snapped += 1
+    vehicle_progress.update(matches, snapped)
+    return matches
@@ -0,0 +1,99 @@
+import os
+import asyncio
+import itertools
+
+from src.shared import status_providers
+from src.live_data_service.live_data_getter import fetch_route_data
+
+UPSTREAM_RPS = float(os.getenv("KIA_UPSTREAM_RPS", 2))               # requests per second across all parents
+UPSTREAM_CONCURRENCY = int(os.getenv("KIA_UPSTREAM_CONCURRENCY", 4))  # requests in flight at once
+
+PRIORITY_ACTIVE = 0  # Parents with vehicles currently matched to trips
+PRIORITY_PROBE = 1   # Parents still being probed for a first match
+
+
+class UpstreamDispatcher:
+    """
+    Funnels every upstream call through one paced queue.
+    Calls start at most once per 1/rps seconds (evenly spaced, no bursts) with at most `concurrency`
+    in flight. Whenever a slot frees up the highest-priority waiting call goes first, FIFO within a priority.
+    """
+
+    def __init__(self, fetch=fetch_route_data, rps: float = UPSTREAM_RPS, concurrency: int = UPSTREAM_CONCURRENCY):
+        self._fetch = fetch
+        self._interval = 1.0 / rps
+        self._queue = asyncio.PriorityQueue()
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._sequence = itertools.count()
+        self._worker = None
+        self.stats = {"dispatched": 0, "max_queue_depth": 0, "total_wait": 0.0}
+
+    async def fetch(self, parent_id: int, priority: int = PRIORITY_PROBE) -> list:
+        if self._worker is None:
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        await self._queue.put((priority, next(self._sequence), loop.time(), parent_id, future))
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self._queue.qsize())
+        return await future
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        next_slot = loop.time()
+        while True:
+            delay = next_slot - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self._semaphore.acquire()
+            # Dequeue only once a slot is free, so a call queued meanwhile with higher priority can overtake
+            _, _, queued_at, parent_id, future = await self._queue.get()
+            if future.done():  # Caller gave up while waiting
+                self._semaphore.release()
+                continue
+            next_slot = loop.time() + self._interval
+            self.stats["dispatched"] += 1
+            self.stats["total_wait"] += loop.time() - queued_at
+            loop.create_task(self._call(parent_id, future))
+
+    async def _call(self, parent_id: int, future):
+        try:
+            result = await self._fetch(parent_id)
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        finally:
+            self._semaphore.release()
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            self._worker = None
+
+
+# One dispatcher per event loop, like the upstream session
+_dispatcher = None
+_dispatcher_loop = None
+
+
+def get_dispatcher() -> UpstreamDispatcher:
+    global _dispatcher, _dispatcher_loop
+    loop = asyncio.get_running_loop()
+    if _dispatcher is None or _dispatcher_loop is not loop:
+        _dispatcher = UpstreamDispatcher()
+        _dispatcher_loop = loop
+        dispatcher = _dispatcher
+        status_providers["upstream_dispatcher"] = lambda: dict(dispatcher.stats, queue_depth=dispatcher.queue_depth())
+    return _dispatcher
+
+
+async def close_dispatcher():
+    global _dispatcher, _dispatcher_loop
+    if _dispatcher is not None:
+        await _dispatcher.close()
+    _dispatcher = None
+    _dispatcher_loop = None
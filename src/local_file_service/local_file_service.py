@@ -1,13 +1,17 @@
 import os
 import sys
+import json
 import threading
 import time
 from datetime import datetime
 
 from src.local_file_service.gtfs_builder import build_gtfs_dataset
+from src.live_data_service.delay_propagation import build_route_stop_index, current_route_stops
+from src.live_data_service.shape_matching import build_shape_index, current_shapes
 from src.shared import new_client_stops, timings_tsv
 from src.shared.utils import load_gtfs_zip, load_input_data, data_has_changed, zip_gtfs_data
 import src.shared as rt_state
+from src.shared.feed_snapshot import StaticArtifact
 from src.shared.config import TSV_PATH, JSON_PATH, IN_DIR, OUT_DIR, OUT_ZIP
 
 
@@ -27,6 +31,8 @@ def process_once():
     rt_state.routes_children.update(input_data["routes_children"])
     rt_state.routes_parent.update(input_data["routes_parent"])
     rt_state.start_times.update(input_data["start_times"])
+    current_route_stops.set(build_route_stop_index(input_data["client_stops"], input_data["routes_children"]))
+    current_shapes.set(build_shape_index(input_data["routelines"], input_data["routes_children"]))
 
     # Load existing GTFS zip
     print("Loading GTFS data...")
@@ -43,11 +49,33 @@ def process_once():
     if data_has_changed(new_gtfs, existing_gtfs):
         print("Changes detected. Saving new GTFS.zip...")
         feed_info = new_gtfs['feed_info.txt']
-        zip_gtfs_data(new_gtfs, OUT_ZIP)
+        zip_bytes = zip_gtfs_data(new_gtfs, OUT_ZIP)
         with open(os.path.join(OUT_DIR, "feed_info.txt"), "w", encoding='utf-8') as f:
             f.write(feed_info[0]['feed_version'])
+        publish_static_artifacts(zip_bytes, feed_info[0]['feed_version'], int(time.time()))
     else:
         print("No changes detected. Skipping update.")
+        if "gtfs.zip" not in rt_state.static_artifacts:
+            with open(OUT_ZIP, "rb") as f:
+                zip_bytes = f.read()
+            feed_version = existing_gtfs["feed_info.txt"][0]["feed_version"]
+            publish_static_artifacts(zip_bytes, feed_version, int(os.path.getmtime(OUT_ZIP)))
+
+
+def publish_static_artifacts(zip_bytes: bytes, feed_version: str, last_modified: int):
+    """
+    Installs the GTFS zip and its version into the in-memory registry served by the web service.
+    """
+    etag = f'"{feed_version}"'
+    rt_state.static_artifacts.update({
+        "gtfs.zip": StaticArtifact(zip_bytes, etag, last_modified, "application/zip"),
+        "gtfs-version": StaticArtifact(
+            json.dumps({"version": feed_version}).encode(), etag, last_modified, "application/json"
+        ),
+    })
+    for callback in list(rt_state.static_artifact_listeners):
+        callback(rt_state.static_artifacts.as_dict())
+    print(f"Published GTFS version {feed_version} ({len(zip_bytes)} bytes) to memory.")
 
 
 class LocalFileService:
@@ -1,14 +1,25 @@
+import os
 import threading
-import asyncio
 from src.local_file_service.local_file_service import process_once, LocalFileService
 from src.live_data_service.live_data_scheduler import schedule_thread
-from src.live_data_service.live_data_receiver import live_data_receiver_loop
-from src.web_service import run_web_service
-from src.shared.db import initialize_database
+from src.live_data_service.live_data_receiver import ReceiverThread
+from src.web_service import run_web_service, run_web_workers, start_snapshot_writer
+from src.shared.db import initialize_database, db_writer
+from src.shared.position_partitions import maintenance_thread
+from src.shared.delay_model import load_delay_model
+
+WEB_WORKERS = int(os.getenv("KIA_WEB_WORKERS", 1))
 
 def main():
     print("[main] Starting GTFS Live Data System")
     initialize_database()
+    load_delay_model()
+    db_writer.start()  # Flushed at exit
+    threading.Thread(target=maintenance_thread, name="db_maintenance", daemon=True).start()
+
+    if WEB_WORKERS > 1:
+        # Web workers read feeds from snapshot files; mirror every publish from here on
+        start_snapshot_writer()
 
     # Step 1: Run local_file_service once to load initial state
     print("[main] Running initial local_file_service pass...")
@@ -25,13 +36,16 @@ def main():
 
     # Step 4: Start live_data_receiver_loop in asyncio background thread
     print("[main] Starting live_data_receiver_loop...")
-    receiver_thread = threading.Thread(
-        target=lambda: asyncio.run(live_data_receiver_loop()),
-        daemon=True
-    )
-    receiver_thread.start()
+    receiver = ReceiverThread().start()
 
-    run_web_service()
+    try:
+        if WEB_WORKERS > 1:
+            run_web_workers(WEB_WORKERS)
+        else:
+            run_web_service()
+    finally:
+        # The web service returns on SIGTERM/SIGINT: let the receiver close its upstream session cleanly
+        receiver.stop()
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,8 @@
 import time
 from threading import RLock
-from queue import PriorityQueue
 from google.transit import gtfs_realtime_pb2
+from src.shared.feed_snapshot import SnapshotStore, EMPTY_INDEX, variant_cache
+from src.shared.job_scheduler import JobScheduler
 
 
 class ThreadSafeDict:
@@ -62,15 +63,61 @@ class ThreadSafeDict:
             return key in self._data
 
 
+class AtomicRef:
+    """
+    Holds an immutable value that is replaced as a whole, e.g. an index rebuilt on every load.
+    Readers take the current value with get() and never see a partially built one.
+    """
+
+    def __init__(self, value):
+        self.value = value
+
+    def get(self):
+        return self.value
+
+    def set(self, value):
+        self.value = value
+
+
 # Thread-safe data stores
-scheduled_timings = PriorityQueue()
-feed_message = gtfs_realtime_pb2.FeedMessage()
-feed_message_lock = RLock()
-with feed_message_lock:
-    feed_message.header.gtfs_realtime_version = "2.0"
-    feed_message.header.timestamp = int(time.time())
+scheduled_timings = JobScheduler()
+# Serialized live feeds, assembled from cached entity bytes and republished once per update for the web service
+feed_snapshot = SnapshotStore("rt")
+trip_updates_snapshot = SnapshotStore("tu")
+vehicle_positions_snapshot = SnapshotStore("vp")
+_empty_feed = gtfs_realtime_pb2.FeedMessage()
+_empty_feed.header.gtfs_realtime_version = "2.0"
+_empty_feed.header.timestamp = int(time.time())
+for store in (feed_snapshot, trip_updates_snapshot, vehicle_positions_snapshot):
+    store.publish(
+        _empty_feed.SerializeToString(), _empty_feed.header.timestamp,
+        index=EMPTY_INDEX._replace(header=_empty_feed.header.SerializeToString())
+    )
 
 # Thread-safe shared dicts
 routes_children = ThreadSafeDict()
 routes_parent = ThreadSafeDict()
 start_times = ThreadSafeDict()
+# Static artifacts served from memory: name -> StaticArtifact
+static_artifacts = ThreadSafeDict()
+static_artifact_listeners = []  # callback(artifacts_dict), invoked after every publish_static_artifacts
+# Monitoring: name -> callable returning a JSON-serializable dict, served on /status
+status_providers = ThreadSafeDict()
+status_providers["variant_cache"] = lambda: dict(variant_cache.stats)
+
+
+def collect_status() -> dict:
+    """
+    Calls every status provider; one that fails reports its error instead of failing the others.
+    """
+    status = {}
+    for name, provider in status_providers.items():
+        try:
+            status[name] = provider()
+        except Exception as e:
+            status[name] = {"error": str(e)}
+    return status
+
+
+# Callable returning {"trips": {trip_id: shape progress}} of the live vehicles, served on /vehicle-progress
+vehicle_progress_report = AtomicRef(lambda: {"trips": {}})
@@ -1,5 +1,10 @@
 import os
 
+import pytz
+
+# Timezone of the upstream's schedule and actual times
+local_tz = pytz.timezone("Asia/Kolkata")
+
 # Root of the project
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "../../"))
 
@@ -12,3 +17,5 @@ JSON_PATH = os.path.join(BASE_DIR, "in", "start_times.json")
 IN_DIR = os.path.join(BASE_DIR, "in")
 OUT_DIR = os.path.join(BASE_DIR, "out")
 OUT_ZIP = os.path.join(OUT_DIR, "gtfs.zip")
+# Memory-mapped snapshot files shared with web worker processes
+SNAPSHOT_DIR = os.getenv("KIA_SNAPSHOT_DIR", os.path.join(OUT_DIR, "snapshots"))
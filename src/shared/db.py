@@ -1,7 +1,21 @@
 import sqlite3
 import os
+import time
+import queue
+import atexit
+import threading
 from typing import Dict
+from src.shared import status_providers
 from src.shared.config import DB_PATH
+from src.shared.utils import distance_meters
+from src.shared.position_partitions import initialize_partitions, ensure_partition, partition_day, insert_sql
+from src.shared.delay_model import initialize_delay_histograms
+
+QUEUE_SIZE = int(os.getenv("KIA_DB_QUEUE_SIZE", 10000))          # rows waiting for the writer thread
+BATCH_SIZE = int(os.getenv("KIA_DB_BATCH_SIZE", 500))            # rows per commit
+FLUSH_INTERVAL = float(os.getenv("KIA_DB_FLUSH_INTERVAL", 1.0))   # seconds a row may wait before a commit
+POSITION_MIN_MOVE = float(os.getenv("KIA_POSITION_MIN_MOVE", 25))     # meters a vehicle must move to be stored again
+POSITION_MAX_GAP = int(os.getenv("KIA_POSITION_MAX_GAP", 300))        # seconds after which a stationary fix is stored anyway (0: never)
 
 def get_connection():
     return sqlite3.connect(DB_PATH)
@@ -26,58 +40,248 @@ def initialize_database():
                 UNIQUE(stop_id, trip_id, date)
             )
         ''')
-        # Table for vehicle positions over time
+        # Covering indexes for the /history endpoints: each query is answered from the index alone
         c.execute('''
-            CREATE TABLE IF NOT EXISTS vehicle_positions (
-                trip_id TEXT,
-                vehicle_id TEXT,
-                route_id TEXT,
-                latitude REAL,
-                longitude REAL,
-                timestamp INTEGER,
-                PRIMARY KEY (trip_id, timestamp)
-            )
+            CREATE INDEX IF NOT EXISTS completed_stop_times_route_history ON completed_stop_times
+            (route_id, date, stop_id, scheduled_arrival, actual_arrival)
         ''')
+        c.execute('''
+            CREATE INDEX IF NOT EXISTS completed_stop_times_stop_history ON completed_stop_times
+            (stop_id, date, route_id, scheduled_arrival, actual_arrival)
+        ''')
+        # Delay histograms for predicted arrivals, maintained by a trigger on completed_stop_times
+        initialize_delay_histograms(conn)
+        # Vehicle positions over time: per-day tables behind the vehicle_positions view
+        initialize_partitions(conn)
         conn.commit()
 
 
-    
-
 def insert_vehicle_data(data: Dict):
-    with get_connection() as conn:
-        c = conn.cursor()
-        try:
-            c.execute('''
-                INSERT OR IGNORE INTO completed_stop_times (
-                    stop_id, trip_id, route_id, date,
-                    actual_arrival, actual_departure,
-                    scheduled_arrival, scheduled_departure
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (
-                data["stop_id"],
-                data["trip_id"],
-                data["route_id"],
-                data["date"],
-                data["actual_arrival"],
-                data["actual_departure"],
-                data["scheduled_arrival"],
-                data["scheduled_departure"]
-            ))
-            conn.commit()
-        except Exception as e:
-            print(f"Error inserting data for stop_id={data['stop_id']}, trip_id={data['trip_id']}: {e}")
+    """
+    Queues a completed stop time for the writer thread; never touches the disk on the caller's thread.
+    """
+    try:
+        row = (
+            data["stop_id"],
+            data["trip_id"],
+            data["route_id"],
+            data["date"],
+            data["actual_arrival"],
+            data["actual_departure"],
+            data["scheduled_arrival"],
+            data["scheduled_departure"]
+        )
+    except KeyError as e:
+        print(f"Error inserting data for stop_id={data.get('stop_id')}, trip_id={data.get('trip_id')}: missing {e}")
+        return
+    db_writer.submit(INSERT_STOP_TIME, row)
 
 
 def insert_vehicle_position(trip_id, vehicle_id, route_id, lat, lon, timestamp):
-    with get_connection() as conn:
-        cursor = conn.cursor()
+    """
+    Queues a vehicle position for the writer thread, unless position_filter finds it adds nothing.
+    """
+    if not position_filter.should_store(vehicle_id, trip_id, lat, lon, timestamp):
+        return
+    day = partition_day(timestamp)
+    db_writer.submit(
+        insert_sql(day), (trip_id, vehicle_id, route_id, lat, lon, timestamp),
+        setup=lambda conn: ensure_partition(conn, day)
+    )
+
+
+INSERT_STOP_TIME = '''
+    INSERT OR IGNORE INTO completed_stop_times (
+        stop_id, trip_id, route_id, date,
+        actual_arrival, actual_departure,
+        scheduled_arrival, scheduled_departure
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class DatabaseWriter:
+    """
+    Write-behind writer: callers enqueue rows on a bounded queue and one thread owns a persistent
+    WAL connection, committing them with executemany once BATCH_SIZE rows are pending or
+    FLUSH_INTERVAL has passed. submit never blocks, since it runs on the receiver's event loop: when the
+    queue is full the row is dropped and counted in stats, so sustained backpressure is visible on /status.
+    """
+
+    def __init__(self, path: str = None, queue_size: int = QUEUE_SIZE, batch_size: int = BATCH_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._setup = {}   # sql -> setup(conn)
+        self._ready = set()  # sql whose setup already ran on the writer's connection
+        self.stats = {
+            "enqueued": 0, "written": 0, "batches": 0, "failed": 0,
+            "dropped": 0, "max_depth": 0, "last_batch_ms": 0.0,
+        }
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="db_writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, sql: str, row: tuple, setup=None):
+        """
+        Queues row for sql. setup(conn), if given, runs before sql is first executed on the writer's connection,
+        e.g. to create the table it inserts into.
+        """
+        if setup is not None and sql not in self._setup:
+            self._setup[sql] = setup
+        if self._thread is None:
+            self.start()
+        try:
+            self._queue.put_nowait((sql, row))
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return
+        self.stats["enqueued"] += 1
+        self.stats["max_depth"] = max(self.stats["max_depth"], self._queue.qsize())
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Blocks until every row queued so far is committed. Returns False when that takes longer than
+        timeout, including the wait for room in a full queue.
+        """
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        done = threading.Event()
+        try:
+            self._queue.put((FLUSH, done), timeout=timeout)
+        except queue.Full:
+            return False
+        return done.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+
+    def stop(self, timeout: float = 10):
+        """
+        Commits what is queued and ends the thread within timeout; registered to run at interpreter exit.
+        A writer that cannot drain a full queue in time is abandoned with its rows, so exit never hangs.
+        """
+        if self._thread is None or not self._thread.is_alive():
+            return
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put((STOP, None), timeout=timeout)
+        except queue.Full:
+            print(f"[DB] Writer stalled: {self._queue.qsize()} queued rows not committed")
+            return
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+
+    def snapshot(self) -> dict:
+        return dict(self.stats, queue_depth=self._queue.qsize())
+
+    def _connect(self):
+        path = self.path or DB_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")  # WAL keeps this durable across crashes, minus the last commits on power loss
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        pending = {}  # sql -> rows, preserving first-seen order
+        pending_count = 0
+        deadline = None
         try:
-            cursor.execute("""
-                INSERT OR IGNORE INTO vehicle_positions (
-                    trip_id, vehicle_id, route_id, latitude, longitude, timestamp
-                ) VALUES (?, ?, ?, ?, ?, ?)
-            """, (trip_id, vehicle_id, route_id, lat, lon, timestamp))
-        except Exception as e:
-            print(f"[DB] insert_vehicle_position error: {e}")
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    sql, row = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    sql, row = None, None
+
+                if sql is not None and sql is not FLUSH and sql is not STOP:
+                    pending.setdefault(sql, []).append(row)
+                    pending_count += 1
+                    if deadline is None:
+                        deadline = time.monotonic() + self.flush_interval
+                    if pending_count < self.batch_size:
+                        continue
+
+                if pending_count:
+                    self._write(conn, pending, pending_count)
+                pending = {}
+                pending_count = 0
+                deadline = None
+                if sql is FLUSH:
+                    row.set()
+                elif sql is STOP:
+                    break
+        finally:
+            conn.close()
+
+    def _write(self, conn, pending: dict, count: int):
+        started = time.monotonic()
+        for attempt in range(2):
+            try:
+                with conn:  # One transaction, one fsync, per batch
+                    for sql, rows in pending.items():
+                        setup = self._setup.get(sql)
+                        if setup is not None and sql not in self._ready:
+                            setup(conn)
+                            self._ready.add(sql)
+                        conn.executemany(sql, rows)
+                self.stats["written"] += count
+                break
+            except Exception as e:
+                if attempt == 0 and self._ready:
+                    self._ready.clear()  # A table may have been dropped by maintenance: run setups again
+                    continue
+                self.stats["failed"] += count
+                print(f"[DB] Batch of {count} rows failed: {e}")
+        self.stats["batches"] += 1
+        self.stats["last_batch_ms"] = round((time.monotonic() - started) * 1000, 2)
+
+
+class PositionFilter:
+    """
+    Last stored fix per vehicle, so repeated polls of a parked or slow bus don't become rows.
+    A fix is stored when the vehicle changed trip, or its lastrefreshon moved and it travelled at
+    least min_move meters, or max_gap seconds passed since the last stored fix.
+    """
+
+    def __init__(self, min_move: float = POSITION_MIN_MOVE, max_gap: int = POSITION_MAX_GAP):
+        self.min_move = min_move
+        self.max_gap = max_gap
+        self._lock = threading.Lock()
+        self._last = {}  # vehicle_id -> (trip_id, lat, lon, timestamp)
+        self.stats = {"stored": 0, "unchanged": 0, "stationary": 0}
+
+    def should_store(self, vehicle_id, trip_id, lat, lon, timestamp) -> bool:
+        with self._lock:
+            last = self._last.get(vehicle_id)
+            if last is not None and last[0] == trip_id:
+                _, last_lat, last_lon, last_timestamp = last
+                if timestamp <= last_timestamp:
+                    self.stats["unchanged"] += 1
+                    return False
+                gap_elapsed = self.max_gap and timestamp - last_timestamp >= self.max_gap
+                if not gap_elapsed and distance_meters(last_lat, last_lon, lat, lon) < self.min_move:
+                    self.stats["stationary"] += 1
+                    return False
+            self._last[vehicle_id] = (trip_id, lat, lon, timestamp)
+            self.stats["stored"] += 1
+            return True
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return dict(self.stats, vehicles=len(self._last))
+
 
+FLUSH = object()  # Queue markers for flush() and stop()
+STOP = object()
 
+db_writer = DatabaseWriter()
+status_providers["db_writer"] = db_writer.snapshot
+atexit.register(db_writer.stop)
+position_filter = PositionFilter()
+status_providers["position_filter"] = position_filter.snapshot
@@ -0,0 +1,179 @@
+"""
+Historical arrival delays per (route, stop, hour of day, weekday), used to predict times at stops a
+vehicle has not reached yet. The delay_histograms table counts delays in whole minutes; a trigger on
+completed_stop_times keeps it current as rows are inserted, so nothing ever rescans the history.
+Buckets are kept per service day, so only the last DELAY_HISTORY_DAYS count and the daily maintenance
+pass can delete the rest. At startup (and after each maintenance pass) the histograms are reduced to an
+in-memory DelayModel, which the transformer consults with plain dict lookups.
+"""
+import os
+import sqlite3
+from datetime import date, timedelta
+from typing import NamedTuple
+
+from src.shared import status_providers, AtomicRef
+from src.shared.config import DB_PATH
+
+DELAY_PERCENTILE = int(os.getenv("KIA_DELAY_PERCENTILE", 50))            # predicted delay
+DELAY_SPREAD_PERCENTILE = int(os.getenv("KIA_DELAY_SPREAD_PERCENTILE", 90))  # uncertainty = spread - predicted
+DELAY_MIN_SAMPLES = int(os.getenv("KIA_DELAY_MIN_SAMPLES", 5))            # fewer samples fall back / predict nothing
+DELAY_HISTORY_DAYS = int(os.getenv("KIA_DELAY_HISTORY_DAYS", 56))         # days of stop times the model learns from
+MIN_DELAY, MAX_DELAY = -30, 120  # minutes; outliers are clamped into the edge buckets
+
+ANY_WEEKDAY = -1
+
+
+def delay_minutes_sql(actual: str, scheduled: str) -> str:
+    """
+    SQL for actual - scheduled in minutes from "HH:MM" columns, wrapped into [-720, 720) across midnight.
+    """
+    def minutes(column):
+        return f"(CAST(substr({column}, 1, 2) AS INTEGER) * 60 + CAST(substr({column}, 4, 2) AS INTEGER))"
+    return f"(({minutes(actual)} - {minutes(scheduled)} + 2160) % 1440 - 720)"
+
+
+def _histogram_values(prefix: str = "") -> str:
+    delay = delay_minutes_sql(f"{prefix}actual_arrival", f"{prefix}scheduled_arrival")
+    return f"""
+        {prefix}date, {prefix}route_id, {prefix}stop_id,
+        CAST(substr({prefix}scheduled_arrival, 1, 2) AS INTEGER),
+        CAST(strftime('%w', {prefix}date) AS INTEGER),
+        MAX({MIN_DELAY}, MIN({MAX_DELAY}, {delay}))
+    """
+
+
+def initialize_delay_histograms(conn):
+    """
+    Creates delay_histograms and its trigger; a new table is backfilled from the stop times stored so far.
+    A table from before buckets were kept per day is rebuilt the same way.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(delay_histograms)")}
+    if columns and "day" not in columns:
+        print("[DB] Rebuilding delay histograms with per-day buckets")
+        conn.execute("DROP TRIGGER IF EXISTS completed_stop_times_delay_histogram")
+        conn.execute("DROP TABLE delay_histograms")
+        columns = set()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS delay_histograms (
+            day TEXT,
+            route_id TEXT,
+            stop_id TEXT,
+            hour INTEGER,
+            weekday INTEGER,
+            delay INTEGER,
+            samples INTEGER,
+            PRIMARY KEY (day, route_id, stop_id, hour, weekday, delay)
+        ) WITHOUT ROWID
+    ''')
+    conn.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS completed_stop_times_delay_histogram
+        AFTER INSERT ON completed_stop_times
+        WHEN NEW.actual_arrival LIKE '__:__' AND NEW.scheduled_arrival LIKE '__:__'
+        BEGIN
+            INSERT INTO delay_histograms (day, route_id, stop_id, hour, weekday, delay, samples)
+            VALUES ({_histogram_values("NEW.")}, 1)
+            ON CONFLICT (day, route_id, stop_id, hour, weekday, delay) DO UPDATE SET samples = samples + 1;
+        END
+    ''')
+    if not columns:
+        backfilled = conn.execute(f'''
+            INSERT INTO delay_histograms (day, route_id, stop_id, hour, weekday, delay, samples)
+            SELECT {_histogram_values()}, COUNT(*) FROM completed_stop_times
+            WHERE actual_arrival LIKE '__:__' AND scheduled_arrival LIKE '__:__'
+            GROUP BY 1, 2, 3, 4, 5, 6
+        ''').rowcount
+        if backfilled:
+            print(f"[DB] Backfilled {backfilled} delay histogram buckets")
+
+
+class DelayModel(NamedTuple):
+    """
+    Immutable {(route_id, stop_id, hour, weekday): (delay, uncertainty)} in seconds, where weekday is
+    0 (Sunday) to 6, or ANY_WEEKDAY for the pooled histogram used when a weekday has too few samples.
+    """
+    predictions: dict
+
+    def lookup(self, route_id: str, stop_id: str, hour: int, weekday: int):
+        """
+        (delay, uncertainty) in seconds, or None when the stop has too little history.
+        """
+        return self.predictions.get((route_id, stop_id, hour, weekday)) \
+            or self.predictions.get((route_id, stop_id, hour, ANY_WEEKDAY))
+
+
+EMPTY_DELAY_MODEL = DelayModel({})
+
+
+def percentile(histogram: list, fraction: float) -> int:
+    """
+    Delay at the given fraction of a [(delay, samples)] histogram sorted by delay.
+    """
+    target = fraction * sum(samples for _, samples in histogram)
+    seen = 0
+    for delay, samples in histogram:
+        seen += samples
+        if seen >= target:
+            return delay
+    return histogram[-1][0]
+
+
+def build_delay_model(rows, min_samples: int = DELAY_MIN_SAMPLES,
+                      predicted: int = DELAY_PERCENTILE, spread: int = DELAY_SPREAD_PERCENTILE) -> DelayModel:
+    """
+    rows are (route_id, stop_id, hour, weekday, delay, samples) in any order.
+    """
+    histograms = {}
+    for route_id, stop_id, hour, weekday, delay, samples in rows:
+        for day in (weekday, ANY_WEEKDAY):
+            buckets = histograms.setdefault((str(route_id), str(stop_id), hour, day), {})
+            buckets[delay] = buckets.get(delay, 0) + samples
+
+    predictions = {}
+    for key, buckets in histograms.items():
+        histogram = sorted(buckets.items())
+        if sum(buckets.values()) < min_samples:
+            continue
+        delay = percentile(histogram, predicted / 100)
+        predictions[key] = (delay * 60, max(percentile(histogram, spread / 100) - delay, 0) * 60)
+    return DelayModel(predictions)
+
+
+current_delay_model = AtomicRef(EMPTY_DELAY_MODEL)  # Replaced on every reload
+
+
+def delay_history_start(today: date = None, days: int = DELAY_HISTORY_DAYS) -> str:
+    """
+    First service day (YYYY-MM-DD, as completed_stop_times.date) inside the history window.
+    """
+    return ((today or date.today()) - timedelta(days=days)).isoformat()
+
+
+def prune_delay_histograms(path: str = None, today: date = None, days: int = DELAY_HISTORY_DAYS) -> int:
+    """
+    Deletes the buckets of days that left the history window. Returns the number deleted.
+    """
+    conn = sqlite3.connect(path or DB_PATH, timeout=30)  # Waits for the writer thread's batches
+    try:
+        with conn:
+            return conn.execute(
+                "DELETE FROM delay_histograms WHERE day < ?", (delay_history_start(today, days),)
+            ).rowcount
+    finally:
+        conn.close()
+
+
+def load_delay_model(path: str = None, today: date = None, days: int = DELAY_HISTORY_DAYS) -> DelayModel:
+    conn = sqlite3.connect(path or DB_PATH)
+    try:
+        model = build_delay_model(conn.execute(
+            "SELECT route_id, stop_id, hour, weekday, delay, samples FROM delay_histograms WHERE day >= ?",
+            (delay_history_start(today, days),)
+        ))
+    finally:
+        conn.close()
+    current_delay_model.set(model)
+    print(f"[DB] Loaded delay predictions for {len(model.predictions)} (route, stop, hour, weekday) keys")
+    return model
+
+
+status_providers["delay_model"] = lambda: {"keys": len(current_delay_model.get().predictions)}
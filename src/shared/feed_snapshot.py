@@ -0,0 +1,273 @@
+import os
+import gzip
+import time
+import hashlib
+from threading import Lock
+from collections import OrderedDict
+from typing import NamedTuple, Dict, Optional
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip alone is always available
+    brotli = None
+
+GZIP_LEVEL = int(os.getenv("KIA_GZIP_LEVEL", 9))
+BROTLI_QUALITY = int(os.getenv("KIA_BROTLI_QUALITY", 9))
+MIN_COMPRESS_SIZE = int(os.getenv("KIA_MIN_COMPRESS_SIZE", 256))  # bytes
+MAX_SUBFEEDS = int(os.getenv("KIA_MAX_SUBFEEDS", 1024))  # cached filtered feeds per version
+VARIANT_CACHE_SIZE = int(os.getenv("KIA_VARIANT_CACHE_SIZE", 8))  # recently published bodies whose encodings are kept
+
+# FeedMessage wire tags: field 1 (header) and field 2 (entity), both length-delimited
+HEADER_TAG = b"\x0a"
+ENTITY_TAG = b"\x12"
+
+
+def encode_varint(value: int) -> bytes:
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_feed_message(header: bytes, entities) -> bytes:
+    """
+    Serializes a FeedMessage from an already serialized header and entities.
+    Concatenating length-delimited fields is exactly what SerializeToString would emit.
+    """
+    parts = [HEADER_TAG, encode_varint(len(header)), header]
+    for entity in entities:
+        parts.append(ENTITY_TAG)
+        parts.append(encode_varint(len(entity)))
+        parts.append(entity)
+    return b"".join(parts)
+
+
+_MISSING = object()
+
+
+class LayeredMap:
+    """
+    Immutable mapping kept as a stack of dict layers, newest last. A new version shares every layer of
+    the old one and adds a layer holding only its changes. A layer is folded into the one below once
+    that one is at most twice its size, like carries in a binary counter, so a lookup probes O(log n)
+    layers and each change is copied O(log n) times over its lifetime.
+    """
+    __slots__ = ("_layers",)
+    DELETED = object()  # Value in updated() changes that removes the key
+
+    def __init__(self, layers: tuple = ()):
+        self._layers = layers
+
+    def get(self, key, default=None):
+        for layer in reversed(self._layers):
+            value = layer.get(key, _MISSING)
+            if value is not _MISSING:
+                return default if value is LayeredMap.DELETED else value
+        return default
+
+    def updated(self, changes: dict) -> "LayeredMap":
+        """
+        Returns a new version with changes applied; changes is kept as a layer, so the caller must not reuse it.
+        """
+        if not changes:
+            return self
+        layers = list(self._layers)
+        layers.append(changes)
+        while len(layers) > 1 and len(layers[-2]) <= 2 * len(layers[-1]):
+            newer = layers.pop()
+            merged = {**layers.pop(), **newer}
+            if not layers:  # Bottom layer: there is nothing left below for a deletion to hide
+                merged = {key: value for key, value in merged.items() if value is not LayeredMap.DELETED}
+            layers.append(merged)
+        return LayeredMap(tuple(layers))
+
+
+class FeedIndex(NamedTuple):
+    """
+    Immutable secondary indexes over one feed version.
+    updated() touches only the changed and deleted entities' keys and buckets; both maps share
+    everything else with the previous version (see LayeredMap).
+    """
+    header: bytes
+    entity_bytes: Dict[str, bytes]  # entity id -> serialized FeedEntity
+    keys: LayeredMap  # entity id -> ((field, value), ...)
+    buckets: LayeredMap  # (field, value) -> entity ids (frozenset)
+
+    def updated(self, header: bytes, entity_bytes: dict, changed_keys: dict, deleted: list) -> "FeedIndex":
+        key_changes = {}
+        bucket_changes = {}
+
+        def members(key):
+            ids = bucket_changes.get(key)
+            return self.buckets.get(key, frozenset()) if ids is None else ids
+
+        for entity_id in list(changed_keys) + list(deleted):
+            for key in self.keys.get(entity_id, ()):
+                bucket_changes[key] = members(key) - {entity_id}
+            key_changes[entity_id] = LayeredMap.DELETED
+
+        for entity_id, entity_keys in changed_keys.items():
+            key_changes[entity_id] = entity_keys
+            for key in entity_keys:
+                bucket_changes[key] = members(key) | {entity_id}
+
+        bucket_changes = {key: ids or LayeredMap.DELETED for key, ids in bucket_changes.items()}
+        return FeedIndex(header, entity_bytes, self.keys.updated(key_changes), self.buckets.updated(bucket_changes))
+
+    def select(self, filters: dict) -> list:
+        matches = None
+        for field, value in filters.items():
+            ids = self.buckets.get((field, value), frozenset())
+            matches = ids if matches is None else matches & ids
+            if not matches:
+                return []
+        return sorted(matches or ())
+
+
+EMPTY_INDEX = FeedIndex(b"", {}, LayeredMap(), LayeredMap())
+
+
+class FeedSnapshot(NamedTuple):
+    """
+    Immutable, pre-serialized view of a published feed.
+    Readers fetch the whole tuple through one attribute read, so serving it needs no lock.
+    """
+    version: int
+    etag: str
+    body: bytes
+    timestamp: int
+    encodings: Dict[str, bytes]  # Content-Encoding -> pre-compressed body
+    diff: Optional[bytes]  # DIFFERENTIAL FeedMessage against the previous version, if known
+    index: Optional[FeedIndex]  # Secondary indexes backing filtered requests
+    subfeeds: dict  # Filter key -> FeedSnapshot, filled lazily and only for this version
+
+
+class StaticArtifact(NamedTuple):
+    """
+    Immutable in-memory copy of a static file, validated by feed_version.
+    """
+    body: bytes
+    etag: str
+    last_modified: int  # epoch seconds
+    content_type: str
+
+
+def compress_variants(body: bytes) -> Dict[str, bytes]:
+    """
+    Builds every supported Content-Encoding of body once.
+    Tiny bodies are left uncompressed since the framing overhead outweighs the saving.
+    """
+    if len(body) < MIN_COMPRESS_SIZE:
+        return {}
+    encodings = {"gzip": gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)}
+    if brotli is not None:
+        encodings["br"] = brotli.compress(body, quality=BROTLI_QUALITY)
+    return encodings
+
+
+class VariantCache:
+    """
+    Compressed variants of recently published bodies, keyed by content and shared by every store,
+    so a body published to several stores (or published again) is compressed only once.
+    """
+
+    def __init__(self, size: int = VARIANT_CACHE_SIZE):
+        self.size = size
+        self._lock = Lock()
+        self._entries = OrderedDict()  # body digest -> encodings, least recently used first
+        self.stats = {"hits": 0, "misses": 0}
+
+    def get(self, body: bytes) -> Dict[str, bytes]:
+        key = hashlib.blake2b(body, digest_size=16).digest()
+        with self._lock:
+            encodings = self._entries.get(key)
+            if encodings is not None:
+                self._entries.move_to_end(key)
+                self.stats["hits"] += 1
+                return encodings
+            self.stats["misses"] += 1
+        encodings = compress_variants(body)  # Outside the lock; a concurrent miss on the same body only repeats the work
+        with self._lock:
+            self._entries[key] = encodings
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        return encodings
+
+
+variant_cache = VariantCache()
+
+
+class SnapshotStore:
+    """
+    Holds the latest FeedSnapshot and hands out monotonically increasing versions.
+    The ETag embeds the process start time so a restart never reuses a tag a client has cached.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = Lock()
+        self._boot_id = format(int(time.time()), "x")
+        self._version = 0
+        self._current = FeedSnapshot(0, self._make_etag(0), b"", 0, {}, None, None, {})
+        self._listeners = []
+
+    def _make_etag(self, version: int) -> str:
+        return f'"{self.name}-{self._boot_id}-{version}"'
+
+    @property
+    def current(self) -> FeedSnapshot:
+        return self._current
+
+    def add_listener(self, callback):
+        """
+        Registers callback(snapshot), invoked on the publishing thread after every publish.
+        """
+        with self._lock:
+            self._listeners.append(callback)
+
+    def remove_listener(self, callback):
+        with self._lock:
+            if callback in self._listeners:
+                self._listeners.remove(callback)
+
+    def publish(self, body: bytes, timestamp: int, diff: Optional[bytes] = None,
+                index: Optional[FeedIndex] = None) -> FeedSnapshot:
+        encodings = variant_cache.get(body)  # Once per distinct body, outside the lock
+        with self._lock:
+            self._version += 1
+            snapshot = FeedSnapshot(
+                self._version, self._make_etag(self._version), body, timestamp, encodings, diff, index, {}
+            )
+            self._current = snapshot  # Single reference swap: readers see the old or the new snapshot, never a mix
+            listeners = list(self._listeners)
+        for callback in listeners:
+            try:
+                callback(snapshot)
+            except Exception as e:
+                print(f"[Snapshot] Listener error on {self.name}: {e}")
+        return snapshot
+
+
+def filtered_snapshot(snapshot: FeedSnapshot, filters: dict) -> FeedSnapshot:
+    """
+    Returns the sub-feed of snapshot matching every filter, e.g. {"route_id": "3813"}.
+    Built from the cached entity bytes on first request and memoized for the rest of the version.
+    """
+    key = tuple(sorted(filters.items()))
+    cached = snapshot.subfeeds.get(key)
+    if cached is not None:
+        return cached
+
+    index = snapshot.index
+    ids = index.select(filters)
+    body = encode_feed_message(index.header, (index.entity_bytes[entity_id] for entity_id in ids))
+    suffix = hashlib.md5(repr(key).encode()).hexdigest()[:8]
+    subfeed = FeedSnapshot(
+        snapshot.version, f'{snapshot.etag[:-1]}-{suffix}"', body, snapshot.timestamp,
+        compress_variants(body), None, None, {}
+    )
+    if ids and len(snapshot.subfeeds) < MAX_SUBFEEDS:  # Unknown keys are cheap; don't let them fill the cache
+        snapshot.subfeeds[key] = subfeed
+    return subfeed
@@ -0,0 +1,133 @@
+import heapq
+import asyncio
+import itertools
+from threading import Lock
+from datetime import datetime
+
+
+class ScheduledJob:
+    """
+    Handle returned by JobScheduler.put, used to cancel or reschedule a job.
+    """
+    __slots__ = ("when", "job", "cancelled")
+
+    def __init__(self, when: datetime, job):
+        self.when = when
+        self.job = job
+        self.cancelled = False
+
+
+class JobScheduler:
+    """
+    Time-ordered job queue that an asyncio loop sleeps on until the earliest job is due,
+    then drains every due job in one batch. put() may be called from any thread: it wakes
+    the loop only when the new job is earlier than what the loop is currently sleeping towards.
+    Keeps PriorityQueue's put((when, job)) / get() / empty() so producers don't change.
+    """
+
+    def __init__(self, clock=datetime.now):
+        self._clock = clock
+        self._heap = []  # (when, sequence, ScheduledJob); cancelled entries are dropped lazily
+        self._sequence = itertools.count()  # Ties on `when` never compare the jobs themselves
+        self._lock = Lock()
+        self._live = 0
+        self._loop = None
+        self._wakeup = None
+        self._sleeping_until = None
+        self.stats = {"wakeups": 0, "dispatched": 0, "batches": 0, "max_batch": 0, "max_lag": 0.0}
+
+    def put(self, item) -> ScheduledJob:
+        when, job = item
+        handle = ScheduledJob(when, job)
+        with self._lock:
+            heapq.heappush(self._heap, (when, next(self._sequence), handle))
+            self._live += 1
+            wake = self._loop is not None and (self._sleeping_until is None or when < self._sleeping_until)
+        if wake:
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+        return handle
+
+    def cancel(self, handle: ScheduledJob) -> bool:
+        with self._lock:
+            if handle.cancelled:
+                return False
+            handle.cancelled = True
+            self._live -= 1
+            return True
+
+    def reschedule(self, handle: ScheduledJob, when: datetime) -> ScheduledJob:
+        """
+        Moves a job to a new time, returning the handle that now represents it.
+        """
+        self.cancel(handle)
+        return self.put((when, handle.job))
+
+    def _drop_cancelled(self):
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+
+    def _pop(self) -> ScheduledJob:
+        _, _, handle = heapq.heappop(self._heap)
+        handle.cancelled = True  # Consumed: later cancel() calls are no-ops
+        self._live -= 1
+        return handle
+
+    def get(self):
+        with self._lock:
+            self._drop_cancelled()
+            handle = self._pop()
+        return handle.when, handle.job
+
+    def empty(self) -> bool:
+        return self.qsize() == 0
+
+    def qsize(self) -> int:
+        with self._lock:
+            return self._live
+
+    def pop_due(self, now: datetime) -> list:
+        """
+        Removes and returns (when, job) for every job due at or before now, earliest first.
+        """
+        due = []
+        with self._lock:
+            self._drop_cancelled()
+            while self._heap and self._heap[0][0] <= now:
+                handle = self._pop()
+                due.append((handle.when, handle.job))
+                self._drop_cancelled()
+        return due
+
+    async def run(self, dispatch):
+        """
+        Calls dispatch(list of (when, job)) with each batch of due jobs, forever.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                now = self._clock()
+                due = self.pop_due(now)
+                if due:
+                    self.stats["batches"] += 1
+                    self.stats["dispatched"] += len(due)
+                    self.stats["max_batch"] = max(self.stats["max_batch"], len(due))
+                    self.stats["max_lag"] = max(self.stats["max_lag"], (now - due[0][0]).total_seconds())
+                    dispatch(due)
+
+                with self._lock:
+                    self._drop_cancelled()
+                    self._sleeping_until = self._heap[0][0] if self._heap else None
+                    self._wakeup.clear()
+                timeout = None
+                if self._sleeping_until is not None:
+                    timeout = max(0.0, (self._sleeping_until - self._clock()).total_seconds())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self.stats["wakeups"] += 1
+        finally:
+            self._loop = None
+            self._wakeup = None
+            self._sleeping_until = None
@@ -0,0 +1,210 @@
+"""
+Vehicle positions are stored in one table per local day (vehicle_positions_YYYYMMDD) behind a
+vehicle_positions view that UNIONs them, so retention drops whole tables instead of deleting rows.
+A daily maintenance pass thins out old days and archives expired ones to gzipped CSV.
+"""
+import os
+import csv
+import gzip
+import time
+import sqlite3
+import traceback
+from datetime import datetime, timedelta
+
+from src.shared.config import DB_PATH
+from src.shared.delay_model import load_delay_model, prune_delay_histograms
+
+PARTITION_PREFIX = "vehicle_positions_"
+VIEW_NAME = "vehicle_positions"
+COLUMNS = ("trip_id", "vehicle_id", "route_id", "latitude", "longitude", "timestamp")
+
+RETENTION_DAYS = int(os.getenv("KIA_POSITION_RETENTION_DAYS", 30))         # days kept in the database
+DOWNSAMPLE_AFTER_DAYS = int(os.getenv("KIA_POSITION_DOWNSAMPLE_AFTER", 2))  # days kept at full resolution
+DOWNSAMPLE_SECONDS = int(os.getenv("KIA_POSITION_DOWNSAMPLE_SECONDS", 60))  # one fix per vehicle and trip per this many seconds
+ARCHIVE_DIR = os.getenv("KIA_POSITION_ARCHIVE_DIR", os.path.join(os.path.dirname(DB_PATH), "archive"))
+MAINTENANCE_HOUR = int(os.getenv("KIA_DB_MAINTENANCE_HOUR", 3))              # local hour of the daily pass
+
+
+def partition_day(timestamp: int) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y%m%d")
+
+
+def partition_table(day: str) -> str:
+    return f"{PARTITION_PREFIX}{day}"
+
+
+def insert_sql(day: str) -> str:
+    return f"""
+        INSERT OR IGNORE INTO {partition_table(day)} (
+            trip_id, vehicle_id, route_id, latitude, longitude, timestamp
+        ) VALUES (?, ?, ?, ?, ?, ?)
+    """
+
+
+def list_partitions(conn) -> list:
+    """
+    Days that have a partition, oldest first.
+    """
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name LIKE ? ORDER BY name",
+        (PARTITION_PREFIX + "%",)
+    ).fetchall()
+    return [name[len(PARTITION_PREFIX):] for (name,) in rows if name[len(PARTITION_PREFIX):].isdigit()]
+
+
+def ensure_partition(conn, day: str):
+    table = partition_table(day)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+    if exists:
+        return
+    conn.execute(f'''
+        CREATE TABLE IF NOT EXISTS {table} (
+            trip_id TEXT,
+            vehicle_id TEXT,
+            route_id TEXT,
+            latitude REAL,
+            longitude REAL,
+            timestamp INTEGER,
+            PRIMARY KEY (trip_id, timestamp)
+        )
+    ''')
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {table}_vehicle ON {table} (vehicle_id, timestamp)")
+    rebuild_view(conn)
+
+
+def rebuild_view(conn):
+    """
+    Points the vehicle_positions view at the partitions that currently exist.
+    """
+    existing = conn.execute("SELECT type FROM sqlite_master WHERE name = ?", (VIEW_NAME,)).fetchone()
+    if existing and existing[0] == "table":
+        migrate_legacy_table(conn)  # Rebuilds the view once the old table is out of the way
+        return
+    selects = [f"SELECT {', '.join(COLUMNS)} FROM {partition_table(day)}" for day in list_partitions(conn)]
+    if not selects:
+        selects = [f"SELECT {', '.join('NULL AS ' + column for column in COLUMNS)} WHERE 0"]
+    conn.execute(f"DROP VIEW IF EXISTS {VIEW_NAME}")
+    conn.execute(f"CREATE VIEW {VIEW_NAME} AS {' UNION ALL '.join(selects)}")
+
+
+def migrate_legacy_table(conn):
+    """
+    Moves rows of the original single vehicle_positions table into day partitions, then replaces it with the view.
+    """
+    legacy = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (VIEW_NAME,)
+    ).fetchone()
+    if not legacy:
+        return
+    conn.execute(f"ALTER TABLE {VIEW_NAME} RENAME TO {VIEW_NAME}_legacy")
+    days = conn.execute(
+        f"SELECT DISTINCT strftime('%Y%m%d', timestamp, 'unixepoch', 'localtime') FROM {VIEW_NAME}_legacy"
+    ).fetchall()
+    for (day,) in days:
+        ensure_partition(conn, day)
+        conn.execute(f'''
+            INSERT OR IGNORE INTO {partition_table(day)} ({', '.join(COLUMNS)})
+            SELECT {', '.join(COLUMNS)} FROM {VIEW_NAME}_legacy
+            WHERE strftime('%Y%m%d', timestamp, 'unixepoch', 'localtime') = ?
+        ''', (day,))
+    conn.execute(f"DROP TABLE {VIEW_NAME}_legacy")
+    rebuild_view(conn)
+    print(f"[DB] Migrated vehicle_positions into {len(days)} day partitions")
+
+
+def initialize_partitions(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS position_partitions (
+            day TEXT PRIMARY KEY,
+            downsampled_at INTEGER
+        )
+    ''')
+    migrate_legacy_table(conn)
+    rebuild_view(conn)
+
+
+def downsample_partition(conn, day: str, seconds: int = DOWNSAMPLE_SECONDS) -> int:
+    """
+    Keeps the first fix of every vehicle and trip in each seconds-long bucket. Returns the rows removed.
+    """
+    table = partition_table(day)
+    removed = conn.execute(f'''
+        DELETE FROM {table} WHERE rowid NOT IN (
+            SELECT MIN(rowid) FROM {table} GROUP BY trip_id, vehicle_id, timestamp / ?
+        )
+    ''', (seconds,)).rowcount
+    conn.execute(
+        "INSERT OR REPLACE INTO position_partitions (day, downsampled_at) VALUES (?, ?)", (day, int(time.time()))
+    )
+    return removed
+
+
+def archive_partition(conn, day: str, archive_dir: str = ARCHIVE_DIR) -> str:
+    """
+    Writes the partition to <archive_dir>/vehicle_positions_<day>.csv.gz, then drops it.
+    """
+    table = partition_table(day)
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"{table}.csv.gz")
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(conn.execute(f"SELECT {', '.join(COLUMNS)} FROM {table} ORDER BY timestamp"))
+    os.replace(tmp_path, path)  # Only drop the table once its archive is complete
+
+    conn.execute(f"DROP TABLE {table}")
+    conn.execute("DELETE FROM position_partitions WHERE day = ?", (day,))
+    rebuild_view(conn)
+    return path
+
+
+def run_maintenance(path: str = None, today: datetime = None, retention_days: int = RETENTION_DAYS,
+                    downsample_after_days: int = DOWNSAMPLE_AFTER_DAYS, archive_dir: str = ARCHIVE_DIR) -> dict:
+    """
+    Archives partitions older than retention_days and downsamples those older than downsample_after_days.
+    """
+    today = (today or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    expire_before = (today - timedelta(days=retention_days)).strftime("%Y%m%d")
+    downsample_before = (today - timedelta(days=downsample_after_days)).strftime("%Y%m%d")
+    report = {"archived": [], "downsampled": {}}
+
+    conn = sqlite3.connect(path or DB_PATH, timeout=30)  # Waits for the writer thread's batches
+    try:
+        with conn:
+            downsampled = {day for (day,) in conn.execute(
+                "SELECT day FROM position_partitions WHERE downsampled_at IS NOT NULL"
+            )}
+        for day in list_partitions(conn):
+            with conn:  # One short transaction per day, so the writer thread is never held up for long
+                if day < expire_before:
+                    archive_partition(conn, day, archive_dir)
+                    report["archived"].append(day)
+                elif day < downsample_before and day not in downsampled:
+                    report["downsampled"][day] = downsample_partition(conn, day)
+    finally:
+        conn.close()
+    return report
+
+
+def maintenance_thread():
+    """
+    Runs run_maintenance once a day at MAINTENANCE_HOUR, local time.
+    """
+    while True:
+        now = datetime.now()
+        next_run = now.replace(hour=MAINTENANCE_HOUR, minute=0, second=0, microsecond=0)
+        if next_run <= now:
+            next_run += timedelta(days=1)
+        time.sleep((next_run - now).total_seconds())
+        try:
+            report = run_maintenance()
+            print(f"[DB] Maintenance: archived {report['archived']}, downsampled {report['downsampled']}")
+        except Exception as e:
+            print(f"[DB] Maintenance failed: {e}")
+            traceback.print_exc()
+        try:
+            print(f"[DB] Pruned {prune_delay_histograms()} delay histogram buckets")
+            load_delay_model()  # Pick up the day's stop times, drop the days that left the window
+        except Exception as e:
+            print(f"[DB] Reloading delay model failed: {e}")
@@ -0,0 +1,363 @@
+import os
+import mmap
+import json
+import time
+import struct
+import asyncio
+import threading
+
+from src.shared.feed_snapshot import FeedSnapshot, FeedIndex, LayeredMap, StaticArtifact, encode_varint
+
+# File layout: MAGIC | uint32 index length | JSON index | payload blobs referenced by (offset, length)
+MAGIC = b"KIASNAP1"
+PREFIX = struct.Struct("<8sI")
+REFRESH_INTERVAL = float(os.getenv("KIA_SNAPSHOT_REFRESH", 0.05))  # seconds between stat() checks per reader
+REPORT_INTERVAL = float(os.getenv("KIA_REPORT_INTERVAL", 5))        # seconds between report file writes
+
+
+def write_snapshot_file(path: str, index: dict, blobs: list):
+    """
+    Atomically replaces path with index + blobs. Readers that already mapped the old file keep
+    their mapping (and any in-flight response still slicing it); new readers see the new inode.
+    index may reference blobs as {"blob": i}; those are written as [offset, length] into the payload.
+    """
+    locations = []
+    offset = 0
+    for blob in blobs:
+        locations.append([offset, len(blob)])
+        offset += len(blob)
+    encoded = json.dumps(_resolve_blobs(index, locations)).encode()
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(PREFIX.pack(MAGIC, len(encoded)))
+        f.write(encoded)
+        for blob in blobs:
+            f.write(blob)
+    os.replace(tmp_path, path)
+
+
+def _resolve_blobs(value, locations):
+    if isinstance(value, dict):
+        if set(value) == {"blob"}:
+            return locations[value["blob"]]
+        return {key: _resolve_blobs(item, locations) for key, item in value.items()}
+    return value
+
+
+def map_snapshot_file(path: str):
+    """
+    Maps path read-only and returns (index, memoryview over the payload blobs).
+    """
+    with open(path, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    magic, index_length = PREFIX.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError(f"{path} is not a snapshot file")
+    payload_start = PREFIX.size + index_length
+    index = json.loads(bytes(view[PREFIX.size:payload_start]))
+    return index, view[payload_start:]
+
+
+def blob_in(view: memoryview, location) -> memoryview:
+    offset, length = location
+    return view[offset:offset + length]
+
+
+# === Feed snapshots ===
+def write_feed_snapshot(path: str, snapshot: FeedSnapshot):
+    blobs = [snapshot.body]
+    index = {
+        "version": snapshot.version,
+        "etag": snapshot.etag,
+        "timestamp": snapshot.timestamp,
+        "body": {"blob": 0},
+        "encodings": {},
+        "diff": None,
+        "entities": None,
+    }
+    for encoding, body in snapshot.encodings.items():
+        index["encodings"][encoding] = {"blob": len(blobs)}
+        blobs.append(body)
+    if snapshot.diff is not None:
+        index["diff"] = {"blob": len(blobs)}
+        blobs.append(snapshot.diff)
+
+    feed_index = snapshot.index
+    if feed_index is not None:
+        # Entities are contiguous inside body, so readers slice them out of it instead of storing them twice
+        position = 1 + len(encode_varint(len(feed_index.header)))
+        header = [position, len(feed_index.header)]
+        position += len(feed_index.header)
+        entities = []
+        for entity_id, entity in feed_index.entity_bytes.items():
+            position += 1 + len(encode_varint(len(entity)))
+            entities.append([entity_id, position, len(entity), feed_index.keys.get(entity_id, [])])
+            position += len(entity)
+        if position == len(snapshot.body):
+            index["header"] = header
+            index["entities"] = entities
+
+    write_snapshot_file(path, index, blobs)
+
+
+def read_feed_snapshot(index: dict, view: memoryview) -> FeedSnapshot:
+    body = blob_in(view, index["body"])
+    feed_index = None
+    if index["entities"] is not None:
+        entity_bytes = {}
+        keys = {}
+        buckets = {}
+        for entity_id, offset, length, entity_keys in index["entities"]:
+            entity_bytes[entity_id] = body[offset:offset + length]
+            keys[entity_id] = tuple(tuple(key) for key in entity_keys)
+            for key in keys[entity_id]:
+                buckets.setdefault(key, set()).add(entity_id)
+        feed_index = FeedIndex(
+            blob_in(body, index["header"]), entity_bytes, LayeredMap((keys,)),
+            LayeredMap(({key: frozenset(ids) for key, ids in buckets.items()},))
+        )
+
+    return FeedSnapshot(
+        index["version"], index["etag"], body, index["timestamp"],
+        {encoding: blob_in(view, location) for encoding, location in index["encodings"].items()},
+        blob_in(view, index["diff"]) if index["diff"] else None,
+        feed_index, {}
+    )
+
+
+# === Static artifacts ===
+def write_static_artifacts(path: str, artifacts: dict):
+    blobs = []
+    index = {}
+    for name, artifact in artifacts.items():
+        index[name] = {
+            "etag": artifact.etag,
+            "last_modified": artifact.last_modified,
+            "content_type": artifact.content_type,
+            "body": {"blob": len(blobs)},
+        }
+        blobs.append(artifact.body)
+    write_snapshot_file(path, index, blobs)
+
+
+def read_static_artifacts(index: dict, view: memoryview) -> dict:
+    return {
+        name: StaticArtifact(blob_in(view, meta["body"]), meta["etag"], meta["last_modified"], meta["content_type"])
+        for name, meta in index.items()
+    }
+
+
+def write_report_file(path: str, report: dict):
+    """
+    Atomically replaces path with one of the producer's JSON reports, stamped with the time it was taken.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(dict(report, written_at=int(time.time())), f, default=str)
+    os.replace(tmp_path, path)
+
+
+def read_report_file(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"error": "the producer has not written this report yet"}
+
+
+class MappedFile:
+    """
+    Re-maps a snapshot file whenever the producer replaces it, checking at most every REFRESH_INTERVAL.
+    Old mappings are never closed explicitly; they are released once no response references them.
+    """
+
+    def __init__(self, path: str, reader, empty):
+        self.path = path
+        self._reader = reader
+        self._value = empty
+        self._file_key = None
+        self._checked_at = 0.0
+
+    def refresh(self) -> bool:
+        now = time.monotonic()
+        if now - self._checked_at < REFRESH_INTERVAL:
+            return False
+        self._checked_at = now
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return False
+        file_key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if file_key == self._file_key:
+            return False
+        try:
+            index, view = map_snapshot_file(self.path)
+        except (OSError, ValueError) as e:
+            print(f"[SnapshotFile] Could not map {self.path}: {e}")
+            return False
+        self._value = self._reader(index, view)
+        self._file_key = file_key
+        return True
+
+    @property
+    def value(self):
+        self.refresh()
+        return self._value
+
+
+class MappedSnapshotStore:
+    """
+    Read-only SnapshotStore backed by a file written by SnapshotFileWriter in another process.
+    """
+
+    def __init__(self, path: str):
+        empty = FeedSnapshot(0, '"empty"', b"", 0, {}, None, None, {})
+        self._file = MappedFile(path, read_feed_snapshot, empty)
+        self._listeners = []
+        self._watcher = None
+
+    @property
+    def current(self) -> FeedSnapshot:
+        return self._file.value
+
+    def add_listener(self, callback):
+        """
+        Listeners are driven by a watcher task on the calling event loop, since no publish happens in this process.
+        """
+        self._listeners.append(callback)
+        if self._watcher is None:
+            self._watcher = asyncio.get_running_loop().create_task(self._watch())
+
+    def remove_listener(self, callback):
+        if callback in self._listeners:
+            self._listeners.remove(callback)
+        if not self._listeners and self._watcher is not None:
+            self._watcher.cancel()
+            self._watcher = None
+
+    async def _watch(self):
+        while True:
+            if self._file.refresh():
+                snapshot = self._file.value
+                for callback in list(self._listeners):
+                    callback(snapshot)
+            await asyncio.sleep(REFRESH_INTERVAL)
+
+
+class MappedArtifactRegistry:
+    """
+    Read-only view of static_artifacts backed by a file written by SnapshotFileWriter.
+    """
+
+    def __init__(self, path: str):
+        self._file = MappedFile(path, read_static_artifacts, {})
+
+    def get(self, name: str, default=None):
+        return self._file.value.get(name, default)
+
+
+class SnapshotFileWriter:
+    """
+    Mirrors every publish of the in-process stores into snapshot files for the web worker processes.
+    Publishes only hand the snapshot over; a dedicated thread does the file writes, keeping just the
+    latest snapshot per file, so a slow disk never holds up the publisher (or the receiver's event loop).
+    The same thread writes the producer's JSON reports (/status, /vehicle-progress) every REPORT_INTERVAL.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._attached = []  # (remove, callback) pairs for detach()
+        self._pending = {}  # path -> (write function, latest payload not yet written)
+        self._writing = False
+        self._stopping = False
+        self._condition = threading.Condition()
+        self._thread = None
+        self._reports = {}  # name -> callable returning the report
+        self.stats = {"written": 0, "coalesced": 0}
+
+    def feed_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.snap")
+
+    def static_path(self) -> str:
+        return os.path.join(self.directory, "static.snap")
+
+    def report_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.json")
+
+    def attach(self, stores: dict, static_artifacts, static_listeners: list, reports: dict = None):
+        # Initial files are written synchronously so workers started right after find them
+        for name, store in stores.items():
+            path = self.feed_path(name)
+            write_feed_snapshot(path, store.current)
+            callback = lambda snapshot, path=path: self._enqueue(path, write_feed_snapshot, snapshot)
+            store.add_listener(callback)
+            self._attached.append((store.remove_listener, callback))
+
+        write_static_artifacts(self.static_path(), static_artifacts.as_dict())
+        callback = lambda artifacts: self._enqueue(self.static_path(), write_static_artifacts, artifacts)
+        static_listeners.append(callback)
+        self._attached.append((static_listeners.remove, callback))
+
+        self._reports = dict(reports or {})
+        for name, report in self._reports.items():
+            write_report_file(self.report_path(name), report())
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name="snapshot_writer", daemon=True)
+        self._thread.start()
+
+    def _enqueue(self, path: str, write, payload):
+        with self._condition:
+            if path in self._pending:
+                self.stats["coalesced"] += 1
+            self._pending[path] = (write, payload)
+            self._condition.notify_all()
+
+    def _run(self):
+        reports_due = time.monotonic() + REPORT_INTERVAL
+        while True:
+            with self._condition:
+                while True:
+                    if self._reports and time.monotonic() >= reports_due:
+                        reports_due = time.monotonic() + REPORT_INTERVAL
+                        for name in self._reports:
+                            self._pending[self.report_path(name)] = (write_report_file, name)
+                    if self._pending or self._stopping:
+                        break
+                    self._condition.wait(reports_due - time.monotonic() if self._reports else None)
+                if not self._pending:
+                    return
+                path, (write, payload) = self._pending.popitem()
+                self._writing = True
+            try:
+                if write is write_report_file:
+                    payload = self._reports[payload]()  # Taken off the lock: providers may be slow
+                write(path, payload)
+                self.stats["written"] += 1
+            except Exception as e:
+                print(f"[SnapshotWriter] Writing {path} failed: {e}")
+            finally:
+                with self._condition:
+                    self._writing = False
+                    self._condition.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Blocks until every snapshot handed over so far is on disk.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: not self._pending and not self._writing, timeout)
+
+    def detach(self, timeout: float = 10):
+        for remove, callback in self._attached:
+            remove(callback)
+        self._attached.clear()
+        if self._thread is not None:
+            with self._condition:
+                self._stopping = True
+                self._condition.notify_all()
+            self._thread.join(timeout)  # Writes what is still pending first
+            self._thread = None
@@ -0,0 +1,81 @@
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import NamedTuple
+
+from src.shared import AtomicRef
+from src.shared.utils import generate_trip_id_timing_map
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class TripEntry(NamedTuple):
+    start_minute: int   # minutes after midnight
+    duration: int       # minutes
+    trip_id: str
+    route_id: str       # child route id
+    trip_time: datetime  # start time on 1900-01-01, as the transformer's jobs expect
+
+
+class TripIndex(NamedTuple):
+    """
+    Immutable lookup from a parent route to the trips of its child routes, rebuilt on every schedule load.
+    Trips are sorted by start minute so the ones around a given time are found with a bisect.
+    """
+    children: dict  # parent_id -> tuple of child route ids
+    trips: dict     # child route id -> tuple of TripEntry sorted by start_minute
+    starts: dict    # child route id -> tuple of start minutes, parallel to trips
+    max_duration: dict  # child route id -> longest trip duration
+
+    def candidates(self, parent_id: int, minute: int, before: int, after: int) -> list:
+        """
+        Trips of parent_id that may be on the road at minute (minutes after midnight):
+        those with start - before <= minute <= start + duration + after. Trips that started
+        before midnight are found too, and so are trips starting just after midnight when minute is late
+        in the evening.
+        """
+        found = []
+        for route_id in self.children.get(parent_id, ()):
+            trips = self.trips[route_id]
+            starts = self.starts[route_id]
+            for at in (minute - MINUTES_PER_DAY, minute, minute + MINUTES_PER_DAY):
+                low = bisect_left(starts, at - self.max_duration[route_id] - after)
+                high = bisect_right(starts, at + before)
+                for trip in trips[low:high]:
+                    if trip.start_minute - before <= at <= trip.start_minute + trip.duration + after:
+                        found.append(trip)
+        return found
+
+
+EMPTY_TRIP_INDEX = TripIndex({}, {}, {}, {})
+
+
+def build_trip_index(start_times, routes_children, routes_parent) -> TripIndex:
+    trip_map = generate_trip_id_timing_map(start_times, routes_children)
+    children = {}
+    trips = {}
+    for route_key, entries in trip_map.items():
+        child_id = routes_children.get(route_key)
+        parent_id = routes_parent.get(route_key)
+        if not (child_id and parent_id):
+            continue
+
+        route_id = str(child_id)
+        route_trips = []
+        for entry, trip_data in zip(entries, start_times.get(route_key) or []):
+            hh, mm, _ = map(int, entry["start"].split(":"))
+            route_trips.append(TripEntry(
+                hh * 60 + mm, int(trip_data.get("duration", 0)), entry["trip"], route_id, datetime(1900, 1, 1, hh, mm)
+            ))
+        children.setdefault(int(parent_id), []).append(route_id)
+        trips.setdefault(route_id, []).extend(route_trips)
+
+    sorted_trips = {route_id: tuple(sorted(entries)) for route_id, entries in trips.items()}
+    return TripIndex(
+        {parent_id: tuple(route_ids) for parent_id, route_ids in children.items()},
+        sorted_trips,
+        {route_id: tuple(trip.start_minute for trip in entries) for route_id, entries in sorted_trips.items()},
+        {route_id: max((trip.duration for trip in entries), default=0) for route_id, entries in sorted_trips.items()},
+    )
+
+
+current_trip_index = AtomicRef(EMPTY_TRIP_INDEX)  # Replaced by the scheduler thread on every schedule load
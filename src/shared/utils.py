@@ -1,4 +1,6 @@
+import io
 import os
+import math
 import json
 import zipfile
 import hashlib
@@ -34,10 +36,14 @@ def load_gtfs_zip(zip_path: str) -> dict:
                 gtfs_data[name] = records
     return gtfs_data
 
-def zip_gtfs_data(data: dict, zip_path: str):
+def zip_gtfs_data(data: dict, zip_path: str) -> bytes:
+    """
+    Writes the GTFS zip to zip_path and returns its bytes, so callers can serve it without re-reading the file.
+    """
     os.makedirs(os.path.dirname(zip_path), exist_ok=True)
 
-    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED) as zf:
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
         for filename, rows in data.items():
             if not rows:
                 continue
@@ -47,9 +53,22 @@ def zip_gtfs_data(data: dict, zip_path: str):
                 content.append(",".join(str(row.get(h, "")) for h in headers))
             zf.writestr(filename, "\n".join(content))
 
+    zip_bytes = buffer.getvalue()
+    with open(zip_path, "wb") as f:
+        f.write(zip_bytes)
+    return zip_bytes
+
 def decode_polyline(poly: str) -> List[Tuple[float, float]]:
     return polyline.decode(poly, geojson=True)
 
+def distance_meters(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Great-circle (haversine) distance between two points.
+    """
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 6371000.0 * 2 * math.asin(math.sqrt(a))
+
 def add_time_trip_times(start_time, minutes):
     # Extract hours and minutes
     hours = start_time // 100
@@ -0,0 +1,259 @@
+"""
+Local stand-in for the BMTC SearchByRouteDetails_v4 API, for load testing the live pipeline.
+
+    python -m src.simulator.bmtc_simulator --mode synthetic --port 59980 --latency-ms 200 --error-rate 0.05
+    KIA_BMTC_API_URL=http://localhost:59980/WebAPI python src/main.py
+
+replay mode serves recorded payloads (the files in api_responses/, or a KIA_RECORD_DIR written by the getter)
+in a loop per parent route; synthetic mode moves vehicles along routelines.json according to start_times.json.
+"""
+import os
+import re
+import json
+import math
+import random
+import asyncio
+import argparse
+from bisect import bisect_right
+from datetime import datetime, timedelta
+from urllib import parse
+
+from aiohttp import web
+
+from src.shared.config import IN_DIR, API_RESPONSES_DIR
+from src.shared.utils import load_input_data, decode_polyline, distance_meters
+
+RECORDED_NAME = re.compile(r"^(\d+)_.*\.json$")  # <parent_id>_<timestamp>.json, as written by the getter
+
+
+def success_payload(up: list, down: list) -> dict:
+    return {
+        "up": {"data": up},
+        "down": {"data": down},
+        "message": "Success",
+        "issuccess": True,
+        "exception": None,
+        "rowCount": 0,
+        "responsecode": 200,
+    }
+
+
+class ReplaySource:
+    """
+    Cycles through recorded payloads per parent_id, in file name order.
+    Files named after a route key ("KIA-10 DOWN.json") are mapped to its parent via routes_parent_ids.json.
+    """
+
+    def __init__(self, directory: str, routes_parent: dict):
+        self.payloads = {}
+        self.positions = {}
+        for name in sorted(os.listdir(directory)):
+            if not name.endswith(".json"):
+                continue
+            recorded = RECORDED_NAME.match(name)
+            parent_id = int(recorded.group(1)) if recorded else routes_parent.get(name[:-len(".json")])
+            if parent_id is None:
+                continue
+            with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+                self.payloads.setdefault(int(parent_id), []).append(json.load(f))
+
+    def respond(self, parent_id: int, now: datetime) -> dict:
+        payloads = self.payloads.get(parent_id)
+        if not payloads:
+            return success_payload([], [])
+        position = self.positions.get(parent_id, 0)
+        self.positions[parent_id] = position + 1
+        return payloads[position % len(payloads)]
+
+
+class SyntheticRoute:
+    """
+    Geometry and timetable of one child route, used to place vehicles at any time of day.
+    """
+
+    def __init__(self, route_key: str, child_id: int, stops: list, points: list, trips: list):
+        self.route_key = route_key
+        self.child_id = child_id
+        self.direction = "down" if route_key.endswith(" DOWN") else "up"
+        self.stops = sorted(stops, key=lambda s: s["distance"])
+        self.points = points
+        self.trips = trips  # [{"start": HHMM, "duration": minutes}]
+        self.cumulative = [0.0]
+        for (lat1, lon1), (lat2, lon2) in zip(points, points[1:]):
+            self.cumulative.append(self.cumulative[-1] + distance_meters(lat1, lon1, lat2, lon2) / 1000)
+
+    def locate(self, fraction: float):
+        """
+        Returns (lat, lon, heading) at fraction of the route's length.
+        """
+        target = fraction * self.cumulative[-1]
+        i = min(max(bisect_right(self.cumulative, target) - 1, 0), len(self.points) - 2)
+        span = self.cumulative[i + 1] - self.cumulative[i] or 1.0
+        t = (target - self.cumulative[i]) / span
+        (lat1, lon1), (lat2, lon2) = self.points[i], self.points[i + 1]
+        heading = math.degrees(math.atan2(lon2 - lon1, lat2 - lat1)) % 360
+        return lat1 + (lat2 - lat1) * t, lon1 + (lon2 - lon1) * t, heading
+
+
+class SyntheticSource:
+    """
+    Generates payloads with one vehicle per trip in progress, moving at constant speed along the route line.
+    Unknown parent ids reuse a real parent's routes (chosen by id), so any number of routes can be simulated.
+    Each vehicle runs a stable per-trip delay so actual times differ from the schedule.
+    """
+
+    def __init__(self, input_data: dict, max_delay_minutes: int = 10):
+        self.max_delay_minutes = max_delay_minutes
+        self.routes_by_parent = {}
+        for route_key, child_id in input_data["routes_children"].items():
+            parent_id = input_data["routes_parent"].get(route_key)
+            line = input_data["routelines"].get(route_key)
+            stops = input_data["client_stops"].get(route_key, {}).get("stops")
+            if parent_id is None or not line or not stops:
+                continue
+            points = decode_polyline(parse.unquote(line, encoding="utf-8", errors="replace"))
+            route = SyntheticRoute(route_key, child_id, stops, points, input_data["start_times"].get(route_key, []))
+            self.routes_by_parent.setdefault(int(parent_id), []).append(route)
+        self.parent_ids = sorted(self.routes_by_parent)
+
+    def routes_for(self, parent_id: int) -> list:
+        if parent_id in self.routes_by_parent:
+            return self.routes_by_parent[parent_id]
+        if not self.parent_ids:
+            return []
+        return self.routes_by_parent[self.parent_ids[parent_id % len(self.parent_ids)]]
+
+    def respond(self, parent_id: int, now: datetime) -> dict:
+        payload = {"up": [], "down": []}
+        for route in self.routes_for(parent_id):
+            stations = {}
+            for trip_index, trip in enumerate(route.trips):
+                self.add_vehicle(route, parent_id, trip_index, trip, now, stations)
+            payload[route.direction].extend(stations.values())
+        return success_payload(payload["up"], payload["down"])
+
+    def add_vehicle(self, route, parent_id: int, trip_index: int, trip: dict, now: datetime, stations: dict):
+        start = now.replace(hour=0, minute=0, second=0, microsecond=0) + timedelta(
+            hours=trip["start"] // 100, minutes=trip["start"] % 100
+        )
+        seeded = random.Random(f"{parent_id}-{route.child_id}-{trip_index}")
+        delay = timedelta(minutes=seeded.randint(0, self.max_delay_minutes))
+        duration = timedelta(minutes=trip["duration"])
+        elapsed = now - start - delay
+        if not timedelta(0) <= elapsed < duration:
+            return  # Not on the road right now
+
+        fraction = elapsed / duration
+        lat, lon, heading = route.locate(fraction)
+        vehicle_id = 100000 + (parent_id * 1000 + route.child_id * 10 + trip_index) % 900000
+        total_distance = route.stops[-1]["distance"] or 1.0
+
+        for stop in route.stops:
+            stop_fraction = stop["distance"] / total_distance
+            scheduled = start + duration * stop_fraction
+            passed = stop_fraction <= fraction
+            actual = (scheduled + delay).strftime("%H:%M") if passed else ""
+            station = stations.setdefault(stop.get("stop_id"), {
+                "routeid": route.child_id,
+                "stationid": stop.get("stop_id"),
+                "stationname": stop["name"],
+                "from": route.stops[0]["name"],
+                "to": route.stops[-1]["name"],
+                "routeno": route.route_key.rsplit(" ", 1)[0],
+                "distance_on_station": stop["distance"],
+                "centerlat": stop["loc"][0],
+                "centerlong": stop["loc"][1],
+                "responsecode": 200,
+                "isnotify": 0,
+                "vehicleDetails": [],
+            })
+            station["vehicleDetails"].append({
+                "vehicleid": vehicle_id,
+                "vehiclenumber": f"KA57F{vehicle_id % 10000:04d}",
+                "servicetypeid": 73,
+                "servicetype": "AC",
+                "centerlat": round(lat, 6),
+                "centerlong": round(lon, 6),
+                "eta": "",
+                "sch_arrivaltime": scheduled.strftime("%H:%M"),
+                "sch_departuretime": scheduled.strftime("%H:%M"),
+                "actual_arrivaltime": actual,
+                "actual_departuretime": actual,
+                "sch_tripstarttime": start.strftime("%H:%M"),
+                "sch_tripendtime": (start + duration).strftime("%H:%M"),
+                "lastlocationid": 0,
+                "currentlocationid": stop.get("stop_id"),
+                "nextlocationid": 0,
+                "currentstop": None,
+                "nextstop": None,
+                "laststop": None,
+                "stopCoveredStatus": 1 if passed else 0,
+                "heading": round(heading),
+                "lastrefreshon": now.strftime("%d-%m-%Y %H:%M:%S"),
+                "lastreceiveddatetimeflag": 0,
+                "tripposition": 1,
+            })
+
+
+def create_simulator_app(source, latency_ms: float = 0, jitter_ms: float = 0, error_rate: float = 0,
+                         timeout_rate: float = 0, clock=datetime.now, seed=None) -> web.Application:
+    """
+    Serves source on POST /WebAPI/SearchByRouteDetails_v4.
+    error_rate answers 503; timeout_rate stalls for a minute so client read timeouts fire.
+    """
+    rng = random.Random(seed)
+    stats = {"requests": 0, "errors": 0, "timeouts": 0}
+
+    async def handle(request):
+        stats["requests"] += 1
+        body = await request.json()
+        delay = max(0.0, latency_ms + rng.uniform(-jitter_ms, jitter_ms)) / 1000
+        if delay:
+            await asyncio.sleep(delay)
+
+        roll = rng.random()
+        if roll < timeout_rate:
+            stats["timeouts"] += 1
+            await asyncio.sleep(60)
+        if roll < timeout_rate + error_rate:
+            stats["errors"] += 1
+            return web.json_response({"issuccess": False, "message": "Simulated failure"}, status=503)
+        return web.json_response(source.respond(int(body["routeid"]), clock()))
+
+    async def handle_stats(request):
+        return web.json_response(stats)
+
+    app = web.Application()
+    app.router.add_post("/WebAPI/SearchByRouteDetails_v4", handle)
+    app.router.add_get("/stats", handle_stats)
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local BMTC SearchByRouteDetails_v4 simulator")
+    parser.add_argument("--mode", choices=["replay", "synthetic"], default="synthetic")
+    parser.add_argument("--replay-dir", default=API_RESPONSES_DIR)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=59980)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--timeout-rate", type=float, default=0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    input_data = load_input_data(IN_DIR)
+    if args.mode == "replay":
+        source = ReplaySource(args.replay_dir, input_data["routes_parent"])
+    else:
+        source = SyntheticSource(input_data)
+
+    app = create_simulator_app(
+        source, args.latency_ms, args.jitter_ms, args.error_rate, args.timeout_rate, seed=args.seed
+    )
+    print(f"[Simulator] {args.mode} mode on http://{args.host}:{args.port}/WebAPI")
+    web.run_app(app, host=args.host, port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+import os
+import asyncio
+import pytest
+from datetime import datetime, timedelta
+from aiohttp.test_utils import TestServer
+
+from src.shared.config import IN_DIR, API_RESPONSES_DIR
+from src.shared.utils import load_input_data
+from src.simulator.bmtc_simulator import ReplaySource, SyntheticSource, create_simulator_app
+from src.live_data_service import live_data_getter
+from src.live_data_service.circuit_breaker import CircuitBreaker, UpstreamError
+
+
+@pytest.fixture
+def fresh_breaker(monkeypatch):
+    monkeypatch.setitem(live_data_getter.breakers, "SearchByRouteDetails_v4", CircuitBreaker("test", failure_threshold=100))
+
+
+async def fetch_from(app, monkeypatch, parent_id):
+    async with TestServer(app) as server:
+        monkeypatch.setattr(live_data_getter, "KIA_API_BASE", str(server.make_url("/WebAPI")))
+        try:
+            return await live_data_getter.fetch_route_data(parent_id)
+        finally:
+            await live_data_getter.close_session()
+
+
+@pytest.mark.asyncio
+async def test_replay_serves_recorded_payloads(monkeypatch, fresh_breaker):
+    input_data = load_input_data(IN_DIR)
+    source = ReplaySource(API_RESPONSES_DIR, input_data["routes_parent"])
+    parent_id = input_data["routes_parent"]["KIA-10 DOWN"]
+
+    stations = await fetch_from(create_simulator_app(source), monkeypatch, parent_id)
+
+    assert stations
+    assert any(station["vehicleDetails"] for station in stations)
+
+
+def test_synthetic_vehicles_move_along_the_route():
+    source = SyntheticSource(load_input_data(IN_DIR))
+    parent_id = source.parent_ids[0]
+    trip = source.routes_for(parent_id)[0].trips[0]
+    start = datetime(2025, 1, 6, trip["start"] // 100, trip["start"] % 100)
+
+    def positions(now):
+        payload = source.respond(parent_id, now)
+        return {
+            (v["vehicleid"], v["centerlat"], v["centerlong"])
+            for direction in ("up", "down") for station in payload[direction]["data"] for v in station["vehicleDetails"]
+        }
+
+    # Every trip is delayed by at most 10 minutes, so it must be on the road 15 minutes after its start
+    first = positions(start + timedelta(minutes=15))
+    later = positions(start + timedelta(minutes=16))
+    assert first and later
+    assert first != later
+
+    # Unknown parent ids are mapped onto real routes so any number of routes can be simulated
+    assert source.routes_for(10 ** 6)
+
+
+@pytest.mark.asyncio
+async def test_simulator_injects_errors(monkeypatch, fresh_breaker):
+    app = create_simulator_app(ReplaySource(API_RESPONSES_DIR, {}), error_rate=1.0)
+    with pytest.raises(UpstreamError):
+        await fetch_from(app, monkeypatch, 2124)
+
+
+@pytest.mark.asyncio
+async def test_getter_records_responses_for_replay(monkeypatch, tmp_path, fresh_breaker):
+    input_data = load_input_data(IN_DIR)
+    parent_id = input_data["routes_parent"]["KIA-10 DOWN"]
+    monkeypatch.setattr(live_data_getter, "RECORD_DIR", str(tmp_path))
+
+    replayed = create_simulator_app(ReplaySource(API_RESPONSES_DIR, input_data["routes_parent"]))
+    original = await fetch_from(replayed, monkeypatch, parent_id)
+    recorded = []
+    for _ in range(100):  # Recording happens in an executor
+        recorded = [name for name in os.listdir(tmp_path) if name.endswith(".json")]
+        if recorded:
+            break
+        await asyncio.sleep(0.05)
+
+    assert len(recorded) == 1
+    assert recorded[0].startswith(f"{parent_id}_")
+
+    monkeypatch.setattr(live_data_getter, "RECORD_DIR", None)
+    assert await fetch_from(create_simulator_app(ReplaySource(str(tmp_path), {})), monkeypatch, parent_id) == original
@@ -0,0 +1,75 @@
+import pytest
+
+from src.live_data_service.circuit_breaker import CircuitBreaker, CircuitOpenError, CLOSED, OPEN, HALF_OPEN
+
+
+def test_breaker_opens_after_threshold_and_recovers_through_half_open():
+    breaker = CircuitBreaker("test", failure_threshold=2, base_backoff=10, max_backoff=100)
+
+    breaker.before_call()
+    breaker.record_failure("timeout")
+    assert breaker.state == CLOSED
+    breaker.before_call()
+    breaker.record_failure("timeout")
+    assert breaker.state == OPEN
+    assert 5 <= breaker.retry_after() <= 10
+
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.open_until = 0  # Backoff elapsed
+    breaker.before_call()  # The single half-open trial
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()  # Everyone else waits for the trial
+
+    breaker.record_success()
+    assert breaker.state == CLOSED
+    assert breaker.snapshot()["trips"] == 0
+
+
+def test_breaker_backoff_grows_exponentially_when_trials_fail():
+    breaker = CircuitBreaker("test", failure_threshold=1, base_backoff=10, max_backoff=35)
+    upper_bounds = []
+    for _ in range(4):
+        breaker.open_until = 0
+        breaker.before_call()
+        breaker.record_failure("HTTP 503")
+        upper_bounds.append(breaker.retry_after())
+
+    assert upper_bounds[0] <= 10
+    assert 10 <= upper_bounds[1] <= 20
+    assert 17.5 <= upper_bounds[3] <= 35  # Capped at max_backoff
+
+
+@pytest.mark.asyncio
+async def test_cancelled_trial_does_not_leave_the_breaker_stuck(monkeypatch):
+    import asyncio
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from src.live_data_service import live_data_getter
+
+    async def hang(request):
+        await asyncio.sleep(60)
+
+    upstream = web.Application()
+    upstream.router.add_post("/WebAPI/SearchByRouteDetails_v4", hang)
+    breaker = CircuitBreaker("SearchByRouteDetails_v4", failure_threshold=1)
+    breaker.state, breaker.open_until = OPEN, 0  # Backoff elapsed: the next call is the trial
+    monkeypatch.setitem(live_data_getter.breakers, "SearchByRouteDetails_v4", breaker)
+
+    async with TestServer(upstream) as server:
+        monkeypatch.setattr(live_data_getter, "KIA_API_BASE", str(server.make_url("/WebAPI")))
+        try:
+            trial = asyncio.create_task(live_data_getter.fetch_route_data(2124))
+            await asyncio.sleep(0.1)
+            assert breaker.state == HALF_OPEN and breaker.trial_in_flight
+            trial.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await trial
+        finally:
+            await live_data_getter.close_session()
+
+    assert breaker.state == HALF_OPEN
+    breaker.before_call()  # The next poll gets to run the trial
+    assert breaker.trial_in_flight
@@ -0,0 +1,107 @@
+import time
+import sqlite3
+import threading
+
+from src.shared import db
+from src.shared.position_partitions import partition_day, insert_sql, ensure_partition
+
+
+def make_writer(tmp_path, monkeypatch, **kwargs):
+    path = str(tmp_path / "live_data.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.initialize_database()
+    return db.DatabaseWriter(path, **kwargs), path
+
+
+def submit_position(writer, row):
+    day = partition_day(row[-1])
+    writer.submit(insert_sql(day), row, setup=lambda conn: ensure_partition(conn, day))
+
+
+def count_rows(path, table):
+    with sqlite3.connect(path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+def test_rows_are_committed_in_batches(tmp_path, monkeypatch):
+    writer, path = make_writer(tmp_path, monkeypatch, batch_size=50, flush_interval=60)
+    for i in range(120):
+        submit_position(writer, ("1234_1", "v1", "1234", 12.9, 77.5, 1700000000 + i))
+    writer.submit(db.INSERT_STOP_TIME, ("s1", "1234_1", "1234", "2025-01-06", "10:01", "10:02", "10:00", "10:01"))
+
+    assert writer.flush(timeout=5)
+    assert count_rows(path, "vehicle_positions") == 120
+    assert count_rows(path, "completed_stop_times") == 1
+    assert writer.stats["batches"] == 3  # Two full batches, then the flush
+    with sqlite3.connect(path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    writer.stop()
+
+
+def test_rows_wait_at_most_the_flush_interval(tmp_path, monkeypatch):
+    writer, path = make_writer(tmp_path, monkeypatch, batch_size=1000, flush_interval=0.05)
+    submit_position(writer, ("1234_1", "v1", "1234", 12.9, 77.5, 1700000000))
+
+    for _ in range(100):
+        if count_rows(path, "vehicle_positions"):
+            break
+        time.sleep(0.02)
+    assert count_rows(path, "vehicle_positions") == 1
+    writer.stop()
+
+
+def test_stop_flushes_and_full_queue_is_counted(tmp_path, monkeypatch):
+    writer, path = make_writer(tmp_path, monkeypatch, queue_size=2, batch_size=1000, flush_interval=60)
+    writer._thread = threading.Thread(target=lambda: None)  # Writer stalled: nothing drains the queue
+    started = time.monotonic()
+    for i in range(50):
+        submit_position(writer, ("1234_1", "v1", "1234", 12.9, 77.5, 1700000000 + i))
+    assert time.monotonic() - started < 1  # Never waits on the full queue
+    assert writer.stats["dropped"] == 48
+
+    writer._thread = None
+    writer.start()
+    writer.stop()
+    assert count_rows(path, "vehicle_positions") == writer.stats["written"] == 2
+
+
+def test_flush_and_stop_give_up_on_a_stalled_writer(tmp_path, monkeypatch):
+    writer, _ = make_writer(tmp_path, monkeypatch, queue_size=2)
+    release = threading.Event()
+    writer._thread = threading.Thread(target=release.wait, daemon=True)  # Alive, but never drains the queue
+    writer._thread.start()
+    for i in range(2):
+        submit_position(writer, ("1234_1", "v1", "1234", 12.9, 77.5, 1700000000 + i))
+
+    started = time.monotonic()
+    assert not writer.flush(timeout=0.1)
+    writer.stop(timeout=0.1)
+    assert time.monotonic() - started < 1
+    release.set()
+
+
+def test_position_filter_stores_only_movement():
+    positions = db.PositionFilter(min_move=25, max_gap=300)
+    t = 1700000000
+
+    assert positions.should_store("v1", "1234_1", 12.97000, 77.59000, t)
+    assert not positions.should_store("v1", "1234_1", 12.97000, 77.59000, t)        # Same lastrefreshon
+    assert not positions.should_store("v1", "1234_1", 12.97010, 77.59000, t + 20)   # ~11 m: parked
+    assert positions.should_store("v1", "1234_1", 12.97100, 77.59000, t + 40)       # ~111 m
+    assert positions.should_store("v1", "1234_1", 12.97100, 77.59000, t + 340)      # Stationary, but 5 minutes passed
+    assert positions.should_store("v1", "1234_2", 12.97100, 77.59000, t + 350)      # New trip
+    assert positions.should_store("v2", "1234_3", 12.97100, 77.59000, t + 350)
+
+    assert positions.snapshot() == {"stored": 5, "unchanged": 1, "stationary": 1, "vehicles": 2}
+
+
+def test_malformed_stop_time_is_skipped(monkeypatch):
+    submitted = []
+    monkeypatch.setattr(db.db_writer, "submit", lambda sql, row, setup=None: submitted.append(row))
+
+    db.insert_vehicle_data({"stop_id": "s1", "trip_id": "1234_1"})  # Missing everything else
+    db.insert_vehicle_data({
+        "stop_id": "s1", "trip_id": "1234_1", "route_id": "1234", "date": "2025-01-06", "actual_arrival": "10:01",
+        "actual_departure": "10:02", "scheduled_arrival": "10:00", "scheduled_departure": "10:01",
+    })
+    assert len(submitted) == 1
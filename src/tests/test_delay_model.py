@@ -0,0 +1,100 @@
+import sqlite3
+from datetime import date, timedelta
+
+from src.shared import db, delay_model
+from src.shared.delay_model import build_delay_model, load_delay_model, prune_delay_histograms, ANY_WEEKDAY
+
+
+def stop_time(stop_id, trip, day, scheduled, actual, route_id="1234"):
+    return (stop_id, f"{route_id}_{trip}", route_id, day, actual, actual, scheduled, scheduled)
+
+
+def test_trigger_maintains_histograms_and_new_table_is_backfilled(tmp_path, monkeypatch):
+    path = str(tmp_path / "live_data.db")
+    with sqlite3.connect(path) as conn:  # A database from before delay_histograms existed
+        conn.execute('''
+            CREATE TABLE completed_stop_times (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, stop_id TEXT, trip_id TEXT, route_id TEXT, date TEXT,
+                actual_arrival TEXT, actual_departure TEXT, scheduled_arrival TEXT, scheduled_departure TEXT,
+                UNIQUE(stop_id, trip_id, date)
+            )
+        ''')
+        conn.execute(db.INSERT_STOP_TIME, stop_time("100", 1, "2025-01-06", "10:00", "10:04"))
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.initialize_database()
+
+    with sqlite3.connect(path) as conn:
+        conn.executemany(db.INSERT_STOP_TIME, [
+            stop_time("100", 2, "2025-01-06", "10:30", "10:34"),
+            stop_time("100", 2, "2025-01-06", "10:30", "10:34"),  # Ignored duplicate, not counted
+            stop_time("100", 3, "2025-01-06", "23:58", "00:01"),  # Across midnight
+            stop_time("100", 4, "2025-01-06", "10:00", "13:00"),  # Clamped
+        ])
+        rows = conn.execute("SELECT hour, weekday, delay, samples FROM delay_histograms ORDER BY hour, delay").fetchall()
+    assert rows == [(10, 1, 4, 2), (10, 1, 120, 1), (23, 1, 3, 1)]  # 2025-01-06 was a Monday
+
+
+def test_model_uses_weekday_histogram_or_falls_back_to_all_weekdays():
+    rows = [
+        ("1234", "100", 10, 1, 2, 3), ("1234", "100", 10, 1, 6, 2), ("1234", "100", 10, 1, 20, 1),
+        ("1234", "100", 10, 2, 0, 1),  # Too few Tuesday samples on their own
+        ("1234", "101", 10, 1, 5, 1),  # Too few altogether
+    ]
+    model = build_delay_model(rows, min_samples=3)
+
+    assert model.lookup("1234", "100", 10, 1) == (2 * 60, 18 * 60)  # Median 2, 90th percentile 20
+    assert model.lookup("1234", "100", 10, 2) == model.predictions[("1234", "100", 10, ANY_WEEKDAY)]
+    assert model.lookup("1234", "101", 10, 1) is None
+    assert model.lookup("1234", "100", 11, 1) is None
+
+
+def test_transformer_predicts_times_of_stops_not_reached_yet(tmp_path, monkeypatch):
+    from src.live_data_service import live_data_transformer
+    monkeypatch.setattr(live_data_transformer, "insert_vehicle_data", lambda row: None)
+    monkeypatch.setattr(live_data_transformer, "insert_vehicle_position", lambda **kwargs: None)
+
+    path = str(tmp_path / "live_data.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.initialize_database()
+    today = date.today().isoformat()
+    with sqlite3.connect(path) as conn:
+        conn.executemany(db.INSERT_STOP_TIME, [stop_time("s2", trip, today, "10:30", "10:33") for trip in range(5)])
+    monkeypatch.setattr(delay_model.current_delay_model, "value", delay_model.EMPTY_DELAY_MODEL)
+    load_delay_model(path)
+
+    def stop(station, actual):
+        return {"stationid": station, "sch_arrivaltime": "10:30", "sch_departuretime": "10:31",
+                "actual_arrivaltime": actual, "actual_departuretime": actual}
+    vehicle = {"vehicleid": "v1", "lastrefreshon": "06-01-2025 10:30:00"}
+    entity = live_data_transformer.build_feed_entity(
+        vehicle, "1234_1", "1234", [stop("s1", "10:29"), stop("s2", ""), stop("s3", "")]
+    )
+
+    reached, predicted, unknown = entity.trip_update.stop_time_update
+    assert reached.arrival.delay == -60
+    assert predicted.arrival.delay == 180
+    assert predicted.arrival.time == unknown.arrival.time + 180
+    assert predicted.departure.time == unknown.departure.time + 180
+    assert unknown.arrival.delay == 0  # No history for s3: the schedule is published as is
+
+
+def test_days_outside_the_history_window_stop_affecting_the_model(tmp_path, monkeypatch):
+    path = str(tmp_path / "live_data.db")
+    with sqlite3.connect(path) as conn:  # A table from before buckets were kept per day
+        conn.execute("CREATE TABLE delay_histograms (route_id TEXT, stop_id TEXT, hour INTEGER, weekday INTEGER, "
+                     "delay INTEGER, samples INTEGER, PRIMARY KEY (route_id, stop_id, hour, weekday, delay))")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.initialize_database()
+    monkeypatch.setattr(delay_model.current_delay_model, "value", delay_model.EMPTY_DELAY_MODEL)
+
+    today = date(2025, 3, 3)
+    old, recent = (today - timedelta(days=20)).isoformat(), (today - timedelta(days=2)).isoformat()
+    with sqlite3.connect(path) as conn:
+        conn.executemany(db.INSERT_STOP_TIME, [stop_time("s1", trip, old, "10:30", "10:50") for trip in range(5)])
+        conn.executemany(db.INSERT_STOP_TIME, [stop_time("s1", trip, recent, "10:30", "10:32") for trip in range(5)])
+
+    assert load_delay_model(path, today=today, days=28).lookup("1234", "s1", 10, ANY_WEEKDAY) == (2 * 60, 18 * 60)
+    assert load_delay_model(path, today=today, days=14).lookup("1234", "s1", 10, ANY_WEEKDAY) == (2 * 60, 0)
+
+    assert prune_delay_histograms(path, today=today, days=14) == 1
+    assert load_delay_model(path, today=today, days=28).lookup("1234", "s1", 10, ANY_WEEKDAY) == (2 * 60, 0)
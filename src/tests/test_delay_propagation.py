@@ -0,0 +1,81 @@
+import math
+from datetime import datetime
+
+from google.transit import gtfs_realtime_pb2
+
+from src.live_data_service import delay_propagation, live_data_transformer
+from src.live_data_service.delay_propagation import build_route_stop_index, propagate_delays
+from src.shared.config import local_tz
+from src.shared.delay_model import DelayModel, ANY_WEEKDAY
+
+CLIENT_STOPS = {
+    "KIA-9 UP": {"stops": [
+        {"distance": 10, "name": "C", "name_kn": "C", "loc": [13.0, 77.2], "stop_id": 3},
+        {"distance": 0, "name": "A", "name_kn": "A", "loc": [13.0, 77.0], "stop_id": 1},
+        {"distance": 5, "name": "B", "name_kn": "B", "loc": [13.0, 77.1], "stop_id": 2},
+        {"distance": 20, "name": "D", "name_kn": "D", "loc": [13.0, 77.3], "stop_id": 4},
+    ]},
+}
+
+
+def test_route_stop_index_orders_stops_by_distance():
+    index = build_route_stop_index(CLIENT_STOPS, {"KIA-9 UP": 1234})
+    row = index.rows["1234"]
+    assert index.stop_ids[row] == ("1", "2", "3", "4")
+    assert index.distances[row].tolist() == [0, 5, 10, 20]
+
+
+def test_live_delay_is_propagated_to_every_later_stop_of_every_trip(monkeypatch):
+    monkeypatch.setattr(live_data_transformer, "insert_vehicle_data", lambda row: None)
+    monkeypatch.setattr(live_data_transformer, "insert_vehicle_position", lambda **kwargs: None)
+    monkeypatch.setattr(delay_propagation.current_route_stops, "value", build_route_stop_index(CLIENT_STOPS, {"KIA-9 UP": 1234}))
+
+    def record(vehicle_id, trip_start, station, scheduled, actual=""):
+        return {
+            "routeid": 1234, "stationid": station,
+            "vehicleDetails": [{
+                "vehicleid": vehicle_id, "sch_tripstarttime": trip_start,
+                "sch_arrivaltime": scheduled, "sch_departuretime": scheduled,
+                "actual_arrivaltime": actual, "actual_departuretime": actual,
+                "lastrefreshon": "06-01-2025 10:30:00",
+            }],
+        }
+
+    api_data = [
+        record("v1", "10:00", 2, "10:10"),             # Upstream lists stops out of order
+        record("v1", "10:00", 1, "10:00", "10:10"),    # 10 minutes late at the first stop
+        record("v2", "11:00", 1, "11:00"),             # Not started yet: nothing observed
+    ]
+    jobs = [
+        {"trip_id": "1234_1", "trip_time": datetime(1900, 1, 1, 10, 0), "route_id": "1234", "parent_id": 1},
+        {"trip_id": "1234_2", "trip_time": datetime(1900, 1, 1, 11, 0), "route_id": "1234", "parent_id": 1},
+    ]
+
+    matched = live_data_transformer.transform_jobs(api_data, jobs)
+
+    updates = matched["1234_1"].trip_update.stop_time_update
+    assert [(stu.stop_id, stu.stop_sequence) for stu in updates] == [("1", 1), ("2", 2), ("3", 3), ("4", 4)]
+    assert updates[0].departure.delay == 600
+    assert [stu.arrival.delay for stu in updates[1:]] == [round(600 * math.exp(-d / 10)) for d in (5, 10, 20)]
+    assert updates[1].arrival.time - updates[0].arrival.time == 10 * 60 - 600 + updates[1].arrival.delay
+    assert not updates[2].arrival.time  # Not returned by the upstream: delay only, applied to the static schedule
+
+    untouched = matched["1234_2"].trip_update.stop_time_update
+    assert [(stu.stop_id, stu.arrival.delay) for stu in untouched] == [("1", 0)]
+
+
+def test_added_stops_fade_towards_their_historical_delay():
+    index = build_route_stop_index(CLIENT_STOPS, {"KIA-9 UP": 1234})
+    model = DelayModel({("1234", "3", 10, ANY_WEEKDAY): (300, 120)})  # Stop 3 usually runs 5 minutes late at 10h
+    entity = gtfs_realtime_pb2.FeedEntity()
+    observed = entity.trip_update.stop_time_update.add()
+    observed.stop_id = "1"
+    observed.arrival.time = int(local_tz.localize(datetime(2025, 1, 6, 10, 10)).timestamp())  # Scheduled 10:00 IST, 10 minutes late
+    observed.arrival.delay = 600
+
+    assert propagate_delays([("1234", entity, {"1": 600})], index=index, model=model) == 1
+
+    delays = {stu.stop_id: stu.arrival.delay for stu in entity.trip_update.stop_time_update}
+    weight = math.exp(-10 / 10)
+    assert delays["3"] == round(weight * 600 + (1 - weight) * 300)
+    assert delays["4"] == round(600 * math.exp(-20 / 10))  # No history: fades towards the schedule
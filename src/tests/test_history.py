@@ -0,0 +1,117 @@
+import sqlite3
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+from src.shared import db
+from src.web_service import create_app
+
+
+@pytest.fixture
+def history_db(tmp_path, monkeypatch):
+    path = str(tmp_path / "live_data.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.initialize_database()
+    rows = []
+    for day in ("2025-01-05", "2025-01-06"):
+        for stop_id, delays in (("100", (0, 4, 10)), ("101", (-2,)), ("102", (1, 30))):
+            for trip, delay in enumerate(delays):
+                rows.append((stop_id, f"1234_{trip}", "1234", day,
+                             f"{(10 * 60 + delay) // 60:02d}:{(10 * 60 + delay) % 60:02d}", None, "10:00", None))
+    rows.append(("100", "1234_9", "1234", "2025-01-05", "00:03", None, "23:58", None))  # Across midnight: +5
+    rows.append(("100", "5678_1", "5678", "2025-01-05", "10:00", None, "10:00", None))
+    with sqlite3.connect(path) as conn:
+        conn.executemany(db.INSERT_STOP_TIME, rows)
+    return path
+
+
+def test_history_queries_are_answered_from_covering_indexes(history_db):
+    from src.web_service.history import QUERIES
+    params = {"id": "1234", "start": "2025-01-01", "end": "2025-01-31", "after_date": "", "after_key": "",
+              "limit": 10, "on_time": 5}
+    with sqlite3.connect(history_db) as conn:
+        for kind, index in (("route", "completed_stop_times_route_history"), ("stop", "completed_stop_times_stop_history")):
+            plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + QUERIES[kind], params))
+            assert f"USING COVERING INDEX {index}" in plan
+            assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.asyncio
+async def test_route_history_pages_through_delay_statistics(history_db):
+    async with TestClient(TestServer(create_app(history_path=history_db))) as client:
+        resp = await client.get("/history/route/1234", params={"from": "2025-01-05", "to": "2025-01-06", "limit": 4})
+        assert resp.status == 200
+        page = await resp.json()
+        assert [(row["date"], row["stop_id"]) for row in page["rows"]] == [
+            ("2025-01-05", "100"), ("2025-01-05", "101"), ("2025-01-05", "102"), ("2025-01-06", "100"),
+        ]
+        first = page["rows"][0]
+        assert (first["samples"], first["min_delay"], first["max_delay"]) == (4, 0, 10)
+        assert first["mean_delay"] == 4.75
+        assert first["on_time"] == 0.75
+
+        resp = await client.get("/history/route/1234", params={
+            "from": "2025-01-05", "to": "2025-01-06", "limit": 4, "after": page["next"]
+        })
+        page = await resp.json()
+        assert [(row["date"], row["stop_id"]) for row in page["rows"]] == [("2025-01-06", "101"), ("2025-01-06", "102")]
+        assert page["next"] is None
+
+        resp = await client.get("/history/stop/100", params={"from": "2025-01-05", "to": "2025-01-05"})
+        page = await resp.json()
+        assert [(row["route_id"], row["samples"]) for row in page["rows"]] == [("1234", 4), ("5678", 1)]
+
+        resp = await client.get("/history/route/1234", params={"from": "yesterday"})
+        assert resp.status == 400
+
+
+@pytest.mark.asyncio
+async def test_history_without_database_is_unavailable(tmp_path):
+    async with TestClient(TestServer(create_app(history_path=str(tmp_path / "missing.db")))) as client:
+        resp = await client.get("/history/stop/100")
+        assert resp.status == 503
+    assert not (tmp_path / "missing.db").exists()  # Read-only connections never create the file
+
+
+@pytest.mark.asyncio
+async def test_history_pages_are_streamed_chunk_by_chunk(history_db, monkeypatch):
+    from src.web_service import history
+
+    monkeypatch.setattr(history, "STREAM_CHUNK", 2)
+    chunks = []
+    original = history.stream_history
+    monkeypatch.setattr(history, "stream_history",
+                        lambda conn, kind, params, send: original(conn, kind, params, lambda rows: chunks.append(len(rows)) or send(rows)))
+
+    async with TestClient(TestServer(create_app(history_path=history_db))) as client:
+        resp = await client.get("/history/route/1234", params={"from": "2025-01-05", "to": "2025-01-06", "limit": 5})
+        page = await resp.json()
+        assert [(row["date"], row["stop_id"]) for row in page["rows"]] == [
+            ("2025-01-05", "100"), ("2025-01-05", "101"), ("2025-01-05", "102"),
+            ("2025-01-06", "100"), ("2025-01-06", "101"),
+        ]
+        assert page["next"] is not None
+        assert chunks == [2, 2, 1]
+
+        resp = await client.get("/history/route/9999")
+        assert (await resp.json())["rows"] == []
+
+
+def test_history_pool_threads_start_with_the_app_and_never_exceed_its_size(history_db):
+    import threading
+    from concurrent.futures import ThreadPoolExecutor
+    from src.web_service.history import ReadOnlyPool
+
+    before = {thread.name for thread in threading.enumerate()}
+    create_app(history_path=history_db)
+    assert not any(thread.name.startswith("history") for thread in threading.enumerate() if thread.name not in before)
+
+    pool = ReadOnlyPool(history_db, size=2)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        held = list(executor.map(lambda _: pool._acquire(), range(2)))
+        waiting = [executor.submit(pool._acquire) for _ in range(6)]
+        for conn in held * 3:  # Each waiter takes a returned connection instead of opening one
+            pool._connections.put(conn)
+        for future in waiting:
+            future.result(timeout=5)
+    assert pool._opened == 2
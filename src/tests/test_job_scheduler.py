@@ -0,0 +1,61 @@
+import asyncio
+import threading
+import pytest
+from datetime import datetime, timedelta
+
+from src.shared.job_scheduler import JobScheduler
+
+
+def test_priority_queue_compatibility():
+    scheduler = JobScheduler()
+    now = datetime.now()
+    scheduler.put((now + timedelta(minutes=5), {"parent_id": 2}))
+    scheduler.put((now, {"parent_id": 1}))
+    scheduler.put((now, {"parent_id": 3}))  # Same time as another job: must not compare the dicts
+
+    order = []
+    while not scheduler.empty():
+        order.append(scheduler.get()[1]["parent_id"])
+    assert order == [1, 3, 2]
+
+
+def test_cancel_and_reschedule():
+    scheduler = JobScheduler()
+    now = datetime.now()
+    first = scheduler.put((now, "first"))
+    second = scheduler.put((now + timedelta(seconds=1), "second"))
+
+    assert scheduler.cancel(first)
+    assert not scheduler.cancel(first)
+    scheduler.reschedule(second, now - timedelta(seconds=1))
+
+    assert scheduler.qsize() == 1
+    assert scheduler.pop_due(now) == [(now - timedelta(seconds=1), "second")]
+    assert scheduler.empty()
+
+
+@pytest.mark.asyncio
+async def test_due_jobs_dispatch_in_one_batch_without_polling():
+    scheduler = JobScheduler()
+    batches = []
+    now = datetime.now()
+    for parent_id in range(50):
+        scheduler.put((now, parent_id))
+
+    task = asyncio.create_task(scheduler.run(batches.append))
+    try:
+        await asyncio.sleep(0.1)
+        assert batches == [[(now, parent_id) for parent_id in range(50)]]
+        assert scheduler.stats["wakeups"] == 0  # Nothing left to wait for: asleep until the next put
+
+        # A producer thread adding an earlier job wakes the loop; it fires on time, not on the next poll
+        due_at = datetime.now() + timedelta(milliseconds=100)
+        producer = threading.Thread(target=scheduler.put, args=((due_at, "late"),))
+        producer.start()
+        producer.join()
+        await asyncio.sleep(0.3)
+        assert batches[-1] == [(due_at, "late")]
+        assert scheduler.stats["wakeups"] <= 3
+        assert scheduler.stats["max_lag"] < 0.1
+    finally:
+        task.cancel()
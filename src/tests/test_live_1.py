@@ -40,6 +40,17 @@ def patched_state(monkeypatch):
 def test_populate_schedule_adds_correct_entries(patched_state, monkeypatch):
     monkeypatch.setenv("KIA_QUERY_INTERVAL", "5")
     monkeypatch.setenv("KIA_QUERY_AMOUNT", "2")
+    patched_state["start_times"]["KIA-10 UP"] = [{"start": 500, "duration": 120}, {"start": 1200, "duration": 120}]
+    patched_state["routes_children"]["KIA-10 UP"] = 3812
+    patched_state["routes_parent"]["KIA-10 UP"] = 2124
+
+    class EarlyMorning(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return cls(2025, 1, 6, 3, 0)
+
+    from src.live_data_service import live_data_scheduler
+    monkeypatch.setattr(live_data_scheduler, "datetime", EarlyMorning)
 
     populate_schedule()
     from src.shared import scheduled_timings
@@ -48,15 +59,26 @@ def test_populate_schedule_adds_correct_entries(patched_state, monkeypatch):
     while not scheduled_timings.empty():
         scheduled.append(scheduled_timings.get())
 
-    assert len(scheduled) == 5
-    times = [s[0] for s in scheduled]
-    metadata = [s[1] for s in scheduled]
+    # 04:50 and 05:00 overlap into one session; 12:00 gets its own
+    assert len(scheduled) == 2
+    morning, noon = [s[1] for s in scheduled]
+    assert morning["parent_id"] == noon["parent_id"] == 2124
+    assert [trip["trip_id"] for trip in morning["trips"]] == ["3813_1", "3812_1"]
+    assert [trip["route_id"] for trip in morning["trips"]] == ["3813", "3812"]
+    assert morning["start"] == datetime(2025, 1, 6, 4, 40)
+    assert morning["end"] == datetime(2025, 1, 6, 5, 10)
+    assert scheduled[0][0] == morning["start"]
+    assert [trip["trip_id"] for trip in noon["trips"]] == ["3812_2"]
+    for trip in morning["trips"] + noon["trips"]:
+        assert isinstance(trip["trip_time"], datetime)
+
+
+def test_populate_schedule_replaces_previous_plan(patched_state):
+    from src.shared import scheduled_timings
 
-    for meta in metadata:
-        assert meta["trip_id"].startswith("3813_")
-        assert meta["parent_id"] == 2124
-        assert meta["route_id"] == "3813"
-        assert isinstance(meta["trip_time"], datetime)
+    populate_schedule()
+    populate_schedule()
+    assert scheduled_timings.qsize() == 1
 
 
 @pytest.mark.asyncio
@@ -86,3 +108,113 @@ async def test_fetch_route_data_success(monkeypatch):
     assert len(result) == 2
     assert result[0]["stationid"] == "S1"
     assert result[1]["stationid"] == "S2"
+
+
+@pytest.mark.asyncio
+async def test_fetch_route_data_reuses_one_keep_alive_connection(monkeypatch):
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+    from src.live_data_service import live_data_getter
+
+    client_ports = []
+
+    async def handle(request):
+        client_ports.append(request.transport.get_extra_info("peername")[1])
+        return web.json_response({"issuccess": True, "up": {"data": [{"routeid": 2124}]}, "down": {"data": []}})
+
+    upstream = web.Application()
+    upstream.router.add_post("/WebAPI/SearchByRouteDetails_v4", handle)
+    async with TestServer(upstream) as server:
+        monkeypatch.setattr(live_data_getter, "KIA_API_BASE", str(server.make_url("/WebAPI")))
+        try:
+            assert await fetch_route_data(2124) == [{"routeid": 2124}]
+            assert await fetch_route_data(2124) == [{"routeid": 2124}]
+        finally:
+            await live_data_getter.close_session()
+
+    assert len(client_ports) == 2
+    assert client_ports[0] == client_ports[1]  # Same TCP connection, no second handshake
+
+
+@pytest.mark.asyncio
+async def test_unchanged_payload_skips_transformation(patched_state, monkeypatch):
+    from src.live_data_service import live_data_receiver
+    from src.shared import trip_index
+    from src.live_data_service.live_feed_store import LiveFeedStore
+    from google.transit.gtfs_realtime_pb2 import FeedEntity
+
+    vehicle = {"vehicleid": 1, "lastrefreshon": "06-01-2025 05:00:00", "actual_arrivaltime": "05:00", "actual_departuretime": ""}
+    responses = [
+        [{"routeid": 3813, "stationid": 1, "vehicleDetails": [vehicle]}],
+        [{"routeid": 3813, "stationid": 1, "vehicleDetails": [dict(vehicle)]}],  # Same content, new objects
+        [{"routeid": 3813, "stationid": 1, "vehicleDetails": [dict(vehicle, lastrefreshon="06-01-2025 05:00:20")]}],
+        [],
+        [],
+    ]
+
+    class FakeDispatcher:
+        async def fetch(self, parent_id, priority):
+            return responses.pop(0)
+
+    transformed = []
+    monkeypatch.setattr(live_data_receiver, "get_dispatcher", lambda: FakeDispatcher())
+    monkeypatch.setattr(live_data_receiver, "transform_jobs",
+                        lambda data, jobs: transformed.append(data) or {jobs[0]["trip_id"]: FeedEntity(id="veh_1")})
+    monkeypatch.setattr(live_data_receiver, "update_feed_message", lambda entities: None)
+    monkeypatch.setattr(live_data_receiver, "POLL_INTERVAL", 0)
+    monkeypatch.setattr(live_data_receiver, "poll_stats", {"processed": 0, "skipped": 0})
+    monkeypatch.setattr(live_data_receiver, "live_store", LiveFeedStore())
+    now = datetime.now()
+    patched_state["start_times"]["KIA-10 DOWN"] = [{"start": now.hour * 100 + now.minute, "duration": 120}]
+    monkeypatch.setattr(trip_index.current_trip_index, "value", trip_index.build_trip_index(
+        patched_state["start_times"], patched_state["routes_children"], patched_state["routes_parent"]
+    ))
+    live_data_receiver.active_parents[2124] = datetime.min  # Session already over
+
+    await live_data_receiver.poll_route_parent_until_done(2124)
+    live_data_receiver.publish_executor.submit(lambda: None).result(timeout=5)  # Queued publishes still see the patches
+
+    assert live_data_receiver.poll_stats == {"processed": 2, "skipped": 1}
+    assert len(transformed) == 2
+    assert not responses
+
+
+def test_receiver_thread_stop_closes_upstream_resources(monkeypatch):
+    from src.live_data_service import live_data_receiver
+    from src.shared.job_scheduler import JobScheduler
+
+    closed = []
+
+    async def close(name):
+        closed.append(name)
+
+    monkeypatch.setattr(live_data_receiver, "scheduled_timings", JobScheduler())
+    monkeypatch.setattr(live_data_receiver, "close_dispatcher", lambda: close("dispatcher"))
+    monkeypatch.setattr(live_data_receiver, "close_session", lambda: close("session"))
+
+    receiver = live_data_receiver.ReceiverThread().start()
+    assert receiver.stop(timeout=5)
+    assert closed == ["dispatcher", "session"]
+
+
+def test_publishes_run_off_the_loop_and_fold_while_queued(monkeypatch):
+    import threading
+    from src.live_data_service import live_data_receiver
+
+    release = threading.Event()
+    published = []
+
+    def slow_publish(entities):
+        release.wait(5)
+        published.append((threading.current_thread().name, entities))
+    monkeypatch.setattr(live_data_receiver, "update_feed_message", slow_publish)
+    monkeypatch.setattr(live_data_receiver.live_store, "entities", lambda: ["veh_1"])
+
+    for _ in range(5):
+        live_data_receiver.publish_live_feed()  # Returns at once; the rest fold into the queued publish
+    release.set()
+    live_data_receiver.publish_executor.submit(lambda: None).result(timeout=5)
+
+    assert 1 <= len(published) <= 2
+    assert all(name.startswith("feed_publisher") for name, _ in published)
+    assert published[-1][1] == ["veh_1"]
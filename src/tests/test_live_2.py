@@ -4,7 +4,7 @@ from google.transit import gtfs_realtime_pb2
 
 from src.live_data_service.live_data_transformer import transform_response_to_feed_entities
 from src.live_data_service.feed_entity_updater import update_feed_message
-from src.shared import feed_message, feed_message_lock
+from src.shared import feed_snapshot
 
 
 @pytest.fixture
@@ -94,8 +94,80 @@ def test_feed_message_updated_correctly(sample_bmtc_api_data):
 
     update_feed_message(entities)
 
-    with feed_message_lock:
-        assert feed_message.header.gtfs_realtime_version == "2.0"
-        assert feed_message.header.timestamp > 0
-        assert len(feed_message.entity) == 1
-        assert feed_message.entity[0].id == "veh_v001"
+    feed_message = gtfs_realtime_pb2.FeedMessage()
+    feed_message.ParseFromString(feed_snapshot.current.body)
+    assert feed_message.header.gtfs_realtime_version == "2.0"
+    assert feed_message.header.timestamp > 0
+    assert len(feed_message.entity) == 1
+    assert feed_message.entity[0].id == "veh_v001"
+
+
+def test_transform_jobs_matches_each_vehicle_to_its_nearest_trip(monkeypatch):
+    from src.live_data_service import live_data_transformer
+
+    monkeypatch.setattr(live_data_transformer, "insert_vehicle_data", lambda row: None)
+    monkeypatch.setattr(live_data_transformer, "insert_vehicle_position", lambda **kwargs: None)
+
+    def record(vehicle_id, trip_start, station):
+        return {
+            "routeid": 1234, "stationid": station,
+            "vehicleDetails": [{
+                "vehicleid": vehicle_id, "sch_tripstarttime": trip_start, "sch_arrivaltime": "10:30",
+                "sch_departuretime": "10:31", "actual_arrivaltime": "", "actual_departuretime": "",
+                "lastrefreshon": "06-01-2025 10:30:00",
+            }],
+        }
+
+    api_data = [
+        record("v1", "10:01", "s1"), record("v1", "10:01", "s2"),
+        record("v2", "10:09", "s1"),   # Nearer to 10:10 than 10:00
+        record("v3", "10:30", "s1"),   # No trip within the window
+        {**record("v4", "10:10", "s1"), "routeid": 9999},  # Other route
+    ]
+    jobs = [
+        {"trip_id": "1234_1", "trip_time": datetime(1900, 1, 1, 10, 0), "route_id": "1234", "parent_id": 1},
+        {"trip_id": "1234_2", "trip_time": datetime(1900, 1, 1, 10, 10), "route_id": "1234", "parent_id": 1},
+        {"trip_id": "1234_3", "trip_time": datetime(1900, 1, 1, 11, 0), "route_id": "1234", "parent_id": 1},
+    ]
+
+    matched = live_data_transformer.transform_jobs(api_data, jobs)
+
+    assert sorted(matched) == ["1234_1", "1234_2"]
+    assert matched["1234_1"].trip_update.vehicle.id == "v1"
+    assert len(matched["1234_1"].trip_update.stop_time_update) == 2
+    assert matched["1234_2"].trip_update.vehicle.id == "v2"
+
+
+def test_feed_assembled_from_cached_bytes_matches_protobuf_encoding():
+    from src.live_data_service.feed_entity_updater import encode_entity
+    from src.shared import trip_updates_snapshot
+
+    entities = []
+    for i in range(3):
+        entity = gtfs_realtime_pb2.FeedEntity(id=f"veh_{i}")
+        entity.trip_update.trip.trip_id = f"1234_{i}"
+        entity.trip_update.stop_time_update.add(stop_id="s1").arrival.time = 1700000000 + i
+        entity.vehicle.trip.trip_id = f"1234_{i}"
+        entity.vehicle.position.latitude = 12.97
+        entity.vehicle.position.longitude = 77.59
+        entities.append(entity)
+    encoded = [encode_entity(entity) for entity in entities]
+
+    update_feed_message(encoded)
+
+    body = feed_snapshot.current.body
+    feed_message = gtfs_realtime_pb2.FeedMessage()
+    feed_message.ParseFromString(body)
+    assert feed_message.SerializeToString() == body
+    assert list(feed_message.entity) == entities
+
+    trip_updates = gtfs_realtime_pb2.FeedMessage()
+    trip_updates.ParseFromString(trip_updates_snapshot.current.body)
+    assert [entity.id for entity in trip_updates.entity] == ["veh_0", "veh_1", "veh_2"]
+    assert not any(entity.HasField("vehicle") for entity in trip_updates.entity)
+
+    # Dropping one entity: the differential update is only its deletion marker
+    update_feed_message(encoded[:2])
+    diff = gtfs_realtime_pb2.FeedMessage()
+    diff.ParseFromString(feed_snapshot.current.diff)
+    assert [(entity.id, entity.is_deleted) for entity in diff.entity] == [("veh_2", True)]
@@ -0,0 +1,33 @@
+from src.live_data_service.live_feed_store import LiveFeedStore
+
+
+def test_polls_replace_only_their_own_partition():
+    store = LiveFeedStore()
+
+    assert store.replace(1, {"1_1": "a", "1_2": "b"})
+    assert store.replace(2, {"2_1": "c"})
+    assert not store.replace(1, {"1_1": "a", "1_2": "b"})  # Same content: nothing to republish
+    assert store.replace(1, {"1_2": "b2"})                  # Trip 1_1 ended
+
+    assert store.entities() == ["b2", "c"]
+    assert store.drop(2)
+    assert store.entities() == ["b2"]
+    assert store.snapshot()["partitions"] == 1
+
+
+def test_partitions_expire_unless_touched():
+    now = [0.0]
+    store = LiveFeedStore(ttl=60, clock=lambda: now[0])
+    store.replace(1, {"1_1": "a"})
+    store.replace(2, {"2_1": "b"})
+
+    now[0] = 50
+    store.touch(1)
+    now[0] = 70
+    assert store.entities() == ["a"]
+    assert not store.expire()
+
+    now[0] = 111
+    assert store.expire()
+    assert store.entities() == []
+    assert store.snapshot()["expired"] == 2
@@ -0,0 +1,72 @@
+import csv
+import gzip
+import sqlite3
+from datetime import datetime
+
+from src.shared import db
+from src.shared.position_partitions import (
+    list_partitions, partition_day, insert_sql, ensure_partition, run_maintenance
+)
+
+
+def timestamp(day: int, hour: int = 10, second: int = 0) -> int:
+    return int(datetime(2025, 1, day, hour, 0, second).timestamp())
+
+
+def test_legacy_table_is_migrated_into_day_partitions(tmp_path, monkeypatch):
+    path = str(tmp_path / "live_data.db")
+    with sqlite3.connect(path) as conn:
+        conn.execute('''
+            CREATE TABLE vehicle_positions (
+                trip_id TEXT, vehicle_id TEXT, route_id TEXT, latitude REAL, longitude REAL, timestamp INTEGER,
+                PRIMARY KEY (trip_id, timestamp)
+            )
+        ''')
+        conn.executemany("INSERT INTO vehicle_positions VALUES (?, ?, ?, ?, ?, ?)", [
+            ("1234_1", "v1", "1234", 12.9, 77.5, timestamp(5)),
+            ("1234_1", "v1", "1234", 12.9, 77.5, timestamp(6)),
+        ])
+
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.initialize_database()
+
+    with sqlite3.connect(path) as conn:
+        assert list_partitions(conn) == ["20250105", "20250106"]
+        assert conn.execute("SELECT COUNT(*) FROM vehicle_positions").fetchone()[0] == 2
+        assert conn.execute("SELECT type FROM sqlite_master WHERE name = 'vehicle_positions'").fetchone()[0] == "view"
+
+
+def test_maintenance_downsamples_then_archives(tmp_path, monkeypatch):
+    path = str(tmp_path / "live_data.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    db.initialize_database()
+
+    writer = db.DatabaseWriter(path, flush_interval=60)
+    for day in (1, 5, 9):
+        for second in range(0, 120, 10):  # One fix every 10 seconds for two minutes
+            row = ("1234_1", "v1", "1234", 12.9, 77.5, timestamp(day, second=0) + second)
+            writer.submit(insert_sql(partition_day(row[-1])), row,
+                          setup=lambda conn, day=partition_day(row[-1]): ensure_partition(conn, day))
+    writer.stop()
+
+    report = run_maintenance(
+        path, today=datetime(2025, 1, 10), retention_days=7, downsample_after_days=2, archive_dir=str(tmp_path / "archive")
+    )
+
+    assert report["archived"] == ["20250101"]
+    assert report["downsampled"] == {"20250105": 10}  # 12 fixes -> one per minute
+    with sqlite3.connect(path) as conn:
+        assert list_partitions(conn) == ["20250105", "20250109"]
+        counts = dict(conn.execute(
+            "SELECT strftime('%d', timestamp, 'unixepoch', 'localtime'), COUNT(*) FROM vehicle_positions GROUP BY 1"
+        ).fetchall())
+    assert counts == {"05": 2, "09": 12}
+
+    with gzip.open(tmp_path / "archive" / "vehicle_positions_20250101.csv.gz", "rt") as f:
+        rows = list(csv.reader(f))
+    assert rows[0] == ["trip_id", "vehicle_id", "route_id", "latitude", "longitude", "timestamp"]
+    assert len(rows) == 13
+
+    # Already downsampled days are left alone on the next pass
+    assert run_maintenance(path, today=datetime(2025, 1, 10), retention_days=7, downsample_after_days=2,
+                           archive_dir=str(tmp_path / "archive")) == {"archived": [], "downsampled": {}}
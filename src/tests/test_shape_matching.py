@@ -0,0 +1,80 @@
+import pytest
+from google.transit import gtfs_realtime_pb2
+
+from src.shared.utils import distance_meters
+from src.live_data_service import shape_matching
+from src.live_data_service.shape_matching import build_shape_segments, project, match_vehicles, VehicleProgress
+
+# An L-shaped route: ~1.1 km east, then ~1.1 km north
+SHAPE = [(13.0, 77.0), (13.0, 77.005), (13.0, 77.01), (13.0, 77.01), (13.01, 77.01)]
+
+
+def test_batch_projection_gives_snapped_position_distance_and_progress():
+    segments = build_shape_segments(SHAPE)
+    leg = distance_meters(13.0, 77.0, 13.0, 77.01)
+    assert len(segments.lengths) == 3  # Repeated point dropped
+    assert segments.total == pytest.approx(leg + distance_meters(13.0, 77.01, 13.01, 77.01), rel=1e-3)
+
+    north_of_first_leg, past_the_end, before_the_start = project(
+        segments, [13.0001, 13.02, 13.0], [77.0025, 77.01, 76.99]
+    )
+    assert (north_of_first_leg.lat, north_of_first_leg.lon) == pytest.approx((13.0, 77.0025))
+    assert north_of_first_leg.offset == pytest.approx(distance_meters(13.0001, 77.0025, 13.0, 77.0025), rel=1e-3)
+    assert north_of_first_leg.shape_dist_traveled == pytest.approx(leg / 4, rel=1e-3)
+    assert past_the_end.progress == pytest.approx(1.0)
+    assert (past_the_end.lat, past_the_end.lon) == pytest.approx((13.01, 77.01))
+    assert before_the_start.shape_dist_traveled == pytest.approx(0.0)
+
+
+def vehicle_entities(positions: dict) -> dict:
+    entities = {}
+    for trip_id, (lat, lon) in positions.items():
+        entity = gtfs_realtime_pb2.FeedEntity()
+        entity.vehicle.position.latitude, entity.vehicle.position.longitude = lat, lon
+        entities[trip_id] = entity
+    return entities
+
+
+def test_match_vehicles_snaps_only_positions_near_their_shape():
+    entities = vehicle_entities({"1234_1": (13.0002, 77.005), "1234_2": (13.01, 77.0), "9999_1": (13.0, 77.0)})
+
+    matches = match_vehicles(
+        entities, {"1234_1": "1234", "1234_2": "1234", "9999_1": "9999"},
+        index={"1234": build_shape_segments(SHAPE)}, max_offset=50
+    )
+
+    assert sorted(matches) == ["1234_1", "1234_2"]  # No shape for route 9999
+    snapped = entities["1234_1"].vehicle.position
+    assert (snapped.latitude, snapped.longitude) == pytest.approx((13.0, 77.005), abs=1e-5)
+    assert matches["1234_1"].shape_dist_traveled == pytest.approx(distance_meters(13.0, 77.0, 13.0, 77.005), rel=1e-3)
+    off_route = entities["1234_2"].vehicle.position  # ~1 km away: published as reported
+    assert (off_route.latitude, off_route.longitude) == pytest.approx((13.01, 77.0), abs=1e-5)
+
+
+def test_raw_positions_are_published_unless_snapping_is_enabled(monkeypatch):
+    progress = VehicleProgress()
+    monkeypatch.setattr(shape_matching, "vehicle_progress", progress)
+    entities = vehicle_entities({"1234_1": (13.0002, 77.005)})
+
+    match_vehicles(entities, {"1234_1": "1234"}, index={"1234": build_shape_segments(SHAPE)}, max_offset=0)
+
+    position = entities["1234_1"].vehicle.position
+    assert (position.latitude, position.longitude) == pytest.approx((13.0002, 77.005), abs=1e-5)
+    reported = progress.report()["trips"]["1234_1"]  # Progress is reported either way
+    assert reported["progress"] == pytest.approx(distance_meters(13.0, 77.0, 13.0, 77.005) / build_shape_segments(SHAPE).total, abs=1e-3)
+    assert progress.stats["snapped"] == 0
+
+
+def test_progress_of_trips_not_matched_again_expires():
+    now = [0.0]
+    progress = VehicleProgress(ttl=60, clock=lambda: now[0])
+    segments = build_shape_segments(SHAPE)
+    progress.update({"1234_1": project(segments, [13.0], [77.005])[0]}, 0)
+    now[0] = 30
+    progress.update({"1234_2": project(segments, [13.0], [77.01])[0]}, 0)
+
+    now[0] = 61
+    assert progress.get("1234_1") is None
+    assert list(progress.report()["trips"]) == ["1234_2"]
+    progress.update({}, 0)
+    assert list(progress._matches) == ["1234_2"]  # Pruned, not just hidden
@@ -0,0 +1,124 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from google.transit import gtfs_realtime_pb2
+
+from src.shared import feed_snapshot
+from src.shared.snapshot_file import SnapshotFileWriter, MappedSnapshotStore, MappedArtifactRegistry
+from src.live_data_service.feed_entity_updater import update_feed_message
+from src.local_file_service.local_file_service import publish_static_artifacts
+from src.web_service import create_app, start_snapshot_writer, FEED_NAMES
+from src.tests.test_web_service import make_entity
+
+
+@pytest.fixture
+def writer(tmp_path, monkeypatch):
+    monkeypatch.setattr("src.shared.snapshot_file.REFRESH_INTERVAL", 0)
+    writer = start_snapshot_writer(str(tmp_path))
+    yield writer
+    writer.detach()
+
+
+def test_mapped_store_reads_published_snapshot_without_copying(writer):
+    entities = [make_entity(f"veh_{i}", trip_id=f"1234_{i}") for i in range(20)]
+    update_feed_message(entities + [make_entity("veh_x", trip_id="5678_1", route_id="5678")])
+    assert writer.flush(timeout=5)
+
+    mapped = MappedSnapshotStore(writer.feed_path("rt"))
+    snapshot = mapped.current
+    assert isinstance(snapshot.body, memoryview)
+    assert snapshot.version == feed_snapshot.current.version
+    assert snapshot.etag == feed_snapshot.current.etag
+    assert bytes(snapshot.body) == feed_snapshot.current.body
+    assert bytes(snapshot.encodings["gzip"]) == feed_snapshot.current.encodings["gzip"]
+    assert snapshot.index.select({"route_id": "5678"}) == ["veh_x"]
+
+    update_feed_message([make_entity("veh_3")])
+    assert writer.flush(timeout=5)
+    assert mapped.current.version == feed_snapshot.current.version
+
+
+@pytest.mark.asyncio
+async def test_worker_app_serves_mapped_feeds_and_artifacts(writer):
+    update_feed_message([make_entity("veh_1"), make_entity("veh_2", trip_id="5678_1", route_id="5678")])
+    publish_static_artifacts(b"zip-bytes", "v1", 1700000000)
+    assert writer.flush(timeout=5)
+
+    worker_app = create_app(
+        feeds={name: MappedSnapshotStore(writer.feed_path(name)) for name in FEED_NAMES},
+        artifacts=MappedArtifactRegistry(writer.static_path())
+    )
+    async with TestClient(TestServer(worker_app)) as client:
+        resp = await client.get("/gtfs-rt.proto", params={"route_id": "5678"})
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(await resp.read())
+        assert [e.id for e in feed.entity] == ["veh_2"]
+
+        resp = await client.get("/gtfs.zip", headers={"Range": "bytes=0-2"})
+        assert resp.status == 206
+        assert await resp.read() == b"zip"
+
+        resp = await client.get("/gtfs-version")
+        assert await resp.json() == {"version": "v1"}
+
+
+def test_publish_hands_snapshots_to_the_writer_thread(writer, monkeypatch):
+    import threading
+    from src.shared import snapshot_file
+
+    release = threading.Event()
+    written = []
+
+    def slow_write(path, snapshot):
+        release.wait(5)  # A stalled disk
+        written.append((path, snapshot.version))
+    monkeypatch.setattr(snapshot_file, "write_feed_snapshot", slow_write)
+
+    for i in range(5):
+        update_feed_message([make_entity(f"veh_{i}")])  # Returns although the disk is stalled
+    assert not written
+    release.set()
+    assert writer.flush(timeout=5)
+    rt_versions = [version for path, version in written if path == writer.feed_path("rt")]
+    assert rt_versions[-1] == feed_snapshot.current.version
+    assert len(rt_versions) < 5  # Intermediate versions were coalesced
+
+
+@pytest.mark.asyncio
+async def test_worker_serves_the_producer_reports(tmp_path, monkeypatch):
+    import time
+    from src.shared import status_providers
+    from src.shared.snapshot_file import read_report_file
+    from src.live_data_service import shape_matching
+    from src.live_data_service.shape_matching import VehicleProgress, build_shape_segments, project
+
+    monkeypatch.setattr("src.shared.snapshot_file.REPORT_INTERVAL", 0.02)
+    progress = VehicleProgress()
+    monkeypatch.setattr(shape_matching, "vehicle_progress", progress)
+    monkeypatch.setattr(shape_matching.vehicle_progress_report, "value", progress.report)
+    calls = []
+
+    def probe():
+        calls.append(1)
+        return {"calls": len(calls)}
+    status_providers["probe"] = probe
+    writer = start_snapshot_writer(str(tmp_path))
+    try:
+        progress.update({"1234_1": project(build_shape_segments([(13.0, 77.0), (13.0, 77.01)]), [13.0], [77.005])[0]}, 0)
+        for _ in range(100):  # Rewritten periodically, not just at attach
+            status = read_report_file(writer.report_path("status"))
+            if read_report_file(writer.report_path("vehicle-progress")).get("trips") and status.get("probe", {}).get("calls", 0) >= 2:
+                break
+            time.sleep(0.02)
+        worker_app = create_app(
+            feeds={name: MappedSnapshotStore(writer.feed_path(name)) for name in FEED_NAMES},
+            reports={name: lambda name=name: read_report_file(writer.report_path(name)) for name in ("status", "vehicle-progress")}
+        )
+        async with TestClient(TestServer(worker_app)) as client:
+            status = await (await client.get("/status")).json()
+            trips = (await (await client.get("/vehicle-progress")).json())["trips"]
+        assert status["probe"]["calls"] >= 2  # Written at attach, then every REPORT_INTERVAL
+        assert "live_store" in status and status["written_at"] <= time.time()
+        assert trips["1234_1"]["progress"] == pytest.approx(0.5, abs=1e-3)
+    finally:
+        writer.detach()
+        status_providers.pop("probe")
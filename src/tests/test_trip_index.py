@@ -0,0 +1,39 @@
+from src.shared.trip_index import build_trip_index
+
+
+def test_candidates_are_the_trips_around_now():
+    start_times = {
+        "KIA-10 DOWN": [{"start": 500, "duration": 60}, {"start": 900, "duration": 60}, {"start": 2330, "duration": 90}],
+        "KIA-10 UP": [{"start": 700, "duration": 60}],
+        "KIA-5 UP": [{"start": 900, "duration": 60}],
+    }
+    routes_children = {"KIA-10 DOWN": 3813, "KIA-10 UP": 3812, "KIA-5 UP": 4000}
+    routes_parent = {"KIA-10 DOWN": 2124, "KIA-10 UP": 2124, "KIA-5 UP": 1000}
+    index = build_trip_index(start_times, routes_children, routes_parent)
+
+    def candidates(hh, mm):
+        return sorted(trip.trip_id for trip in index.candidates(2124, hh * 60 + mm, 15, 30))
+
+    assert candidates(4, 50) == ["3813_1"]
+    assert candidates(6, 20) == ["3813_1"]            # 30 minutes late margin after 06:00
+    assert candidates(6, 50) == ["3812_1"]
+    assert candidates(8, 50) == ["3813_2"]            # Other parents' trips are never candidates
+    assert candidates(0, 40) == ["3813_3"]            # Started at 23:30 the day before
+    assert candidates(3, 0) == []
+
+    trip = index.candidates(2124, 9 * 60, 0, 0)[0]
+    assert trip.route_id == "3813"
+    assert (trip.trip_time.hour, trip.trip_time.minute) == (9, 0)
+
+
+def test_candidates_on_both_sides_of_midnight():
+    start_times = {"KIA-10 DOWN": [{"start": 5, "duration": 60}, {"start": 2350, "duration": 30}]}
+    index = build_trip_index(start_times, {"KIA-10 DOWN": 3813}, {"KIA-10 DOWN": 2124})
+
+    def candidates(hh, mm):
+        return sorted(trip.trip_id for trip in index.candidates(2124, hh * 60 + mm, 15, 30))
+
+    assert candidates(23, 50) == ["3813_1", "3813_2"]  # 00:05 is within the early margin
+    assert candidates(23, 58) == ["3813_1", "3813_2"]
+    assert candidates(0, 10) == ["3813_1", "3813_2"]   # 23:50 trip still running
+    assert candidates(23, 40) == ["3813_2"]
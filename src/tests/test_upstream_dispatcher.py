@@ -0,0 +1,47 @@
+import asyncio
+import pytest
+
+from src.live_data_service.upstream_dispatcher import UpstreamDispatcher, PRIORITY_ACTIVE, PRIORITY_PROBE
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_spaces_calls_by_rate():
+    loop = asyncio.get_running_loop()
+    started = []
+
+    async def fetch(parent_id):
+        started.append(loop.time())
+        return [parent_id]
+
+    dispatcher = UpstreamDispatcher(fetch, rps=20, concurrency=4)
+    results = await asyncio.gather(*(dispatcher.fetch(i) for i in range(4)))
+    await dispatcher.close()
+
+    assert results == [[0], [1], [2], [3]]
+    gaps = [b - a for a, b in zip(started, started[1:])]
+    assert all(gap >= 0.045 for gap in gaps)
+
+
+@pytest.mark.asyncio
+async def test_dispatcher_prefers_active_parents_when_saturated():
+    order = []
+    release = asyncio.Event()
+
+    async def fetch(parent_id):
+        order.append(parent_id)
+        if parent_id == "first":
+            await release.wait()
+        return []
+
+    dispatcher = UpstreamDispatcher(fetch, rps=1000, concurrency=1)
+    first = asyncio.ensure_future(dispatcher.fetch("first"))
+    await asyncio.sleep(0.01)  # "first" now holds the only slot
+
+    probe = asyncio.ensure_future(dispatcher.fetch("probe", PRIORITY_PROBE))
+    active = asyncio.ensure_future(dispatcher.fetch("active", PRIORITY_ACTIVE))
+    await asyncio.sleep(0.01)
+    release.set()
+    await asyncio.gather(first, probe, active)
+    await dispatcher.close()
+
+    assert order == ["first", "active", "probe"]
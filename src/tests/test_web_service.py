@@ -0,0 +1,235 @@
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+from google.transit import gtfs_realtime_pb2
+
+from src.web_service import create_app
+from src.live_data_service.feed_entity_updater import update_feed_message
+
+
+def make_entity(entity_id: str, trip_id: str = "1234_1", route_id: str = "1234"):
+    entity = gtfs_realtime_pb2.FeedEntity()
+    entity.id = entity_id
+    entity.trip_update.trip.trip_id = trip_id
+    entity.trip_update.trip.route_id = route_id
+    return entity
+
+
+@pytest.mark.asyncio
+async def test_realtime_feed_served_from_snapshot_with_etag():
+    update_feed_message([make_entity("veh_1")])
+
+    async with TestClient(TestServer(create_app())) as client:
+        resp = await client.get("/gtfs-rt.proto")
+        assert resp.status == 200
+        etag = resp.headers["ETag"]
+
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(await resp.read())
+        assert [e.id for e in feed.entity] == ["veh_1"]
+
+        resp = await client.get("/gtfs-rt.proto", headers={"If-None-Match": etag})
+        assert resp.status == 304
+
+        update_feed_message([make_entity("veh_2")])
+        resp = await client.get("/gtfs-rt.proto", headers={"If-None-Match": etag})
+        assert resp.status == 200
+        assert resp.headers["ETag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_realtime_feed_negotiates_precompressed_encoding():
+    update_feed_message([make_entity(f"veh_{i}", trip_id=f"1234_{i}") for i in range(50)])
+
+    async with TestClient(TestServer(create_app())) as client:
+        resp = await client.get("/gtfs-rt.proto", headers={"Accept-Encoding": "gzip"})
+        assert resp.status == 200
+        assert resp.headers["Content-Encoding"] == "gzip"
+        assert resp.headers["Vary"] == "Accept-Encoding"
+
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(await resp.read())  # The client transparently decompresses
+        assert len(feed.entity) == 50
+
+        resp = await client.get("/gtfs-rt.proto", headers={"Accept-Encoding": "gzip;q=0, identity"})
+        assert "Content-Encoding" not in resp.headers
+
+
+@pytest.mark.asyncio
+async def test_stream_sends_full_snapshot_then_differential_updates():
+    update_feed_message([make_entity("veh_1"), make_entity("veh_2", trip_id="1234_2")])
+
+    async with TestClient(TestServer(create_app())) as client:
+        ws = await client.ws_connect("/gtfs-rt/stream")
+
+        full = gtfs_realtime_pb2.FeedMessage()
+        full.ParseFromString(await ws.receive_bytes(timeout=2))
+        assert full.header.incrementality == gtfs_realtime_pb2.FeedHeader.FULL_DATASET
+        assert {e.id for e in full.entity} == {"veh_1", "veh_2"}
+
+        update_feed_message([make_entity("veh_1"), make_entity("veh_3", trip_id="1234_3")])
+
+        diff = gtfs_realtime_pb2.FeedMessage()
+        diff.ParseFromString(await ws.receive_bytes(timeout=2))
+        assert diff.header.incrementality == gtfs_realtime_pb2.FeedHeader.DIFFERENTIAL
+        changed = {e.id: e.is_deleted for e in diff.entity}
+        assert changed == {"veh_3": False, "veh_2": True}
+        await ws.close()
+
+
+@pytest.mark.asyncio
+async def test_realtime_feed_filters_by_route_trip_and_vehicle():
+    update_feed_message([
+        make_entity("veh_1", trip_id="1234_1", route_id="1234"),
+        make_entity("veh_2", trip_id="1234_2", route_id="1234"),
+        make_entity("veh_3", trip_id="5678_1", route_id="5678"),
+    ])
+
+    async def fetch_ids(client, query):
+        resp = await client.get("/gtfs-rt.proto", params=query)
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(await resp.read())
+        assert feed.header.gtfs_realtime_version == "2.0"
+        return sorted(e.id for e in feed.entity)
+
+    async with TestClient(TestServer(create_app())) as client:
+        assert await fetch_ids(client, {"route_id": "1234"}) == ["veh_1", "veh_2"]
+        assert await fetch_ids(client, {"route_id": "1234", "trip_id": "1234_2"}) == ["veh_2"]
+        assert await fetch_ids(client, {"route_id": "5678", "trip_id": "1234_2"}) == []
+        assert await fetch_ids(client, {"route_id": "unknown"}) == []
+
+        # Indexes follow entities that move between routes or disappear
+        update_feed_message([
+            make_entity("veh_1", trip_id="5678_2", route_id="5678"),
+            make_entity("veh_3", trip_id="5678_1", route_id="5678"),
+        ])
+        assert await fetch_ids(client, {"route_id": "1234"}) == []
+        assert await fetch_ids(client, {"route_id": "5678"}) == ["veh_1", "veh_3"]
+
+
+def test_feed_index_updates_share_unchanged_entries():
+    import random
+    from src.shared.feed_snapshot import EMPTY_INDEX
+
+    rng = random.Random(7)
+    index = EMPTY_INDEX
+    expected = {}
+    for _ in range(300):
+        changed = {f"veh_{rng.randrange(40)}": (("route_id", str(rng.randrange(5))),) for _ in range(3)}
+        deleted = [entity_id for entity_id in (f"veh_{rng.randrange(40)}",) if entity_id not in changed]
+        previous = index
+        index = index.updated(b"", {}, changed, deleted)
+        assert len(index.keys._layers) <= len(previous.keys._layers) + 1
+        for entity_id in deleted:
+            expected.pop(entity_id, None)
+        expected.update(changed)
+
+    assert {entity_id: index.keys.get(entity_id) for entity_id in expected} == expected
+    assert index.keys.get("veh_missing") is None
+    for route in map(str, range(5)):
+        members = {entity_id for entity_id, keys in expected.items() if keys == (("route_id", route),)}
+        assert index.buckets.get(("route_id", route), frozenset()) == members
+    assert len(index.keys._layers) <= 10  # Layers are merged, so lookups stay logarithmic
+
+
+@pytest.mark.asyncio
+async def test_filtered_request_without_index_is_refused(monkeypatch):
+    from src.shared import feed_snapshot
+
+    update_feed_message([make_entity("veh_1")])
+    monkeypatch.setattr(feed_snapshot, "_current", feed_snapshot.current._replace(index=None))
+    async with TestClient(TestServer(create_app())) as client:
+        resp = await client.get("/gtfs-rt.proto", params={"route_id": "1234"})
+        assert resp.status == 503
+        assert "Retry-After" in resp.headers
+        resp = await client.get("/gtfs-rt.proto")
+        assert resp.status == 200
+
+
+@pytest.mark.asyncio
+async def test_trip_updates_and_vehicle_positions_feeds_version_independently():
+    def make_combined(lat: float):
+        entity = make_entity("veh_1")
+        entity.trip_update.stop_time_update.add().stop_id = "s1"
+        entity.vehicle.trip.CopyFrom(entity.trip_update.trip)
+        entity.vehicle.vehicle.id = "1"
+        entity.vehicle.position.latitude = lat
+        entity.vehicle.position.longitude = 77.5
+        return entity
+
+    update_feed_message([make_combined(12.9)])
+
+    async with TestClient(TestServer(create_app())) as client:
+        resp = await client.get("/gtfs-rt/vehicle-positions.proto")
+        vp_etag = resp.headers["ETag"]
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(await resp.read())
+        assert feed.entity[0].HasField("vehicle")
+        assert not feed.entity[0].HasField("trip_update")
+
+        resp = await client.get("/gtfs-rt/trip-updates.proto")
+        tu_etag = resp.headers["ETag"]
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(await resp.read())
+        assert feed.entity[0].HasField("trip_update")
+        assert not feed.entity[0].HasField("vehicle")
+
+        # Only the coordinates moved: the vehicle feed gets a new version, trip updates keep theirs
+        update_feed_message([make_combined(13.0)])
+        resp = await client.get("/gtfs-rt/vehicle-positions.proto", headers={"If-None-Match": vp_etag})
+        assert resp.status == 200
+        resp = await client.get("/gtfs-rt/trip-updates.proto", headers={"If-None-Match": tu_etag})
+        assert resp.status == 304
+
+
+@pytest.mark.asyncio
+async def test_static_artifacts_served_from_memory_with_validators_and_ranges():
+    from src.local_file_service.local_file_service import publish_static_artifacts
+
+    zip_bytes = bytes(range(256)) * 4
+    publish_static_artifacts(zip_bytes, "abcd1234", 1700000000)
+
+    async with TestClient(TestServer(create_app())) as client:
+        resp = await client.get("/gtfs-version")
+        assert resp.status == 200
+        assert await resp.json() == {"version": "abcd1234"}
+        assert resp.headers["ETag"] == '"abcd1234"'
+
+        resp = await client.get("/gtfs-version", headers={"If-None-Match": '"abcd1234"'})
+        assert resp.status == 304
+
+        resp = await client.get("/gtfs.zip")
+        assert await resp.read() == zip_bytes
+
+        last_modified = resp.headers["Last-Modified"]
+        resp = await client.get("/gtfs.zip", headers={"If-Modified-Since": last_modified})
+        assert resp.status == 304
+
+        resp = await client.get("/gtfs.zip", headers={"Range": "bytes=10-19"})
+        assert resp.status == 206
+        assert resp.headers["Content-Range"] == f"bytes 10-19/{len(zip_bytes)}"
+        assert await resp.read() == zip_bytes[10:20]
+
+        resp = await client.get("/gtfs.zip", headers={"Range": "bytes=5000-"})
+        assert resp.status == 416
+
+
+def test_stores_publishing_the_same_body_share_its_compression(monkeypatch):
+    import sys
+    from src.shared.feed_snapshot import SnapshotStore, VariantCache
+
+    snapshot_module = sys.modules["src.shared.feed_snapshot"]  # src.shared.feed_snapshot is also the rt store
+
+    compressed = []
+    monkeypatch.setattr(snapshot_module, "compress_variants", lambda body: compressed.append(body) or {"gzip": b"z"})
+    monkeypatch.setattr(snapshot_module, "variant_cache", VariantCache(size=2))
+    body = b"x" * 1000
+
+    first = SnapshotStore("a").publish(body, 1)
+    second = SnapshotStore("b").publish(body, 1)
+    assert first.encodings is second.encodings
+    assert compressed == [body]
+
+    SnapshotStore("a").publish(b"y" * 1000, 2)
+    SnapshotStore("a").publish(b"z" * 1000, 3)  # Evicts the least recently used body
+    SnapshotStore("b").publish(body, 4)
+    assert len(compressed) == 4
@@ -1,48 +1,196 @@
 # Recreating the web_service since execution state was reset
 
-import os
+import sys
+import time
+import signal
+import multiprocessing
+from typing import Optional
+from email.utils import formatdate
 from aiohttp import web
-from src.shared import feed_message, feed_message_lock
-from threading import Lock
+from src.shared import (
+    feed_snapshot, trip_updates_snapshot, vehicle_positions_snapshot, static_artifacts, collect_status,
+    vehicle_progress_report
+)
+from src.shared.config import SNAPSHOT_DIR, DB_PATH
+from src.shared.feed_snapshot import filtered_snapshot
+from src.shared.snapshot_file import (
+    SnapshotFileWriter, MappedSnapshotStore, MappedArtifactRegistry, read_report_file
+)
+from src.web_service.feed_stream import FeedStreamHub
+from src.web_service.history import HistoryService
 
 
-app = web.Application()
 corsOrigin = "*"
 corsHeaders = "*"
+ARTIFACTS_KEY = web.AppKey("artifacts", object)  # static_artifacts, or its memory-mapped view in a worker
+REPORTS_KEY = web.AppKey("reports", dict)  # report name -> callable returning its JSON, see producer_reports
+ENCODING_PREFERENCE = ("br", "gzip")  # Tie-break order when the client weighs encodings equally
+FILTER_PARAMS = ("route_id", "trip_id", "vehicle_id")
+
+
+# === Conditional GET and content negotiation ===
+def etag_matches(request, etag: str) -> bool:
+    header = request.headers.get("If-None-Match", "")
+    tags = {tag.strip().removeprefix("W/") for tag in header.split(",") if tag.strip()}
+    return "*" in tags or etag in tags
+
+
+def choose_encoding(request, available) -> Optional[str]:
+    """
+    Picks the best pre-built Content-Encoding the client accepts, or None for identity.
+    """
+    header = request.headers.get("Accept-Encoding", "")
+    weights = {}
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        weights[name] = q
+
+    best, best_q = None, 0.0
+    for encoding in ENCODING_PREFERENCE:
+        if encoding not in available:
+            continue
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def snapshot_response(request, snapshot, content_type: str) -> web.Response:
+    """
+    Serves a pre-serialized snapshot, honouring If-None-Match and Accept-Encoding.
+    Every encoding was built when the snapshot was published, so this never compresses.
+    """
+    encoding = choose_encoding(request, snapshot.encodings)
+    etag = snapshot.etag if encoding is None else f'{snapshot.etag[:-1]}-{encoding}"'
+    if etag_matches(request, etag) or etag_matches(request, snapshot.etag):
+        response = web.Response(status=304)
+    elif encoding is None:
+        response = web.Response(body=snapshot.body, content_type=content_type)
+    else:
+        response = web.Response(body=snapshot.encodings[encoding], content_type=content_type)
+        response.headers["Content-Encoding"] = encoding
+    response.headers["ETag"] = etag
+    response.headers["Vary"] = "Accept-Encoding"
+    return response
+
+
+def not_modified_since(request, last_modified: int) -> bool:
+    try:
+        since = request.if_modified_since
+    except ValueError:
+        return False
+    return since is not None and last_modified <= since.timestamp()
+
+
+def static_response(request, artifact, allow_range: bool = False) -> web.Response:
+    """
+    Serves an in-memory StaticArtifact with ETag/Last-Modified validation and, optionally, a single byte Range.
+    If-None-Match takes precedence over If-Modified-Since, as in RFC 9110.
+    """
+    headers = {
+        "ETag": artifact.etag,
+        "Last-Modified": formatdate(artifact.last_modified, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Access-Control-Allow-Origin": corsOrigin,
+    }
+    if allow_range:
+        headers["Accept-Ranges"] = "bytes"
+
+    if "If-None-Match" in request.headers:
+        if etag_matches(request, artifact.etag):
+            return web.Response(status=304, headers=headers)
+    elif not_modified_since(request, artifact.last_modified):
+        return web.Response(status=304, headers=headers)
+
+    body = artifact.body
+    if allow_range and "Range" in request.headers and request.headers.get("If-Range", artifact.etag) == artifact.etag:
+        try:
+            byte_range = request.http_range
+            start, stop, _ = byte_range.indices(len(body))
+        except ValueError:
+            start, stop = 0, 0
+        if start >= stop:
+            headers["Content-Range"] = f"bytes */{len(body)}"
+            return web.Response(status=416, headers=headers)
+        headers["Content-Range"] = f"bytes {start}-{stop - 1}/{len(body)}"
+        return web.Response(
+            status=206, body=memoryview(body)[start:stop], content_type=artifact.content_type, headers=headers
+        )
+
+    return web.Response(body=body, content_type=artifact.content_type, headers=headers)
+
 
 # === Serve GTFS Static zip ===
 async def handle_gtfs_zip(request):
-    zip_path = "../out/gtfs.zip"
-    if not os.path.exists(zip_path):
+    artifact = request.app[ARTIFACTS_KEY].get("gtfs.zip")
+    if artifact is None:
         return web.Response(status=404, text="GTFS ZIP not found.")
-    response = web.FileResponse(zip_path)
+    response = static_response(request, artifact, allow_range=True)
     response.headers["Content-Disposition"] = "attachment; filename=gtfs.zip"
-    response.headers["Access-Control-Allow-Origin"] = corsOrigin
     return response
 
 
-# === Serve GTFS Realtime Feed ===
-async def handle_gtfs_realtime(request):
-    with feed_message_lock:
-        binary = feed_message.SerializeToString()
-    response = web.Response(body=binary, content_type="application/x-protobuf")
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
-    response.headers["Access-Control-Allow-Origin"] = corsOrigin
-    return response
+# === Serve GTFS Realtime Feeds ===
+def realtime_handler(store):
+    """
+    Builds a handler serving the current snapshot of store, optionally filtered by FILTER_PARAMS.
+    """
+    async def handle(request):
+        snapshot = store.current  # Immutable, already serialized and compressed by the publisher
+        filters = {key: request.query[key] for key in FILTER_PARAMS if key in request.query}
+        if filters:
+            if snapshot.index is None:  # Never answer a filtered request with the whole feed
+                return web.json_response(
+                    {"error": "filtering is unavailable for this feed version"}, status=503,
+                    headers={"Retry-After": "5", "Access-Control-Allow-Origin": corsOrigin}
+                )
+            snapshot = filtered_snapshot(snapshot, filters)
+        response = snapshot_response(request, snapshot, "application/x-protobuf")
+        response.headers["Cache-Control"] = "no-cache, must-revalidate"
+        response.headers["Pragma"] = "no-cache"
+        response.headers["Expires"] = "0"
+        response.headers["Access-Control-Allow-Origin"] = corsOrigin
+        return response
+    return handle
+
 
 
 # === Serve GTFS Version Info ===
 async def handle_gtfs_version(request):
-    version_file = "../out/feed_info.txt"
-    if not os.path.exists(version_file):
+    artifact = request.app[ARTIFACTS_KEY].get("gtfs-version")
+    if artifact is None:
         return web.json_response({"error": "version file not found"}, status=404)
+    return static_response(request, artifact)
+
+
+# === JSON reports ===
+def producer_reports() -> dict:
+    """
+    The JSON reports of the producer process, by name:
+      status            upstream breaker, dispatcher, writer and matching state
+      vehicle-progress  {"trips": {trip_id: {"shape_dist_traveled", "progress", "offset"}}} of live vehicles
+    Worker processes serve the copies the producer writes next to the feed snapshots every REPORT_INTERVAL;
+    their written_at tells how old they are.
+    """
+    return {"status": collect_status, "vehicle-progress": lambda: vehicle_progress_report.get()()}
+
 
-    with open(version_file, "r") as f:
-        version = f.read().strip()
-    response = web.json_response({"version": version})
-    response.headers["Cache-Control"] = "no-store"
+def report_handler(name: str):
+    async def handle(request):
+        response = web.json_response(request.app[REPORTS_KEY][name]())
+        response.headers["Cache-Control"] = "no-store"
+        return response
+    return handle
 
 
 # === Enable CORS support for browser restrictions ===
@@ -56,12 +204,99 @@ async def handle_options(request):
 
 
 # === Routes ===
-app.router.add_get("/gtfs.zip", handle_gtfs_zip)
-app.router.add_get("/gtfs-rt.proto", handle_gtfs_realtime)
-app.router.add_get("/gtfs-version", handle_gtfs_version)
-app.router.add_options("/{tail:.*}", handle_options)
+def create_app(feeds: dict = None, artifacts=None, history_path: str = DB_PATH, reports: dict = None) -> web.Application:
+    """
+    feeds maps "rt", "tu" and "vp" to snapshot stores; by default the in-process ones.
+    history_path is the SQLite database the /history endpoints read (read-only).
+    reports maps the names in producer_reports to callables; by default this process's.
+    """
+    if feeds is None:
+        feeds = {"rt": feed_snapshot, "tu": trip_updates_snapshot, "vp": vehicle_positions_snapshot}
+    app = web.Application()
+    app[ARTIFACTS_KEY] = static_artifacts if artifacts is None else artifacts
+    app[REPORTS_KEY] = producer_reports() if reports is None else reports
+    stream_hub = FeedStreamHub(feeds["rt"])
+    app.on_startup.append(stream_hub.on_startup)
+    app.on_cleanup.append(stream_hub.on_cleanup)
+    history = HistoryService(history_path)
+    app.on_startup.append(history.on_startup)
+    app.on_cleanup.append(history.on_cleanup)
+
+    app.router.add_get("/gtfs.zip", handle_gtfs_zip)
+    app.router.add_get("/gtfs-rt.proto", realtime_handler(feeds["rt"]))
+    app.router.add_get("/gtfs-rt/trip-updates.proto", realtime_handler(feeds["tu"]))
+    app.router.add_get("/gtfs-rt/vehicle-positions.proto", realtime_handler(feeds["vp"]))
+    app.router.add_get("/gtfs-rt/stream", stream_hub.handle)
+    app.router.add_get("/gtfs-version", handle_gtfs_version)
+    app.router.add_get("/history/route/{id}", history.handle_route)
+    app.router.add_get("/history/stop/{id}", history.handle_stop)
+    app.router.add_get("/status", report_handler("status"))
+    app.router.add_get("/vehicle-progress", report_handler("vehicle-progress"))
+    app.router.add_options("/{tail:.*}", handle_options)
+    return app
+
 
 # === Run Server ===
 def run_web_service(host="0.0.0.0", port=59966):
     print(f"[web_service] Serving on http://{host}:{port}")
-    web.run_app(app, host=host, port=port)
+    web.run_app(create_app(), host=host, port=port)
+
+
+# === Multi-worker mode ===
+FEED_NAMES = ("rt", "tu", "vp")
+
+
+def start_snapshot_writer(snapshot_dir: str = SNAPSHOT_DIR) -> SnapshotFileWriter:
+    """
+    Called in the producer process: mirrors every feed and static publish, and the JSON reports, into
+    snapshot files.
+    """
+    import src.shared as rt_state
+    writer = SnapshotFileWriter(snapshot_dir)
+    writer.attach(
+        {"rt": feed_snapshot, "tu": trip_updates_snapshot, "vp": vehicle_positions_snapshot},
+        static_artifacts, rt_state.static_artifact_listeners, reports=producer_reports()
+    )
+    return writer
+
+
+def run_web_worker(host: str, port: int, snapshot_dir: str):
+    """
+    Entry point of a worker process: serves the memory-mapped snapshots on a port shared via SO_REUSEPORT.
+    """
+    writer = SnapshotFileWriter(snapshot_dir)
+    worker_app = create_app(
+        feeds={name: MappedSnapshotStore(writer.feed_path(name)) for name in FEED_NAMES},
+        artifacts=MappedArtifactRegistry(writer.static_path()),
+        reports={name: lambda name=name: read_report_file(writer.report_path(name)) for name in producer_reports()}
+    )
+    web.run_app(worker_app, host=host, port=port, reuse_port=True, print=None)
+
+
+def run_web_workers(workers: int, host="0.0.0.0", port=59966, snapshot_dir: str = SNAPSHOT_DIR):
+    """
+    Runs workers web processes on one port and restarts any that exit. Blocks forever.
+    """
+    context = multiprocessing.get_context("spawn")  # Never fork the producer's threads
+    print(f"[web_service] Serving on http://{host}:{port} with {workers} workers")
+
+    def spawn():
+        process = context.Process(target=run_web_worker, args=(host, port, snapshot_dir), daemon=True)
+        process.start()
+        return process
+
+    # Turn SIGTERM into SystemExit so the finally block below stops the workers too
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    processes = [spawn() for _ in range(workers)]
+    try:
+        while True:
+            for i, process in enumerate(processes):
+                if not process.is_alive():
+                    print(f"[web_service] Worker {process.pid} exited with {process.exitcode}; restarting")
+                    processes[i] = spawn()
+            time.sleep(1)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join(timeout=5)
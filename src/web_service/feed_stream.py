@@ -0,0 +1,82 @@
+import os
+import asyncio
+from aiohttp import web, WSCloseCode, WSMsgType
+
+STREAM_MAX_PENDING = int(os.getenv("KIA_STREAM_MAX_PENDING", 8))  # queued updates per client before dropping it
+STREAM_HEARTBEAT = float(os.getenv("KIA_STREAM_HEARTBEAT", 30))  # seconds
+
+
+class FeedStreamHub:
+    """
+    Pushes a SnapshotStore to WebSocket subscribers.
+    A new subscriber gets the FULL_DATASET snapshot, then the DIFFERENTIAL message of every later version.
+    Each message was encoded once by the publisher and the same bytes object is shared by all subscribers.
+    """
+
+    def __init__(self, store, max_pending: int = STREAM_MAX_PENDING):
+        self.store = store
+        self.max_pending = max_pending
+        self._loop = None
+        self._subscribers = {}  # WebSocketResponse -> asyncio.Queue of snapshots
+
+    async def on_startup(self, app):
+        self._loop = asyncio.get_running_loop()
+        self.store.add_listener(self._on_publish)
+
+    async def on_cleanup(self, app):
+        self.store.remove_listener(self._on_publish)
+        for ws in list(self._subscribers):
+            await ws.close(code=WSCloseCode.GOING_AWAY, message=b"Server shutdown")
+        self._subscribers.clear()
+
+    def _on_publish(self, snapshot):
+        # Runs on the publisher's thread; hand off to the web loop
+        loop = self._loop
+        if loop is None or loop.is_closed():
+            return
+        try:
+            loop.call_soon_threadsafe(self._fan_out, snapshot)
+        except RuntimeError:
+            pass  # Loop shutting down
+
+    def _fan_out(self, snapshot):
+        for ws, queue in list(self._subscribers.items()):
+            try:
+                queue.put_nowait(snapshot)
+            except asyncio.QueueFull:
+                # Slow consumer: drop it rather than buffering without bound or stalling everyone else
+                print(f"[Stream] Dropping slow subscriber {id(ws)} at version {snapshot.version}")
+                self._subscribers.pop(ws, None)
+                asyncio.ensure_future(ws.close(code=WSCloseCode.TRY_AGAIN_LATER, message=b"Subscriber too slow"))
+
+    async def handle(self, request):
+        ws = web.WebSocketResponse(heartbeat=STREAM_HEARTBEAT)
+        await ws.prepare(request)
+
+        # Subscribe before reading the snapshot so no version published in between is missed
+        queue = asyncio.Queue(maxsize=self.max_pending)
+        self._subscribers[ws] = queue
+        sender = asyncio.ensure_future(self._send_updates(ws, queue))
+        try:
+            async for msg in ws:  # Drain client frames so close and ping are processed
+                if msg.type == WSMsgType.ERROR:
+                    break
+        finally:
+            self._subscribers.pop(ws, None)
+            sender.cancel()
+        return ws
+
+    async def _send_updates(self, ws, queue):
+        snapshot = self.store.current
+        await ws.send_bytes(snapshot.body)
+        last_version = snapshot.version
+
+        while not ws.closed:
+            snapshot = await queue.get()
+            if snapshot.version <= last_version:
+                continue  # Already covered by the full snapshot sent on connect
+            if snapshot.version == last_version + 1 and snapshot.diff is not None:
+                await ws.send_bytes(snapshot.diff)
+            else:
+                await ws.send_bytes(snapshot.body)  # Missed a version (reordered publish); resync with a full dataset
+            last_version = snapshot.version
@@ -0,0 +1,220 @@
+import os
+import json
+import queue
+import base64
+import sqlite3
+import asyncio
+import threading
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+from aiohttp import web
+
+from src.shared.delay_model import delay_minutes_sql
+
+POOL_SIZE = int(os.getenv("KIA_HISTORY_POOL_SIZE", 4))      # read-only connections (and threads) per process
+PAGE_SIZE = int(os.getenv("KIA_HISTORY_PAGE_SIZE", 200))    # rows per page by default
+MAX_PAGE_SIZE = 1000
+STREAM_CHUNK = 100  # rows per fetch and write
+WRITE_TIMEOUT = 60  # seconds a pool thread waits on a client to take one chunk
+DEFAULT_DAYS = int(os.getenv("KIA_HISTORY_DEFAULT_DAYS", 30))  # range when from= is omitted
+ON_TIME_MINUTES = int(os.getenv("KIA_ON_TIME_MINUTES", 5))  # |arrival delay| counted as on time
+
+DELAY = delay_minutes_sql("actual_arrival", "scheduled_arrival")
+STATS = f"""
+    COUNT(*) AS samples,
+    ROUND(AVG({DELAY}), 2) AS mean_delay,
+    MIN({DELAY}) AS min_delay,
+    MAX({DELAY}) AS max_delay,
+    ROUND(AVG(ABS({DELAY}) <= :on_time), 3) AS on_time
+"""
+# Both queries walk a covering index in (key, date, group) order, so GROUP BY and the cursor need no sort
+QUERIES = {
+    "route": f"""
+        SELECT date, stop_id AS key, {STATS}
+        FROM completed_stop_times INDEXED BY completed_stop_times_route_history
+        WHERE route_id = :id AND date BETWEEN :start AND :end AND (date, stop_id) > (:after_date, :after_key)
+        GROUP BY date, stop_id ORDER BY date, stop_id LIMIT :limit
+    """,
+    "stop": f"""
+        SELECT date, route_id AS key, {STATS}
+        FROM completed_stop_times INDEXED BY completed_stop_times_stop_history
+        WHERE stop_id = :id AND date BETWEEN :start AND :end AND (date, route_id) > (:after_date, :after_key)
+        GROUP BY date, route_id ORDER BY date, route_id LIMIT :limit
+    """,
+}
+GROUP_NAMES = {"route": "stop_id", "stop": "route_id"}
+
+
+class ReadOnlyPool:
+    """
+    Fixed set of read-only SQLite connections used from a dedicated thread pool, so history
+    queries never run on the event loop and can never take a write lock from the db_writer.
+    The threads are only created by start(), from the app's on_startup.
+    """
+
+    def __init__(self, path: str, size: int = POOL_SIZE):
+        self.path = path
+        self.size = size
+        self._connections = queue.Queue()
+        self._opened = 0
+        self._lock = threading.Lock()  # Guards _opened across pool threads
+        self._executor = None
+
+    def start(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.size, thread_name_prefix="history")
+
+    def _acquire(self):
+        with self._lock:
+            try:
+                return self._connections.get_nowait()
+            except queue.Empty:
+                opening = self._opened < self.size
+                if opening:
+                    self._opened += 1
+        if not opening:
+            return self._connections.get()
+        try:
+            return sqlite3.connect(f"file:{self.path}?mode=ro", uri=True, check_same_thread=False)
+        except sqlite3.Error:
+            with self._lock:
+                self._opened -= 1
+            raise
+
+    def _call(self, fn, args):
+        conn = self._acquire()
+        try:
+            return fn(conn, *args)
+        finally:
+            self._connections.put(conn)
+
+    async def run(self, fn, *args):
+        """
+        Runs fn(connection, *args) on a pool thread.
+        """
+        return await asyncio.get_running_loop().run_in_executor(self._executor, self._call, fn, args)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+        while not self._connections.empty():
+            self._connections.get_nowait().close()
+
+
+def encode_cursor(row_date: str, key: str) -> str:
+    return base64.urlsafe_b64encode(json.dumps([row_date, key]).encode()).decode()
+
+
+def decode_cursor(cursor: str):
+    row_date, key = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return str(row_date), str(key)
+
+
+def stream_history(conn, kind: str, params: dict, send):
+    """
+    Runs the history query and hands its rows to send(rows) STREAM_CHUNK at a time, starting once
+    the query has succeeded (with an empty list if nothing matched). Returns the cursor of the next
+    page, or None on the last one.
+    """
+    conn.row_factory = sqlite3.Row
+    cursor = conn.execute(QUERIES[kind], params)
+    group = GROUP_NAMES[kind]
+    count = 0
+    last = None
+    try:
+        while True:
+            rows = [dict(row) for row in cursor.fetchmany(STREAM_CHUNK)]
+            for row in rows:
+                row[group] = row.pop("key")
+            if rows or not count:
+                send(rows)
+            count += len(rows)
+            last = rows[-1] if rows else last
+            if len(rows) < STREAM_CHUNK:
+                break
+    finally:
+        cursor.close()
+    return encode_cursor(last["date"], last[group]) if count == params["limit"] else None
+
+
+def parse_history_params(request) -> dict:
+    """
+    Reads from/to (YYYY-MM-DD), after (cursor) and limit, raising HTTPBadRequest on invalid input.
+    """
+    try:
+        end = date.fromisoformat(request.query["to"]) if "to" in request.query else date.today()
+        start = date.fromisoformat(request.query["from"]) if "from" in request.query else end - timedelta(days=DEFAULT_DAYS)
+        limit = min(max(int(request.query.get("limit", PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        after_date, after_key = decode_cursor(request.query["after"]) if "after" in request.query else ("", "")
+    except (ValueError, TypeError):
+        raise web.HTTPBadRequest(text="from/to must be YYYY-MM-DD, limit an integer and after a cursor from a previous page")
+    return {
+        "id": request.match_info["id"], "start": start.isoformat(), "end": end.isoformat(),
+        "after_date": after_date, "after_key": after_key, "limit": limit, "on_time": ON_TIME_MINUTES,
+    }
+
+
+class HistoryService:
+    """
+    Serves /history/route/{id} (per day and stop) and /history/stop/{id} (per day and route) from
+    completed_stop_times. Queries run on the read-only pool, whose thread fetches STREAM_CHUNK rows
+    at a time and waits for each chunk to be written, so a page is never held in memory whole. It
+    ends with "next", the cursor of the following page, or null on the last one.
+    """
+
+    def __init__(self, path: str, pool_size: int = POOL_SIZE):
+        self.pool = ReadOnlyPool(path, pool_size)
+
+    async def on_startup(self, app):
+        self.pool.start()
+
+    async def on_cleanup(self, app):
+        self.pool.close()
+
+    async def handle_route(self, request):
+        return await self._serve(request, "route")
+
+    async def handle_stop(self, request):
+        return await self._serve(request, "stop")
+
+    async def _serve(self, request, kind: str):
+        params = parse_history_params(request)
+        loop = asyncio.get_running_loop()
+        response = web.StreamResponse(headers={
+            "Content-Type": "application/json", "Cache-Control": "max-age=60",
+        })
+        response.enable_chunked_encoding()
+        abandoned = threading.Event()
+
+        async def write_rows(rows):
+            chunk = ", ".join(json.dumps(row) for row in rows).encode()
+            if not response.prepared:
+                await response.prepare(request)
+                header = {kind + "_id": params["id"], "from": params["start"], "to": params["end"],
+                          "on_time_minutes": ON_TIME_MINUTES}
+                await response.write(json.dumps(header)[:-1].encode() + b', "rows": [' + chunk)
+            elif chunk:
+                await response.write(b", " + chunk)
+
+        def send(rows):
+            # Runs on the pool thread, which waits for the write so a slow client holds back the cursor
+            if abandoned.is_set():
+                raise ConnectionResetError("history request was cancelled")
+            asyncio.run_coroutine_threadsafe(write_rows(rows), loop).result(WRITE_TIMEOUT)
+
+        try:
+            next_cursor = await self.pool.run(stream_history, kind, params, send)
+        except sqlite3.Error as e:
+            print(f"[History] Query failed: {e}")
+            if response.prepared:
+                raise
+            raise web.HTTPServiceUnavailable(text="History database unavailable")
+        except asyncio.CancelledError:
+            abandoned.set()
+            raise
+
+        await response.write(f'], "next": {json.dumps(next_cursor)}}}'.encode())
+        await response.write_eof()
+        return response